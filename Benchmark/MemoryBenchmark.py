@@ -0,0 +1,124 @@
+"""
+常驻内存基准：用模拟K线跑完整的缠论计算，统计每根K线平均占用的字节数，超过预算则返回非0
+    python -m Benchmark.MemoryBenchmark [bar_cnt] [--columnar]
+
+每根K线的内存 = tracemalloc 统计的计算前后常驻内存之差 / K线数量（计算结束后先 gc，不含临时对象）
+同时按类统计对象图里各类对象的个数和大小（实例本身 + __dict__），方便定位是谁变大了
+"""
+import argparse
+import contextlib
+import gc
+import io
+import sys
+import tracemalloc
+from collections import defaultdict
+from enum import Enum
+from types import FunctionType, MethodType, ModuleType
+from typing import Dict, List, Tuple
+
+from Bi.Bi import CBi
+from BuySellPoint.BS_Point import CBSPoint
+from Chan import CChan
+from ChanConfig import CChanConfig
+from Common.CEnum import KL_TYPE
+from KLine.KLine import CKLine
+from Seg.Eigen import CEigen
+from Seg.Seg import CSeg
+from ZS.ZS import CZS
+
+SYNTHETIC_SRC = "custom:SyntheticAPI.CSyntheticAPI"
+DEFAULT_BAR_CNT = 20000
+
+# 场景名 -> (配置, 每根K线内存预算（字节）)
+# 预算 = 实测值留出约10%余量，优化之后应同步调小，防止内存占用悄悄回涨
+MEMORY_SCENARIOS: Dict[str, Tuple[dict, float]] = {
+    "default": ({}, 3050),
+    "columnar": ({"kl_columnar": True}, 1620),
+}
+
+# 数量多的元素类都用 __slots__，不能有 __dict__（子类新增属性忘记加进 __slots__ 时会出现 __dict__）
+SLOTTED_CLASSES = [CKLine, CEigen, CBi, CSeg, CZS, CBSPoint]
+
+
+def run_chan(code: str, conf: dict, lv_list=None) -> CChan:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return CChan(
+            code=code,
+            data_src=SYNTHETIC_SRC,
+            lv_list=[KL_TYPE.K_DAY] if lv_list is None else lv_list,
+            config=CChanConfig(dict({"print_warning": False}, **conf)),
+        )
+
+
+def measure_bytes_per_bar(code: str, conf: dict, lv_list=None) -> Tuple[float, CChan]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        chan = run_chan(code, conf, lv_list)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    bar_cnt = sum(len(list(chan[lv].klu_iter())) for lv in chan.lv_list)
+    return current / bar_cnt, chan
+
+
+def audit_objects(root) -> List[Tuple[str, int, int]]:
+    """
+    从 root 出发遍历对象图，按类型统计 (类型名, 个数, 字节数)，按字节数从大到小排序
+    实例的 __dict__ 算在实例所属的类上；类，函数，模块，枚举等共享对象不统计
+    """
+    cnt: Dict[str, int] = defaultdict(int)
+    size: Dict[str, int] = defaultdict(int)
+    seen = {id(root)}
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        name = type(obj).__name__
+        cnt[name] += 1
+        size[name] += sys.getsizeof(obj)
+        obj_dict = getattr(obj, "__dict__", None) if not isinstance(obj, type) else None
+        if obj_dict is not None and id(obj_dict) not in seen:
+            seen.add(id(obj_dict))
+            size[name] += sys.getsizeof(obj_dict)
+            children = gc.get_referents(obj_dict) + [v for v in gc.get_referents(obj) if v is not obj_dict]
+        else:
+            children = gc.get_referents(obj)
+        for child in children:
+            if id(child) in seen or isinstance(child, (type, ModuleType, FunctionType, MethodType, Enum)):
+                continue
+            seen.add(id(child))
+            stack.append(child)
+    return sorted(((name, cnt[name], size[name]) for name in cnt), key=lambda item: -item[2])
+
+
+def parse_size(size: str) -> int:
+    return int(float(size))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="chan.py 每根K线常驻内存的预算检查")
+    parser.add_argument("bar_cnt", nargs="?", type=parse_size, default=DEFAULT_BAR_CNT, help=f"模拟K线数量，可以写成 1e5 这种形式，默认{DEFAULT_BAR_CNT}")
+    parser.add_argument("--columnar", action="store_true", help="只跑 kl_columnar 的场景")
+    args = parser.parse_args(argv)
+
+    bar_cnt = args.bar_cnt
+    exceed = False
+    for cls in SLOTTED_CLASSES:
+        if cls.__dictoffset__ != 0:
+            print(f"[EXCEED] {cls.__name__} has __dict__, check __slots__ of its bases")
+            exceed = True
+    for name, (conf, budget) in MEMORY_SCENARIOS.items():
+        if args.columnar and not conf.get("kl_columnar"):
+            continue
+        bytes_per_bar, chan = measure_bytes_per_bar(f"rw:1:{bar_cnt}", conf)
+        status = "OK" if bytes_per_bar <= budget else "EXCEED"
+        exceed |= bytes_per_bar > budget
+        print(f"[{status}] {name}: {bytes_per_bar:.0f} bytes/bar (budget {budget:.0f}), bars={bar_cnt}")
+        for type_name, type_cnt, type_size in audit_objects(chan)[:12]:
+            print(f"    {type_name:<24}{type_cnt:>10}{type_size/bar_cnt:>10.1f} bytes/bar")
+    return 1 if exceed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+端到端性能基准：用确定性的模拟K线（参见 SyntheticData.py）跑完整的缠论计算，分阶段统计耗时，结果输出为json
+    python -m Benchmark.PipelineBenchmark [--kinds rw,trend,range,gap,flat] [--sizes 1000,10000] [--modes batch,step] [--repeat 3]
+                                          [--output result.json] [--baseline old.json] [--tolerance 0.2]
+K线数量可以写成 1e6 这种形式，默认只跑1e3和1e4，1e5及以上（step模式尤其慢）需要手动指定；1e6根K线默认配置下常驻内存约3GB，可以加上 --conf '{"kl_columnar": true}' --no-deepcopy
+
+每个场景（数据类型/K线数量/计算模式）：
+    不统计阶段跑 repeat 遍，取最快的一遍作为总耗时 total，用于和 baseline 比较
+    再配置 profile=True 跑一遍，用 CChan.get_profile() 的 self_time（不含嵌套调用的其它阶段）按 PROFILE_STAGE 汇总各阶段的耗时和调用次数，
+    没有覆盖到的（读数据，检查点等）算在 other 里
+然后对算完的 CChan 统计 deepcopy 和生成画图元数据（CChanPlotMeta）的耗时，deepcopy 失败（递归太深）或者 --no-deepcopy 时记为 null
+指定 --baseline 时，total 比 baseline 里同一场景慢超过 tolerance 的返回非0
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import platform
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from Chan import CChan
+from ChanConfig import CChanConfig
+from Common.CEnum import KL_TYPE
+from Plot.PlotMeta import CChanPlotMeta
+
+from .SyntheticData import SYNTHETIC_KINDS
+
+SYNTHETIC_SRC = "custom:SyntheticAPI.CSyntheticAPI"
+DEFAULT_SIZES = [1000, 10000]
+MODES = ["batch", "step"]
+STAGES = ["combine", "fx", "bi", "seg", "segseg", "zs", "bsp", "indicator"]
+DEEPCOPY_RECURSION_LIMIT = 1000000
+DEEPCOPY_STACK_SIZE = 1 << 30
+DEFAULT_CONF = {"print_warning": False, "bs_type": "1,1p,2,2s,3a,3b"}
+
+
+# CKLineProfiler 的阶段 -> 这里汇总的阶段，参见 KLine_List.run_stage
+PROFILE_STAGE = {
+    "kl_combine": "combine",
+    "update_fx": "fx",
+    "update_bi": "bi",
+    "virtual_bi": "bi",
+    "cal_seg": "seg",
+    "cal_segseg": "segseg",
+    "cal_bi_zs": "zs",
+    "update_zs_in_seg": "zs",
+    "cal_segzs": "zs",
+    "update_zs_in_segseg": "zs",
+    "cal_bsp": "bsp",
+    "cal_seg_bsp": "bsp",
+    "set_metric": "indicator",
+    "cal_batch_metric": "indicator",
+}
+
+
+def run_chan(code: str, mode: str, conf: dict) -> CChan:
+    config = CChanConfig(dict(DEFAULT_CONF, trigger_step=(mode == "step"), **conf))
+    with contextlib.redirect_stdout(io.StringIO()):
+        chan = CChan(code=code, data_src=SYNTHETIC_SRC, lv_list=[KL_TYPE.K_DAY], config=config)
+        if mode == "step":
+            for _ in chan.step_load():
+                pass
+    return chan
+
+
+def timeit(func):
+    begin = time.perf_counter()
+    res = func()
+    return time.perf_counter() - begin, res
+
+
+def deepcopy_cost(chan: CChan) -> Optional[float]:
+    # 笔/线段等之间前后互相引用，K线多了deepcopy递归很深，放到栈足够大的线程里跑；仍然失败时返回None
+    res = {}
+
+    def run():
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(DEEPCOPY_RECURSION_LIMIT)
+        try:
+            res["cost"], _ = timeit(lambda: copy.deepcopy(chan))
+        except RecursionError:
+            res["cost"] = None
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+    stack_size = threading.stack_size(DEEPCOPY_STACK_SIZE)
+    try:
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(stack_size)
+    return res.get("cost")
+
+
+def bench_scenario(kind: str, bar_cnt: int, mode: str, seed=1, conf: Optional[dict] = None, repeat=1, with_deepcopy=True) -> dict:
+    code = f"{kind}:{seed}:{bar_cnt}"
+    conf = conf or {}
+    total = min(timeit(lambda: run_chan(code, mode, conf))[0] for _ in range(repeat))
+    instrumented_total, chan = timeit(lambda: run_chan(code, mode, dict(conf, profile=True)))
+    stages: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+    calls: Dict[str, int] = {stage: 0 for stage in STAGES}
+    for profile_stage, item in chan.get_profile()[KL_TYPE.K_DAY.name]["stages"].items():
+        if (stage := PROFILE_STAGE.get(profile_stage)) is not None:
+            stages[stage] += item["self_time"]
+            calls[stage] += item["calls"]
+    stages["other"] = instrumented_total - sum(stages.values())
+    plot_meta_cost, _ = timeit(lambda: CChanPlotMeta(chan[0]))
+    return {
+        "kind": kind,
+        "bar_cnt": bar_cnt,
+        "mode": mode,
+        "seed": seed,
+        "conf": conf,
+        "total": total,
+        "bars_per_sec": bar_cnt / total,
+        "instrumented_total": instrumented_total,
+        "stages": stages,
+        "calls": calls,
+        "deepcopy": deepcopy_cost(chan) if with_deepcopy else None,
+        "plot_meta": plot_meta_cost,
+        "result": {
+            "klc": len(chan[0].lst),
+            "bi": len(chan[0].bi_list),
+            "seg": len(chan[0].seg_list),
+            "zs": len(chan[0].zs_list),
+            "bsp": len(chan[0].bs_point_lst.lst),
+        },
+    }
+
+
+def scenario_key(item: dict):
+    return item["kind"], item["bar_cnt"], item["mode"], item["seed"], json.dumps(item["conf"], sort_keys=True)
+
+
+def compare_baseline(results: List[dict], baseline: List[dict], tolerance: float) -> bool:
+    # 返回是否有场景变慢
+    baseline_dict = {scenario_key(item): item for item in baseline}
+    regress = False
+    for item in results:
+        if (old := baseline_dict.get(scenario_key(item))) is None:
+            continue
+        ratio = item["total"] / old["total"]
+        status = "REGRESS" if ratio > 1 + tolerance else "OK"
+        regress |= ratio > 1 + tolerance
+        print(f"[{status}] {item['kind']}:{item['bar_cnt']} {item['mode']}: {old['total']:.3f}s -> {item['total']:.3f}s ({ratio:.2f}x)")
+        if item["result"] != old["result"]:
+            print(f"    result changed: {old['result']} -> {item['result']}")
+    return regress
+
+
+def print_result(item: dict):
+    deepcopy_str = "-" if item["deepcopy"] is None else f"{item['deepcopy']:.3f}s"
+    print(f"{item['kind']}:{item['bar_cnt']} {item['mode']}: total {item['total']:.3f}s ({item['bars_per_sec']:.0f} bars/s), "
+          f"deepcopy {deepcopy_str}, plot_meta {item['plot_meta']:.3f}s")
+    instrumented_total = item["instrumented_total"]
+    for stage, cost in item["stages"].items():
+        print(f"    {stage:<12}{cost:>10.3f}s{cost/instrumented_total:>8.1%}{item['calls'].get(stage, ''):>12}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="chan.py 端到端性能基准")
+    parser.add_argument("--kinds", default=",".join(SYNTHETIC_KINDS))
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="不统计阶段跑几遍，总耗时取最快的一遍")
+    parser.add_argument("--no-deepcopy", action="store_true", help="不统计deepcopy（K线很多时deepcopy需要双倍内存）")
+    parser.add_argument("--conf", default="{}", help="额外的CChanConfig配置，json格式")
+    parser.add_argument("--output", default=None, help="结果写入的json文件")
+    parser.add_argument("--baseline", default=None, help="之前的结果文件，用来检查性能回退")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.modes.split(","):
+        for bar_cnt in [int(float(size)) for size in args.sizes.split(",")]:
+            for kind in args.kinds.split(","):
+                item = bench_scenario(kind, bar_cnt, mode, args.seed, json.loads(args.conf), args.repeat, not args.no_deepcopy)
+                print_result(item)
+                results.append(item)
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        return 1 if compare_baseline(results, baseline, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
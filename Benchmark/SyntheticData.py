@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from Common.CEnum import DataField, KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+from Common.CTime import CTime
+from KLine.KLine_Unit import CKLine_Unit
+
+BEGIN_TIME = datetime(2000, 1, 4)
+KL_STEP_MINUTES = {
+    KL_TYPE.K_1M: 1,
+    KL_TYPE.K_3M: 3,
+    KL_TYPE.K_5M: 5,
+    KL_TYPE.K_15M: 15,
+    KL_TYPE.K_30M: 30,
+    KL_TYPE.K_60M: 60,
+    KL_TYPE.K_DAY: 24*60,
+    KL_TYPE.K_WEEK: 7*24*60,
+}
+
+
+SYNTHETIC_KINDS = ["rw", "trend", "range", "gap", "flat"]
+
+
+def gen_ohlcv(kind: str, seed: int, n: int) -> dict:
+    """
+    生成确定性的模拟K线，相同的 kind/seed/n 结果永远相同
+    kind:
+        rw 随机游走，价格超出初始价格的 0.05~50 倍时反向
+        trend 分段趋势，每段几十到几百根K线，方向和斜率随机
+        range 均值回归，长期在一个区间里震荡
+        gap 随机游走，且经常跳空开盘
+        flat 随机游走，夹杂大量一字K线（开高低收相同，价格等于前一根的最高或最低价，经常连续出现），覆盖K线合并里一字K线的特殊处理
+    返回 open/high/low/close/volume 五个长度为n的数组
+    """
+    rnd = np.random.default_rng(seed)
+    gap = np.zeros(n)
+    if kind == "rw":
+        ret = reflect(rnd.normal(0, 0.01, n), np.log(0.05), np.log(50))
+    elif kind == "gap":
+        noise = rnd.normal(0, 0.01, n)
+        gap = np.where(rnd.random(n) < 0.15, rnd.normal(0, 0.03, n), 0.0)  # 开盘相对前收盘的跳空
+        ret = mean_revert(noise+gap, 0.001) - gap
+    elif kind == "flat":
+        ret = mean_revert(rnd.normal(0, 0.01, n), 0.001)
+    elif kind == "trend":
+        seg_len = rnd.integers(50, 300, n//50+1)
+        drift = rnd.choice([-1, 1], len(seg_len))*rnd.uniform(0.001, 0.004, len(seg_len))
+        ret = mean_revert(np.repeat(drift, seg_len)[:n] + rnd.normal(0, 0.01, n), 0.001)
+    elif kind == "range":
+        ret = mean_revert(rnd.normal(0, 0.01, n), 0.005)
+    else:
+        raise CChanException(f"unknown synthetic kind={kind}", ErrCode.PARA_ERROR)
+    close = np.round(10*np.exp(np.cumsum(ret+gap)), 2)
+    _open = np.round(np.concatenate([[10.0], close[:-1]])*np.exp(gap), 2)
+    high = np.round(np.maximum(_open, close)*(1+np.abs(rnd.normal(0, 0.004, n))), 2)
+    low = np.round(np.minimum(_open, close)*(1-np.abs(rnd.normal(0, 0.004, n))), 2)
+    volume = np.round(rnd.uniform(1000, 5000, n))
+    if kind == "flat":
+        flat_mask = np.repeat(rnd.random(n//4+1) < 0.3, 4)[:n] | (rnd.random(n) < 0.1)
+        at_high = rnd.random(n) < 0.5
+        for i in np.nonzero(flat_mask)[0].tolist():
+            if i == 0:
+                continue
+            price = high[i-1] if at_high[i] else low[i-1]
+            _open[i] = high[i] = low[i] = close[i] = price
+            if i+1 < n:
+                _open[i+1] = price
+                high[i+1], low[i+1] = max(high[i+1], price), min(low[i+1], price)
+    return {
+        DataField.FIELD_OPEN: _open,
+        DataField.FIELD_HIGH: np.maximum(high, np.maximum(_open, close)),
+        DataField.FIELD_LOW: np.minimum(low, np.minimum(_open, close)),
+        DataField.FIELD_CLOSE: close,
+        DataField.FIELD_VOLUME: volume,
+    }
+
+
+def mean_revert(ret: np.ndarray, k: float) -> np.ndarray:
+    # 对数价格每根K线向初始值回归k，返回调整后的收益率；除了rw，其余模拟数据都加上，避免数据量大时价格漂移到不合理的范围
+    log_price = 0.0
+    res = np.empty(len(ret))
+    for i, r in enumerate(ret.tolist()):
+        res[i] = r - k*log_price
+        log_price += res[i]
+    return res
+
+
+def reflect(ret: np.ndarray, low: float, high: float) -> np.ndarray:
+    # 对数价格（相对初始值）超出[low, high]时把这一步反向，数据量很大时价格不会跌到0；没有超出时原样返回
+    log_price = np.cumsum(ret)
+    if len(ret) == 0 or (log_price.min() >= low and log_price.max() <= high):
+        return ret
+    cur = 0.0
+    res = np.empty(len(ret))
+    for i, r in enumerate(ret.tolist()):
+        res[i] = -r if not low <= cur + r <= high else r
+        cur += res[i]
+    return res
+
+
+def parse_code(code: str):
+    # 代码格式：kind:seed:K线数量，如 rw:1:10000
+    try:
+        kind, seed, n = code.split(":")
+        return kind, int(seed), int(n)
+    except ValueError as e:
+        raise CChanException(f"synthetic code should be kind:seed:cnt, got {code}", ErrCode.PARA_ERROR) from e
+
+
+def iter_klu(code: str, k_type: KL_TYPE):
+    if k_type not in KL_STEP_MINUTES:
+        raise CChanException(f"synthetic data not support {k_type}", ErrCode.SRC_DATA_NOT_FOUND)
+    data = gen_ohlcv(*parse_code(code))
+    columns = {name: arr.tolist() for name, arr in data.items()}
+    step = timedelta(minutes=KL_STEP_MINUTES[k_type])
+    t = BEGIN_TIME
+    for i in range(len(columns[DataField.FIELD_CLOSE])):
+        t += step
+        item = {name: values[i] for name, values in columns.items()}
+        item[DataField.FIELD_TIME] = CTime(t.year, t.month, t.day, t.hour, t.minute, auto=False)
+        yield CKLine_Unit(item)
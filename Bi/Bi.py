@@ -1,14 +1,24 @@
 from typing import List, Optional
 
-from Common.cache import make_cache
+from Common.cache import cache_slots, make_cache, new_cache_gen
 from Common.CEnum import BI_DIR, BI_TYPE, DataField, FX_TYPE, MACD_ALGO
 from Common.ChanException import CChanException, ErrCode
 from KLine.KLine import CKLine
+from KLine.KLine_MetricIndex import CKLineMetricIndex
 from KLine.KLine_Unit import CKLine_Unit
 
 
 class CBi:
-    def __init__(self, begin_klc: CKLine, end_klc: CKLine, idx: int, is_sure: bool):
+    __slots__ = (
+        "__dir", "__idx", "__type", "__begin_klc", "__end_klc", "__is_sure", "__sure_end", "__seg_idx",
+        "parent_seg", "bsp", "next", "pre", "metric_index",
+    ) + cache_slots(
+        "get_begin_val", "get_end_val", "get_begin_klu", "get_end_klu", "amp", "get_klu_cnt", "get_klc_cnt",
+        "_high", "_low", "_mid", "is_down", "is_up",
+        "Cal_Rsi", "Cal_MACD_area", "Cal_MACD_peak", "Cal_MACD_half_obverse", "Cal_MACD_half_reverse", "Cal_MACD_diff", "Cal_MACD_slope", "Cal_MACD_amp",
+    )
+
+    def __init__(self, begin_klc: CKLine, end_klc: CKLine, idx: int, is_sure: bool, metric_index: Optional[CKLineMetricIndex] = None):
         # self.__begin_klc = begin_klc
         # self.__end_klc = end_klc
         self.__dir = None
@@ -31,8 +41,10 @@ class CBi:
         self.next: Optional[CBi] = None
         self.pre: Optional[CBi] = None
 
+        self.metric_index = metric_index  # 所在级别的K线指标索引，用于快速计算笔内的macd等指标
+
     def clean_cache(self):
-        self._memoize_cache = {}
+        self._cache_gen = new_cache_gen()
 
     @property
     def begin_klc(self): return self.__begin_klc
@@ -100,8 +112,8 @@ class CBi:
             self.__dir = BI_DIR.DOWN
         else:
             raise CChanException("ERROR DIRECTION when creating bi", ErrCode.BI_ERR)
-        self.check()
         self.clean_cache()
+        self.check()
 
     @make_cache
     def get_begin_val(self):
@@ -205,32 +217,21 @@ class CBi:
         else:
             raise CChanException(f"unsupport macd_algo={macd_algo}, should be one of area/full_area/peak/diff/slope/amp", ErrCode.PARA_ERROR)
 
+    def klu_idx_range(self):
+        # 笔包含的所有K线（首尾合并K线的全部K线）的idx范围，左右都是闭区间
+        return self.begin_klc[0].idx, self.end_klc[-1].idx
+
     @make_cache
     def Cal_Rsi(self):
-        rsi_lst: List[float] = []
-        for klc in self.klc_lst:
-            rsi_lst.extend(klu.rsi for klu in klc.lst)
-        return 10000.0/(min(rsi_lst)+1e-7) if self.is_down() else max(rsi_lst)
+        return self.metric_index.rsi_metric(*self.klu_idx_range(), is_down=self.is_down())
 
     @make_cache
     def Cal_MACD_area(self):
-        _s = 1e-7
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                _s += abs(klu.macd.macd)
-        return _s
+        return self.metric_index.macd_area(*self.klu_idx_range())
 
     @make_cache
     def Cal_MACD_peak(self):
-        peak = 1e-7
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                if abs(klu.macd.macd) > peak:
-                    if self.is_down() and klu.macd.macd < 0:
-                        peak = abs(klu.macd.macd)
-                    elif self.is_up() and klu.macd.macd > 0:
-                        peak = abs(klu.macd.macd)
-        return peak
+        return self.metric_index.macd_peak(*self.klu_idx_range(), is_down=self.is_down())
 
     def Cal_MACD_half(self, is_reverse):
         if is_reverse:
@@ -240,54 +241,18 @@ class CBi:
 
     @make_cache
     def Cal_MACD_half_obverse(self):
-        _s = 1e-7
-        begin_klu = self.get_begin_klu()
-        peak_macd = begin_klu.macd.macd
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                if klu.idx < begin_klu.idx:
-                    continue
-                if klu.macd.macd*peak_macd > 0:
-                    _s += abs(klu.macd.macd)
-                else:
-                    break
-            else:  # 没有被break，继续找写一个KLC
-                continue
-            break
-        return _s
+        return self.metric_index.macd_half(self.get_begin_klu().idx, self.klu_idx_range()[1], is_reverse=False)
 
     @make_cache
     def Cal_MACD_half_reverse(self):
-        _s = 1e-7
-        begin_klu = self.get_end_klu()
-        peak_macd = begin_klu.macd.macd
-        for klc in self.klc_lst_re:
-            for klu in klc[::-1]:
-                if klu.idx > begin_klu.idx:
-                    continue
-                if klu.macd.macd*peak_macd > 0:
-                    _s += abs(klu.macd.macd)
-                else:
-                    break
-            else:  # 没有被break，继续找写一个KLC
-                continue
-            break
-        return _s
+        return self.metric_index.macd_half(self.klu_idx_range()[0], self.get_end_klu().idx, is_reverse=True)
 
     @make_cache
     def Cal_MACD_diff(self):
         """
         macd红绿柱最大值最小值之差
         """
-        _max, _min = float("-inf"), float("inf")
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                macd = klu.macd.macd
-                if macd > _max:
-                    _max = macd
-                if macd < _min:
-                    _min = macd
-        return _max-_min
+        return self.metric_index.macd_diff(*self.klu_idx_range())
 
     @make_cache
     def Cal_MACD_slope(self):
@@ -308,13 +273,9 @@ class CBi:
             return (end_klu.high-begin_klu.low)/begin_klu.low
 
     def Cal_MACD_trade_metric(self, metric: str, cal_avg=False) -> float:
-        _s = 0
-        for klc in self.klc_lst:
-            for klu in klc.lst:
-                metric_res = klu.trade_info.metric[metric]
-                if metric_res is None:
-                    return 0.0
-                _s += metric_res
+        _s = self.metric_index.trade_metric_sum(metric, *self.klu_idx_range())
+        if _s is None:
+            return 0.0
         return _s / self.get_klu_cnt() if cal_avg else _s
 
     # def set_klc_lst(self, lst):
@@ -1,17 +1,23 @@
 from typing import List, Optional, Union, overload
 
 from Common.CEnum import FX_TYPE, KLINE_DIR
+from Common.OffsetList import COffsetList
+from Common.SparseTable import LINEAR_SCAN_MAX
 from KLine.KLine import CKLine
 
 from .Bi import CBi
 from .BiConfig import CBiConfig
+from .LinePeakIndex import CLinePeakIndex
 
 
 class CBiList:
     def __init__(self, bi_conf=CBiConfig()):
-        self.bi_list: List[CBi] = []
+        self.bi_list: COffsetList[CBi] = COffsetList()  # 按笔的idx访问，头部可能被裁剪，参见 CKLine_List.trim_history
         self.last_end = None  # 最后一笔的尾部
         self.config = bi_conf
+        self.metric_index = None  # 所在级别的K线指标索引，由CKLine_List设置，参见CKLineMetricIndex
+        self.klc_index = None  # 所在级别合并K线的高低点索引，由CKLine_List设置，参见CKLineExtremeIndex
+        self.peak_index = CLinePeakIndex()  # 线段计算时在笔里面找最高最低点用
 
         self.free_klc_lst = []  # 仅仅用作第一笔未画出来之前的缓存，为了获得更精准的结果而已，不加这块逻辑其实对后续计算没太大影响
 
@@ -33,6 +39,22 @@ class CBiList:
     def __len__(self):
         return len(self.bi_list)
 
+    @property
+    def offset(self) -> int:
+        # 第一个保留的笔的idx，头部没有被裁剪时为0
+        return self.bi_list.offset
+
+    def trim(self, begin_idx):
+        # 裁掉idx小于begin_idx的笔，断开和被裁掉的笔之间的前后引用，保证它们可以被回收
+        # 跨过裁剪位置的中枢还会引用被裁掉的笔，parent_seg也要断开，否则会沿着线段把更早的笔和K线都留住
+        for bi in self.bi_list.trim(begin_idx):
+            bi.pre = None
+            bi.next = None
+            bi.parent_seg = None
+        self.bi_list[begin_idx].pre = None
+        self.peak_index.trim(begin_idx)
+        self.free_klc_lst = []  # 已经有笔了，用不到
+
     def try_create_first_bi(self, klc: CKLine) -> bool:
         for exist_free_klc in self.free_klc_lst:
             if exist_free_klc.fx == klc.fx:
@@ -62,7 +84,7 @@ class CBiList:
             return False
         if self.bi_list[-1].is_up() and klc.low > self.bi_list[-1].get_begin_val():
             return False
-        if not end_is_peak(self.bi_list[-2].begin_klc, klc):
+        if not end_is_peak(self.bi_list[-2].begin_klc, klc, self.klc_index):
             return False
         if self[-1].is_down() and self[-1].get_end_val() < self[-2].get_begin_val():
             return False
@@ -141,7 +163,7 @@ class CBiList:
         return False
 
     def add_new_bi(self, pre_klc, cur_klc, is_sure=True):
-        self.bi_list.append(CBi(pre_klc, cur_klc, idx=len(self.bi_list), is_sure=is_sure))
+        self.bi_list.append(CBi(pre_klc, cur_klc, idx=len(self.bi_list), is_sure=is_sure, metric_index=self.metric_index))
         if len(self.bi_list) >= 2:
             self.bi_list[-2].next = self.bi_list[-1]
             self.bi_list[-1].pre = self.bi_list[-2]
@@ -181,7 +203,7 @@ class CBiList:
             return False
         if not last_end.check_fx_valid(klc, self.config.bi_fx_check, for_virtual):
             return False
-        if self.config.bi_end_is_peak and not end_is_peak(last_end, klc):
+        if self.config.bi_end_is_peak and not end_is_peak(last_end, klc, self.klc_index):
             return False
         return True
 
@@ -213,7 +235,14 @@ class CBiList:
         return self.bi_list[-1].get_end_klu().idx if len(self) > 0 else None
 
 
-def end_is_peak(last_end: CKLine, cur_end: CKLine) -> bool:
+def end_is_peak(last_end: CKLine, cur_end: CKLine, klc_index=None) -> bool:
+    if klc_index is not None and cur_end.idx - last_end.idx > LINEAR_SCAN_MAX:
+        # 两个分型之间合并K线很多时查区间最值，结果和下面逐根比较一致
+        if last_end.fx == FX_TYPE.BOTTOM:
+            return klc_index.get_max_high(last_end.idx+1, cur_end.idx-1) <= cur_end.high
+        elif last_end.fx == FX_TYPE.TOP:
+            return klc_index.get_min_low(last_end.idx+1, cur_end.idx-1) >= cur_end.low
+        return True
     if last_end.fx == FX_TYPE.BOTTOM:
         cmp_thred = cur_end.high  # 或者严格点选择get_klu_max_high()
         klc = last_end.get_next()
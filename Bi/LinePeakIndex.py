@@ -0,0 +1,79 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from Common.SparseTable import CArgSparseTable, CSparseTable, grow_array
+
+
+class CLinePeakIndex:
+    """
+    笔（或线段）列表的区间极值索引，用于 FindPeakBi / left_bi_break 等在一段笔里面找最高最低点的场景
+    笔列表的尾部会反复变化（虚笔，笔尾延伸，回滚），所以每条记录都带一个指纹（对象本身，结束值，高点，低点），
+    查询时从尾部往前校验，不一致的记录丢掉重新读入；只有尾部会变，所以校验到第一条一致的记录就可以停止
+    线列表头部被裁剪（参见 COffsetList）之后，内部数组从 offset 开始存
+    """
+    def __init__(self, offset=0):
+        self.offset = offset  # lines[0] 的idx
+        self.lines: list = []
+        self.fingerprint: List[Tuple[float, float, float]] = []
+        self.high = np.full(1024, np.nan)
+        self.low = np.full(1024, np.nan)
+        self.peak_high_key = np.full(1024, -np.inf)  # 能作为 FindPeakBi(is_high=True) 结果的笔取结束值，否则为-inf
+        self.peak_low_key = np.full(1024, -np.inf)  # 同上，取结束值的相反数
+        self.max_high = CSparseTable(is_max=True)
+        self.min_low = CSparseTable(is_max=False)
+        self.peak_high = CArgSparseTable()
+        self.peak_low = CArgSparseTable()
+
+    def __len__(self):
+        return len(self.lines)
+
+    @staticmethod
+    def get_fingerprint(line) -> Tuple[float, float, float]:
+        return line.get_end_val(), line._high(), line._low()
+
+    def trim(self, begin):
+        # 线列表裁掉了idx小于begin的部分，裁剪很少发生，直接清空，下次查询时再从begin开始重新读入
+        if begin > self.offset:
+            self.__init__(offset=begin)
+
+    def sync(self, line_lst):
+        offset = self.offset
+        size = min(len(self.lines), len(line_lst) - offset)
+        while size > 0 and (line_lst[offset+size-1] is not self.lines[size-1] or self.get_fingerprint(line_lst[offset+size-1]) != self.fingerprint[size-1]):
+            size -= 1
+        del self.lines[size:]
+        del self.fingerprint[size:]
+        for table in [self.max_high, self.min_low, self.peak_high, self.peak_low]:
+            table.size = min(table.size, size)
+        new_size = len(line_lst) - offset
+        for name in ["high", "low", "peak_high_key", "peak_low_key"]:
+            setattr(self, name, grow_array(getattr(self, name), new_size, np.nan if name in ("high", "low") else -np.inf))
+        for idx in range(size, new_size):
+            line = line_lst[offset+idx]
+            fingerprint = self.get_fingerprint(line)
+            self.lines.append(line)
+            self.fingerprint.append(fingerprint)
+            end_val, self.high[idx], self.low[idx] = fingerprint
+            pre_pre = line.pre.pre if line.pre else None
+            self.peak_high_key[idx] = end_val if line.is_up() and not (pre_pre and pre_pre.get_end_val() > end_val) else -np.inf
+            self.peak_low_key[idx] = -end_val if line.is_down() and not (pre_pre and pre_pre.get_end_val() < end_val) else -np.inf
+
+    def get_max_high(self, line_lst, begin, end) -> float:
+        self.sync(line_lst)
+        self.max_high.extend(self.high, len(self.lines))
+        return self.max_high.query(max(begin-self.offset, 0), end-self.offset)
+
+    def get_min_low(self, line_lst, begin, end) -> float:
+        self.sync(line_lst)
+        self.min_low.extend(self.low, len(self.lines))
+        return self.min_low.query(max(begin-self.offset, 0), end-self.offset)
+
+    def find_peak(self, line_lst, begin, end, is_high):
+        # 和 FindPeakBi(line_lst[begin:end+1], is_high) 结果一致
+        self.sync(line_lst)
+        table, key = (self.peak_high, self.peak_high_key) if is_high else (self.peak_low, self.peak_low_key)
+        table.extend(key, len(self.lines))
+        idx = table.query(max(begin-self.offset, 0), end-self.offset)
+        return None if key[idx] == -np.inf else self.lines[idx]
+
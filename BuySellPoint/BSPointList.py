@@ -1,4 +1,5 @@
-from typing import Dict, Generic, List, Optional, TypeVar, Union, overload
+import bisect
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar, Union, overload
 
 from Bi.Bi import CBi
 from Bi.BiList import CBiList
@@ -18,12 +19,24 @@ LINE_LIST_TYPE = TypeVar('LINE_LIST_TYPE', CBiList, CSegListComm[CBi])
 class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
     def __init__(self, bs_point_config: CBSPointConfig):
 
-        self.lst: List[CBSPoint[LINE_TYPE]] = []
+        self.lst: List[CBSPoint[LINE_TYPE]] = []  # 按买卖点所在K线排序
         self.lst_dict = {}
+        self.bsp_dict: Dict[int, CBSPoint[LINE_TYPE]] = {}  # key是买卖点所在klu的idx
+        self.bsp_bi_idx_cnt: Dict[int, int] = {}  # lst中买卖点所在笔的idx计数
         self.bsp1_lst: List[CBSPoint[LINE_TYPE]] = []
+        self.bsp1_dict: Dict[int, CBSPoint[LINE_TYPE]] = {}  # key是一类买卖点所在笔的idx
         self.config = bs_point_config
         self.last_sure_pos = -1
 
+        # 上次cal时用来过滤的last_sure_pos，以及当时lst/bsp1_lst的长度（之后的都是上次cal新增的）
+        self.last_filter_pos = -1
+        self.last_lst_len = 0
+        self.last_bsp1_lst_len = 0
+
+        # (is_buy, 类别) -> 该类买卖点在lst中的下标（递增），类别为None表示不限；lst[:type_index_len]已经建好索引且之后没有变化，查询时补上后面的
+        self.type_index: Dict[Tuple[bool, Optional[BSP_TYPE]], List[int]] = {}
+        self.type_index_len = 0
+
     def __iter__(self):
         yield from self.lst
 
@@ -39,20 +52,79 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
     def __getitem__(self, index: Union[slice, int]) -> Union[List[CBSPoint], CBSPoint]:
         return self.lst[index]
 
-    def cal(self, bi_list: LINE_LIST_TYPE, seg_list: CSegListComm[LINE_TYPE]):
-        self.lst = [bsp for bsp in self.lst if bsp.klu.idx <= self.last_sure_pos]
-        self.bsp_dict = {bsp.bi.get_end_klu().idx: bsp for bsp in self.lst}
-        self.bsp1_lst = [bsp for bsp in self.bsp1_lst if bsp.klu.idx <= self.last_sure_pos]
+    def cal(self, bi_list: LINE_LIST_TYPE, seg_list: CSegListComm[LINE_TYPE], full_cal=False):
+        self.remove_unsure_bsp(full_cal)
 
-        self.cal_seg_bs1point(seg_list, bi_list)
-        self.cal_seg_bs2point(seg_list, bi_list)
-        self.cal_seg_bs3point(seg_list, bi_list)
+        begin_seg_idx = self.first_need_cal_seg_idx(seg_list)
+        self.cal_seg_bs1point(seg_list, bi_list, begin_seg_idx)
+        self.cal_seg_bs2point(seg_list, bi_list, begin_seg_idx)
+        self.cal_seg_bs3point(seg_list, bi_list, begin_seg_idx)
+        self.sort_new_bsp()
 
         self.update_last_pos(seg_list)
 
+    def sort_new_bsp(self):
+        # 保留下来的部分已经有序，只需要排这次新增的；新增的跑到了前面时整体重排（换成新列表，检查点据此全部回滚）
+        new_bsp_lst = sorted(self.lst[self.last_lst_len:], key=lambda bsp: bsp.klu.idx)
+        if self.last_lst_len > 0 and new_bsp_lst and new_bsp_lst[0].klu.idx < self.lst[self.last_lst_len-1].klu.idx:
+            self.lst = sorted(self.lst, key=lambda bsp: bsp.klu.idx)
+            self.invalid_type_index(0)
+        else:
+            self.lst[self.last_lst_len:] = new_bsp_lst
+
+    def remove_unsure_bsp(self, full_cal=False):
+        # 每次cal新增的买卖点都在last_sure_pos之后，所以只要last_sure_pos没有回退，之前保留下来的买卖点这次也一定会保留
+        # 只需要检查上次cal新增的部分就行
+        if full_cal or self.last_sure_pos < self.last_filter_pos:
+            self.invalid_type_index(0)
+            self.lst = [bsp for bsp in self.lst if bsp.klu.idx <= self.last_sure_pos]
+            self.bsp_dict = {bsp.bi.get_end_klu().idx: bsp for bsp in self.lst}
+            self.bsp_bi_idx_cnt = {}
+            for bsp in self.lst:
+                self.bsp_bi_idx_cnt[bsp.bi.idx] = self.bsp_bi_idx_cnt.get(bsp.bi.idx, 0) + 1
+            self.bsp1_lst = [bsp for bsp in self.bsp1_lst if bsp.klu.idx <= self.last_sure_pos]
+            self.bsp1_dict = {bsp.bi.idx: bsp for bsp in self.bsp1_lst}
+        else:
+            self.invalid_type_index(self.last_lst_len)
+            new_bsp_lst = self.lst[self.last_lst_len:]
+            del self.lst[self.last_lst_len:]
+            for bsp in new_bsp_lst:
+                if bsp.klu.idx <= self.last_sure_pos:
+                    self.lst.append(bsp)
+                    continue
+                if self.bsp_dict.get(bsp.klu.idx) is bsp:
+                    del self.bsp_dict[bsp.klu.idx]
+                self.bsp_bi_idx_cnt[bsp.bi.idx] -= 1
+                if self.bsp_bi_idx_cnt[bsp.bi.idx] == 0:
+                    del self.bsp_bi_idx_cnt[bsp.bi.idx]
+            new_bsp1_lst = self.bsp1_lst[self.last_bsp1_lst_len:]
+            del self.bsp1_lst[self.last_bsp1_lst_len:]
+            for bsp in new_bsp1_lst:
+                if bsp.klu.idx <= self.last_sure_pos:
+                    self.bsp1_lst.append(bsp)
+                elif self.bsp1_dict.get(bsp.bi.idx) is bsp:
+                    del self.bsp1_dict[bsp.bi.idx]
+        self.last_filter_pos = self.last_sure_pos
+        self.last_lst_len = len(self.lst)
+        self.last_bsp1_lst_len = len(self.bsp1_lst)
+
+    def trim(self, begin_bi_idx):
+        # 裁掉所在线的idx小于begin_bi_idx的买卖点，last_lst_len等记录的长度也要扣掉裁掉的个数
+        def keep(bsp):
+            return bsp.bi.idx >= begin_bi_idx
+
+        self.last_lst_len = sum(keep(bsp) for bsp in self.lst[:self.last_lst_len])
+        self.last_bsp1_lst_len = sum(keep(bsp) for bsp in self.bsp1_lst[:self.last_bsp1_lst_len])
+        self.lst = [bsp for bsp in self.lst if keep(bsp)]
+        self.bsp1_lst = [bsp for bsp in self.bsp1_lst if keep(bsp)]
+        self.bsp_dict = {klu_idx: bsp for klu_idx, bsp in self.bsp_dict.items() if keep(bsp)}
+        self.bsp_bi_idx_cnt = {bi_idx: cnt for bi_idx, cnt in self.bsp_bi_idx_cnt.items() if bi_idx >= begin_bi_idx}
+        self.bsp1_dict = {bi_idx: bsp for bi_idx, bsp in self.bsp1_dict.items() if bi_idx >= begin_bi_idx}
+        self.invalid_type_index(0)
+
     def update_last_pos(self, seg_list: CSegListComm):
         self.last_sure_pos = -1
-        for seg in seg_list[::-1]:
+        for seg in reversed(seg_list):
             if seg.is_sure:
                 self.last_sure_pos = seg.end_bi.get_begin_klu().idx
                 return
@@ -60,6 +132,16 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
     def seg_need_cal(self, seg: CSeg):
         return seg.end_bi.get_end_klu().idx > self.last_sure_pos
 
+    def first_need_cal_seg_idx(self, seg_list: CSegListComm[LINE_TYPE]) -> int:
+        # 线段的尾部是递增的，需要计算的一定是尾部那几个线段
+        seg_idx = len(seg_list)
+        while seg_idx > seg_list.offset and self.seg_need_cal(seg_list[seg_idx-1]):
+            seg_idx -= 1
+        return seg_idx
+
+    def bsp_exist_on_bi(self, bi_idx: int) -> bool:
+        return bi_idx in self.bsp_bi_idx_cnt
+
     def add_bs(
         self,
         bs_type: BSP_TYPE,
@@ -72,6 +154,7 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
         if exist_bsp := self.bsp_dict.get(bi.get_end_klu().idx):
             assert exist_bsp.is_buy == is_buy
             exist_bsp.add_another_bsp_prop(bs_type, relate_bsp1)
+            self.invalid_type_index(self.bsp_pos(exist_bsp.klu.idx, self.last_lst_len))  # cal过程中只有前面保留下来的部分有序
             return
         if bs_type not in self.config.GetBSConfig(is_buy).target_types:
             is_target_bsp = False
@@ -89,13 +172,13 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
         if is_target_bsp:
             self.lst.append(bsp)
             self.bsp_dict[bi.get_end_klu().idx] = bsp
+            self.bsp_bi_idx_cnt[bi.idx] = self.bsp_bi_idx_cnt.get(bi.idx, 0) + 1
         if bs_type in [BSP_TYPE.T1, BSP_TYPE.T1P]:
             self.bsp1_lst.append(bsp)
+            self.bsp1_dict[bi.idx] = bsp
 
-    def cal_seg_bs1point(self, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE):
-        for seg in seg_list:
-            if not self.seg_need_cal(seg):
-                continue
+    def cal_seg_bs1point(self, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE, begin_seg_idx: int):
+        for seg in seg_list[begin_seg_idx:]:
             self.cal_single_bs1point(seg, bi_list)
 
     def cal_single_bs1point(self, seg: CSeg[LINE_TYPE], bi_list: LINE_LIST_TYPE):
@@ -123,6 +206,8 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
 
     def treat_pz_bsp1(self, seg: CSeg[LINE_TYPE], BSP_CONF: CPointConfig, bi_list: LINE_LIST_TYPE, is_target_bsp):
         last_bi = seg.end_bi
+        if last_bi.idx-2 < bi_list.offset:
+            return
         pre_bi = bi_list[last_bi.idx-2]
         if last_bi.seg_idx != pre_bi.seg_idx:
             return
@@ -142,14 +227,11 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
         feature_dict = {'divergence_rate': divergence_rate}
         self.add_bs(bs_type=BSP_TYPE.T1P, bi=last_bi, relate_bsp1=None, is_target_bsp=is_target_bsp, feature_dict=feature_dict)
 
-    def cal_seg_bs2point(self, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE):
-        bsp1_bi_idx_dict = {bsp.bi.idx: bsp for bsp in self.bsp1_lst}
-        for seg in seg_list:
-            self.treat_bsp2(seg, bsp1_bi_idx_dict, seg_list, bi_list)
+    def cal_seg_bs2point(self, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE, begin_seg_idx: int):
+        for seg in seg_list[begin_seg_idx:]:
+            self.treat_bsp2(seg, self.bsp1_dict, seg_list, bi_list)
 
     def treat_bsp2(self, seg: CSeg, bsp1_bi_idx_dict, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE):
-        if not self.seg_need_cal(seg):
-            return
         if len(seg_list) > 1:
             BSP_CONF = self.config.GetBSConfig(seg.is_down())
             bsp1_bi = seg.end_bi
@@ -163,11 +245,11 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
             BSP_CONF = self.config.GetBSConfig(seg.is_up())
             bsp1_bi, real_bsp1 = None, None
             bsp1_bi_idx = -1
-            if len(bi_list) == 1:
+            if len(bi_list) - bi_list.offset == 1:
                 return
-            bsp2_bi = bi_list[1]
-            break_bi = bi_list[0]
-        if BSP_CONF.bsp2_follow_1 and bsp1_bi_idx not in [bsp.bi.idx for bsp in self.bsp_dict.values()]:  # check bsp2_follow_1
+            bsp2_bi = bi_list[bi_list.offset+1]
+            break_bi = bi_list[bi_list.offset]
+        if BSP_CONF.bsp2_follow_1 and not self.bsp_exist_on_bi(bsp1_bi_idx):  # check bsp2_follow_1
             return
         retrace_rate = bsp2_bi.amp()/break_bi.amp()
         bsp2_flag = retrace_rate <= BSP_CONF.max_bs2_rate
@@ -212,11 +294,9 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
             self.add_bs(bs_type=BSP_TYPE.T2S, bi=bsp2s_bi, relate_bsp1=real_bsp1)  # type: ignore
             bias += 2
 
-    def cal_seg_bs3point(self, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE):
-        bsp1_bi_idx_dict = {bsp.bi.idx: bsp for bsp in self.bsp1_lst}
-        for seg in seg_list:
-            if not self.seg_need_cal(seg):
-                continue
+    def cal_seg_bs3point(self, seg_list: CSegListComm[LINE_TYPE], bi_list: LINE_LIST_TYPE, begin_seg_idx: int):
+        bsp1_bi_idx_dict = self.bsp1_dict
+        for seg in seg_list[begin_seg_idx:]:
             if len(seg_list) > 1:
                 bsp1_bi = seg.end_bi
                 bsp1_bi_idx = bsp1_bi.idx
@@ -230,7 +310,7 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
                 bsp1_bi, real_bsp1 = None, None
                 bsp1_bi_idx = -1
                 BSP_CONF = self.config.GetBSConfig(seg.is_up())
-            if BSP_CONF.bsp3_follow_1 and bsp1_bi_idx not in [bsp.bi.idx for bsp in self.bsp_dict.values()]:
+            if BSP_CONF.bsp3_follow_1 and not self.bsp_exist_on_bi(bsp1_bi_idx):
                 continue
             if next_seg:
                 self.treat_bsp3_after(seg_list, next_seg, BSP_CONF, bi_list, real_bsp1, bsp1_bi_idx, next_seg_idx)
@@ -302,9 +382,43 @@ class CBSPointList(Generic[LINE_TYPE, LINE_LIST_TYPE]):
             break
 
     def get_lastest_bsp_list(self) -> List[CBSPoint[LINE_TYPE]]:
-        if len(self.lst) == 0:
-            return []
-        return sorted(self.lst, key=lambda bsp: bsp.bi.idx, reverse=True)
+        return self.lst[::-1]
+
+    def bsp_pos(self, klu_idx: int, hi: Optional[int] = None) -> int:
+        # lst[:hi]中第一个所在K线idx >= klu_idx的买卖点的下标
+        return bisect.bisect_left(self.lst, klu_idx, hi=len(self.lst) if hi is None else hi, key=lambda bsp: bsp.klu.idx)
+
+    def get_bsp_since(self, klu_idx: int) -> List[CBSPoint[LINE_TYPE]]:
+        # 所在K线idx >= klu_idx的买卖点，按时间排序
+        return self.lst[self.bsp_pos(klu_idx):]
+
+    def get_bsp_by_klu(self, klu_idx: int) -> Optional[CBSPoint[LINE_TYPE]]:
+        return self.bsp_dict.get(klu_idx)
+
+    def get_latest_bsp(self, is_buy: Optional[bool] = None, bsp_type: Optional[BSP_TYPE] = None) -> Optional[CBSPoint[LINE_TYPE]]:
+        # 最后一个买卖点，可以限定买/卖以及类别
+        if is_buy is None and bsp_type is None:
+            return self.lst[-1] if self.lst else None
+        self.update_type_index()
+        pos = -1
+        for _is_buy in ([True, False] if is_buy is None else [is_buy]):
+            if pos_lst := self.type_index.get((_is_buy, bsp_type)):
+                pos = max(pos, pos_lst[-1])
+        return self.lst[pos] if pos >= 0 else None
+
+    def invalid_type_index(self, pos: int):
+        # lst[pos:]有变化，type_index中这之后的部分需要重建
+        self.type_index_len = min(self.type_index_len, pos)
+
+    def update_type_index(self):
+        for pos_lst in self.type_index.values():
+            while pos_lst and pos_lst[-1] >= self.type_index_len:
+                pos_lst.pop()
+        for pos in range(self.type_index_len, len(self.lst)):
+            bsp = self.lst[pos]
+            for bsp_type in [None, *bsp.type]:
+                self.type_index.setdefault((bsp.is_buy, bsp_type), []).append(pos)
+        self.type_index_len = len(self.lst)
 
 
 def bsp2s_break_bsp1(bsp2s_bi: LINE_TYPE, bsp2_break_bi: LINE_TYPE) -> bool:
@@ -12,6 +12,8 @@ class CBSPoint(Generic[LINE_TYPE]):
     """
     买卖点类
     """
+    __slots__ = ("bi", "klu", "is_buy", "type", "relate_bsp1", "features", "is_segbsp")
+
     def __init__(self, bi: LINE_TYPE, is_buy, bs_type: BSP_TYPE, relate_bsp1: Optional['CBSPoint'], feature_dict=None):
         self.bi: LINE_TYPE = bi  # 所属的笔（买卖点一定在某一笔末尾）
         self.klu = bi.get_end_klu()  # 笔末尾的K线，即买卖点所在K线
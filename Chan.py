@@ -1,15 +1,19 @@
 import copy
 import datetime
+import itertools
+import json
+import os
 from collections import defaultdict
-from typing import Dict, Iterable, List, Optional, Union
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 
 from BuySellPoint.BS_Point import CBSPoint
 from ChanConfig import CChanConfig
-from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE
+from Common.CEnum import AUTYPE, BSP_TYPE, DATA_SRC, KL_TYPE
 from Common.ChanException import CChanException, ErrCode
 from Common.CTime import CTime
 from Common.func_util import check_kltype_order, kltype_lte_day
 from DataAPI.CommonStockAPI import CCommonStockApi
+from KLine.KLine_Event import CChanEvent
 from KLine.KLine_List import CKLine_List
 from KLine.KLine_Unit import CKLine_Unit
 
@@ -20,7 +24,7 @@ class CChan:
         code,
         begin_time=None,
         end_time=None,
-        data_src: Union[DATA_SRC, str] = DATA_SRC.BAO_STOCK,
+        data_src: Union[DATA_SRC, str, Type[CCommonStockApi]] = DATA_SRC.BAO_STOCK,
         lv_list=None,
         config=None,
         autype: AUTYPE = AUTYPE.QFQ,
@@ -37,6 +41,7 @@ class CChan:
             DATA_SRC.CSV: csv（具体可以看内部实现）
             "custom:文件名:类名"：自定义解析器
             框架默认提供一个 demo 为："custom: OfflineDataAPI.CStockFileReader"
+            CCommonStockApi 的子类：直接使用，如 CKLinePrefetcher.get_api_cls() 返回的预取数据源
             自己开发参考下文『自定义开发-数据接入』
         :param lv_list: K 线级别，必须从大到小，默认为 [KL_TYPE.K_DAY, KL_TYPE.K_60M]，可选：
             KL_TYPE.K_YEAR（-_-|| 没啥卵用，毕竟全部年线可能就只有一笔。。）
@@ -79,6 +84,7 @@ class CChan:
         self.g_kl_iters = defaultdict()  # key是K线级别，value是对应级别的K Line Unit 的迭代器
 
         self.kl_datas: Dict[KL_TYPE, CKLine_List] = {}
+        self.event_listener_lst: List[Tuple[Callable, Optional[KL_TYPE]]] = []  # (监听者, 级别)，参见 add_event_listener
         self.do_init()
 
         if not config.trigger_step:
@@ -86,6 +92,9 @@ class CChan:
                 ...
 
     def __deepcopy__(self, memo):
+        forming_loaded = hasattr(self, 'kl_resampler') and self.kl_resampler.forming_loaded
+        if forming_loaded:  # 未确定的K线去掉再拷贝，拷贝完两边再重新加入
+            self.unload_resample_forming()
         cls = self.__class__
         obj: CChan = cls.__new__(cls)
         memo[id(self)] = obj
@@ -103,9 +112,14 @@ class CChan:
             obj.klu_cache = copy.deepcopy(self.klu_cache, memo)
         if hasattr(self, 'klu_last_t'):
             obj.klu_last_t = copy.deepcopy(self.klu_last_t, memo)
+        obj.chan_checkpoint = None
+        obj.forming_klu_dict = {}
+        obj.event_listener_lst = []
         obj.kl_datas = {}
         for kl_type, ckline in self.kl_datas.items():
             obj.kl_datas[kl_type] = copy.deepcopy(ckline, memo)
+        if hasattr(self, 'kl_resampler'):
+            obj.kl_resampler = copy.deepcopy(self.kl_resampler, memo)
         for kl_type, ckline in self.kl_datas.items():
             for klc in ckline:
                 for klu in klc.lst:
@@ -113,12 +127,19 @@ class CChan:
                     if klu.sup_kl:
                         memo[id(klu)].sup_kl = memo[id(klu.sup_kl)]
                     memo[id(klu)].sub_kl_list = [memo[id(sub_kl)] for sub_kl in klu.sub_kl_list]
+        if forming_loaded:
+            self.load_resample_forming()
+            obj.load_resample_forming()
         return obj
 
     def do_init(self):
+        self.chan_checkpoint = None
+        self.forming_klu_dict: Dict[KL_TYPE, CKLine_Unit] = {}  # trigger_load(forming=True)时每个级别最后一根K线
         self.kl_datas = {}
         for kl_type in self.lv_list:
             self.kl_datas[kl_type] = CKLine_List(kl_type, conf=self.conf)
+        for listener, lv in self.event_listener_lst:
+            self.add_lv_event_listener(listener, lv)
 
     @staticmethod
     def load_klus(stockapi_instance: CCommonStockApi, lv) -> Iterable[CKLine_Unit]:
@@ -147,9 +168,108 @@ class CChan:
         if not yielded:
             yield self
 
-    def trigger_load(self, inp):
+    def trigger_load(self, inp, forming=False):
         # 在已有pickle基础上继续计算新的
         # {type: [klu, ...]}
+        # forming=True 表示每个级别传入的最后一根K线还没走完，之后可以用 update_last_bar 修改（只支持trigger_step模式）
+        if self.conf.kl_resample:
+            if forming:
+                raise CChanException("kl_resample模式下没走完的K线由CChan自己合成，不支持forming", ErrCode.PARA_ERROR)
+            self.trigger_load_resample(inp)
+            return
+        self.trigger_load_klus(inp, forming)
+
+    def trigger_load_resample(self, inp):
+        """
+        kl_resample 模式下的 trigger_load：只传入最小级别已经走完的K线，其余级别由 CMultiLevelResampler 合成
+        其余级别最后一根还没走完的K线以 forming=True 加入计算，之后每来一根最小级别K线只用 update_last_klu 修改这几根，
+        走完之后留在原处，新开始的一根再以 forming=True 加入；每根最小级别K线的代价和最高级别一根K线里已经有多少根次级别K线无关
+        所以这个模式下不要自己调用 checkpoint/rollback/update_last_bar
+        """
+        if not self.conf.trigger_step:
+            raise CChanException("kl_resample模式下的trigger_load只支持trigger_step模式", ErrCode.PARA_ERROR)
+        sub_lv = self.lv_list[-1]
+        if set(inp.keys()) != {sub_lv}:
+            raise CChanException(f"kl_resample模式下只需要传入最小级别{sub_lv}的K线", ErrCode.PARA_ERROR)
+        from KLine.KLine_Resampler import CMultiLevelResampler
+        if not hasattr(self, 'kl_resampler'):
+            self.kl_resampler = CMultiLevelResampler(self.lv_list, self.conf.kl_resample_session)
+        if not self.kl_resampler.forming_loaded:
+            self.load_resample_forming()
+        for klu in inp[sub_lv]:
+            self.add_resample_klu(klu)
+
+    def add_resample_klu(self, sub_klu: CKLine_Unit):
+        sub_lv_idx = len(self.lv_list) - 1
+        last_klu = self[sub_lv_idx].get_last_klu()
+        if last_klu is not None and not sub_klu.time > last_klu.time:
+            raise CChanException(f"klu time err, cur={sub_klu.time}, last={last_klu.time}", ErrCode.KL_NOT_MONOTONOUS)
+        parent_klu = None
+        for lv_idx, is_new in enumerate(self.kl_resampler.add(sub_klu)):
+            if is_new:  # 上一根已经走完（最后一次修改时就是最终的值）
+                parent_klu = self.add_resample_forming_klu(lv_idx, parent_klu)
+            else:
+                parent_klu = self.update_resample_forming_klu(lv_idx)
+        self.try_set_klu_idx(sub_lv_idx, sub_klu)
+        sub_klu = self.add_new_kl(self.lv_list[sub_lv_idx], sub_klu)
+        if parent_klu is not None:
+            self.set_klu_parent_relation(parent_klu, sub_klu, sub_lv_idx)
+
+    def add_resample_forming_klu(self, lv_idx: int, parent_klu: Optional[CKLine_Unit]) -> CKLine_Unit:
+        # 以forming=True加入合成出来的某个级别的最后一根K线
+        klu = self.kl_resampler.get_forming_klu(lv_idx)
+        self.try_set_klu_idx(lv_idx, klu)
+        try:
+            klu = self[lv_idx].add_single_klu(klu, forming=True)
+        except Exception:
+            print(f"[ERROR-{self.code}]在计算{klu.time}K线时发生错误!")
+            raise
+        if parent_klu is not None:
+            self.set_klu_parent_relation(parent_klu, klu, lv_idx)
+        return klu
+
+    def update_resample_forming_klu(self, lv_idx: int) -> CKLine_Unit:
+        # 合成的某个级别最后一根K线加入了新的最小级别K线，周线及以上的时间也会变
+        try:
+            return self[lv_idx].update_last_klu(self.kl_resampler.get_forming_dict(lv_idx), allow_time=True)
+        except Exception:
+            print(f"[ERROR-{self.code}]在更新{self.lv_list[lv_idx]}最后一根K线时发生错误!")
+            raise
+
+    def load_resample_forming(self):
+        # 把各级别未确定的K线重新加入计算（参见 unload_resample_forming），下一级别末尾还没有父级别K线的那些挂到它下面
+        parent_klu = None
+        for lv_idx in range(len(self.lv_list)-1):
+            if self.kl_resampler.get_forming_klu(lv_idx) is None:  # 还没有K线
+                break
+            parent_klu = self.add_resample_forming_klu(lv_idx, parent_klu)
+            orphan_lst = []
+            for klc in reversed(self[lv_idx+1].lst):
+                if klc.lst[-1].sup_kl is not None:
+                    break
+                orphan_lst = [klu for klu in klc.lst if klu.sup_kl is None] + orphan_lst
+            for sub_klu in orphan_lst:
+                self.set_klu_parent_relation(parent_klu, sub_klu, lv_idx+1)
+        self.kl_resampler.forming_loaded = True
+
+    def unload_resample_forming(self):
+        # 去掉各级别未确定的K线（回滚到它们加入之前），保存/拷贝时只保留确定的部分，之后再用 load_resample_forming 重新加入
+        for kl_list in self.kl_datas.values():
+            if kl_list.last_klu_checkpoint is None:
+                continue
+            forming_klu = kl_list.get_last_klu()
+            kl_list.rollback_last_klu()
+            kl_list.last_klu_checkpoint = None
+            kl_list.notify_event()
+            for sub_klu in forming_klu.sub_kl_list:
+                sub_klu.set_parent(None)
+            forming_klu.sub_kl_list = []
+            if forming_klu.sup_kl is not None:
+                forming_klu.sup_kl.sub_kl_list = [klu for klu in forming_klu.sup_kl.sub_kl_list if klu is not forming_klu]
+                forming_klu.set_parent(None)
+        self.kl_resampler.forming_loaded = False
+
+    def trigger_load_klus(self, inp, forming=False):
         if not hasattr(self, 'klu_cache'):
             self.klu_cache: List[Optional[CKLine_Unit]] = [None for _ in self.lv_list]
         if not hasattr(self, 'klu_last_t'):
@@ -161,14 +281,108 @@ class CChan:
                 continue
             assert isinstance(inp[lv_name], list)
             self.add_lv_iter(lv_name, iter(inp[lv_name]))
-        for _ in self.load_iterator(lv_idx=0, parent_klu=None, step=False):
-            ...
+        if forming:
+            self.forming_klu_dict = {lv_name: klu_lst[-1] for lv_name, klu_lst in inp.items() if klu_lst}
+        try:
+            for _ in self.load_iterator(lv_idx=0, parent_klu=None, step=False):
+                ...
+        finally:
+            self.forming_klu_dict = {}
         if not self.conf.trigger_step:  # 非回放模式全部算完之后才算一次中枢和线段
             for lv in self.lv_list:
                 self.kl_datas[lv].cal_seg_and_zs()
 
+    def checkpoint(self):
+        """
+        记录当前状态，之后可以用rollback()回到这里，用来替代实盘中 deepcopy 一份再 trigger_load 未完成K线的用法
+        只在trigger_step模式下可用：每加入一根K线时只记录这一步可能修改到的尾部，代价和历史长度无关
+        再次调用checkpoint()会覆盖之前的记录
+        """
+        if not self.conf.trigger_step:
+            raise CChanException("checkpoint只支持trigger_step模式", ErrCode.PARA_ERROR)
+        from KLine.KLine_Checkpoint import CKLineListCheckpoint, copy_state
+        self.chan_checkpoint = {
+            'klu_cache': list(self.klu_cache) if hasattr(self, 'klu_cache') else None,
+            'klu_cache_state': [(klu, copy_state(klu)) for klu in getattr(self, 'klu_cache', []) if klu is not None],  # 缓存的K线之后加入时会被修改
+            'klu_last_t': list(self.klu_last_t) if hasattr(self, 'klu_last_t') else None,
+            'kl_misalign_cnt': self.kl_misalign_cnt,
+            'kl_inconsistent_detail': copy.deepcopy(self.kl_inconsistent_detail),
+            'g_kl_iters': dict(self.g_kl_iters),
+        }
+        for kl_list in self.kl_datas.values():
+            kl_list.checkpoint = None
+            kl_list.trim_history()  # 有检查点时增量计算不会裁剪历史，在这里补上
+            kl_list.checkpoint = CKLineListCheckpoint(kl_list)
+
+    def rollback(self):
+        # 回到上一次checkpoint()时的状态，checkpoint依然有效，可以反复回滚
+        if self.chan_checkpoint is None:
+            raise CChanException("rollback之前需要先调用checkpoint", ErrCode.PARA_ERROR)
+        from KLine.KLine_Checkpoint import restore_state
+        for kl_list in self.kl_datas.values():
+            kl_list.checkpoint.rollback()
+            kl_list.last_klu_checkpoint = None
+            kl_list.notify_event()  # 回退的变化也会通知
+        state = self.chan_checkpoint
+        for klu, klu_state in state['klu_cache_state']:
+            restore_state(klu, klu_state)
+        for attr in ['klu_cache', 'klu_last_t']:
+            if state[attr] is None:
+                if hasattr(self, attr):
+                    delattr(self, attr)
+            else:
+                setattr(self, attr, list(state[attr]))
+        self.kl_misalign_cnt = state['kl_misalign_cnt']
+        self.kl_inconsistent_detail = copy.deepcopy(state['kl_inconsistent_detail'])
+        self.g_kl_iters = defaultdict(None, state['g_kl_iters'])
+
+    def drop_checkpoint(self):
+        self.chan_checkpoint = None
+        for kl_list in self.kl_datas.values():
+            kl_list.checkpoint = None
+
+    def save(self, path):
+        """
+        保存成紧凑的二进制格式（参见 Common/ChanFile.py），之后可以用 CChan.load_file 恢复后继续 trigger_load
+        检查点和数据源迭代器不会保存
+        """
+        from Common.ChanFile import dump_obj
+        forming_loaded = hasattr(self, 'kl_resampler') and self.kl_resampler.forming_loaded
+        if forming_loaded:  # 检查点不会保存，只保存确定的部分，读回时再重新加入未确定的K线
+            self.unload_resample_forming()
+        try:
+            dump_obj(self, path)
+        finally:
+            if forming_loaded:
+                self.load_resample_forming()
+
+    @classmethod
+    def load_file(cls, path, use_mmap=True) -> 'CChan':
+        # use_mmap=True 时数组直接映射文件内容（写时复制），列式存储（kl_columnar）下K线数据不需要拷贝
+        from Common.ChanFile import load_obj
+        chan = load_obj(path, use_mmap)
+        if not isinstance(chan, cls):
+            raise CChanException(f"{path}保存的不是{cls.__name__}", ErrCode.CHAN_FILE_ERR)
+        chan.g_kl_iters = defaultdict()
+        chan.chan_checkpoint = None
+        chan.forming_klu_dict = {}
+        chan.event_listener_lst = []
+        for kl_list in chan.kl_datas.values():
+            kl_list.checkpoint = None
+            kl_list.last_klu_checkpoint = None
+            kl_list.event_tracker = None
+            kl_list.reset_profile()
+        chan.conf.get_metric_model()  # CDemarkEngine的参数是类属性，重新生成一次指标模型以恢复
+        if hasattr(chan, 'kl_resampler'):
+            chan.load_resample_forming()
+        return chan
+
     def get_klu_iters(self, stockapi_cls):
         # 跳过一些获取数据失败的级别，只保留有效的级别
+        if self.conf.kl_resample:
+            return self.get_resample_klu_iters(stockapi_cls)
+        if self.conf.kl_fetch_concurrency is not None and len(self.lv_list) > 1:
+            stockapi_cls = self.prefetch_klus(stockapi_cls)
         klu_iters = []
         valid_lv_list = []
         for lv in self.lv_list:
@@ -185,8 +399,33 @@ class CChan:
         self.lv_list = valid_lv_list
         return klu_iters
 
+    def prefetch_klus(self, stockapi_cls):
+        # 所有级别并发获取完再开始计算，返回读取预取结果的数据源
+        from DataAPI.AsyncStockAPI import CKLinePrefetcher, CPrefetchStockApi
+        if issubclass(stockapi_cls, CPrefetchStockApi):
+            return stockapi_cls
+        prefetcher = CKLinePrefetcher(stockapi_cls, self.lv_list, self.begin_time, self.end_time, self.autype, self.conf.kl_fetch_concurrency)
+        prefetcher.fetch([self.code], init_api=False)  # do_init/do_close 由 load 负责
+        return prefetcher.get_api_cls()
+
+    def get_resample_klu_iters(self, stockapi_cls):
+        # 只获取最小级别的K线，其余级别都由它合成，天然对齐
+        from KLine.KLine_Resampler import CKLineResampler, parse_session, resample_klus
+        session = parse_session(self.conf.kl_resample_session)
+        klu_iters = itertools.tee(self.get_klu_iter(stockapi_cls, self.lv_list[-1]), len(self.lv_list))
+        return [resample_klus(klu_iter, CKLineResampler(lv, session)) for lv, klu_iter in zip(self.lv_list[:-1], klu_iters)] + [klu_iters[-1]]
+
     def _get_stock_api(self):
+        stockapi_cls = self._get_src_stock_api()
+        if self.conf.kl_cache_dir is not None:
+            from DataAPI.CacheAPI import make_cache_api
+            return make_cache_api(stockapi_cls, self.conf.kl_cache_dir)
+        return stockapi_cls
+
+    def _get_src_stock_api(self):
         print(f'load stock api {self.data_src}')
+        if isinstance(self.data_src, type) and issubclass(self.data_src, CCommonStockApi):
+            return self.data_src
         if self.data_src == DATA_SRC.BAO_STOCK:
             from DataAPI.BaoStockAPI import CBaoStock
             return CBaoStock
@@ -222,30 +461,63 @@ class CChan:
             raise
         finally:
             stockapi_cls.do_close()
+            self.g_kl_iters.clear()  # 生成器不能deepcopy，读完就不需要了
         if len(self[0]) == 0:
             raise CChanException("最高级别没有获得任何数据", ErrCode.NO_DATA)
 
     def set_klu_parent_relation(self, parent_klu, kline_unit, lv_idx):
         lv_name = self.lv_list[lv_idx]
-        if self.conf.kl_data_check and kltype_lte_day(lv_name) and kltype_lte_day(self.lv_list[lv_idx - 1]):
+        if self.conf.kl_data_check and not self.conf.kl_resample and kltype_lte_day(lv_name) and kltype_lte_day(self.lv_list[lv_idx - 1]):
             self.check_kl_consitent(parent_klu, kline_unit)
         parent_klu.add_children(kline_unit)
         kline_unit.set_parent(parent_klu)
 
-    def add_new_kl(self, lv_name: KL_TYPE, klu):
+    def add_new_kl(self, lv_name: KL_TYPE, klu) -> CKLine_Unit:
         try:
-            self.kl_datas[lv_name].add_single_klu(klu)
+            return self.kl_datas[lv_name].add_single_klu(klu, forming=klu is self.forming_klu_dict.get(lv_name))
         except Exception:
             print(f"[ERROR-{self.code}]在计算{klu.time}K线时发生错误!")
             raise
 
+    def update_last_bar(self, level: Union[KL_TYPE, int], ohlcv: Dict[str, float]) -> CKLine_Unit:
+        """
+        实盘tick更新：修改某个级别最后一根还没走完的K线（trigger_load(..., forming=True)时加入的），不需要checkpoint/rollback
+        只重算这根K线影响到的尾部，可以对同一根K线反复调用，返回修改后的K线
+        :param level: KL_TYPE 或者 lv_list 中的下标
+        :param ohlcv: key同DataField，如 {DataField.FIELD_HIGH: 10.5, DataField.FIELD_CLOSE: 10.3}，没有给出的保持不变，时间不能改
+        只修改这一个级别，多级别时父级别的K线需要自己一起更新
+        """
+        try:
+            return self[level].update_last_klu(ohlcv)
+        except Exception:
+            print(f"[ERROR-{self.code}]在更新{level}最后一根K线时发生错误!")
+            raise
+
+    def add_event_listener(self, listener: Callable[[CChanEvent], None], lv: Optional[KL_TYPE] = None):
+        """
+        监听笔/线段/中枢/买卖点的变化，lv为None时监听所有级别；事件类型参见 CHAN_EVENT
+        只通知注册之后的变化：trigger_step模式下每根K线算完之后回调，否则在整批K线算完之后；rollback回退的变化也会通知
+        每次只对比各列表尾部，不用每根K线自己去diff整个买卖点列表；监听者不会被deepcopy/save保存
+        """
+        self.event_listener_lst.append((listener, lv))
+        self.add_lv_event_listener(listener, lv)
+
+    def remove_event_listener(self, listener: Callable[[CChanEvent], None], lv: Optional[KL_TYPE] = None):
+        if (listener, lv) not in self.event_listener_lst:
+            return
+        self.event_listener_lst.remove((listener, lv))
+        for kl_type in (self.lv_list if lv is None else [lv]):
+            self[kl_type].remove_event_listener(listener)
+
+    def add_lv_event_listener(self, listener: Callable[[CChanEvent], None], lv: Optional[KL_TYPE]):
+        for kl_type in (self.lv_list if lv is None else [lv]):
+            self[kl_type].add_event_listener(listener)
+
     def try_set_klu_idx(self, lv_idx: int, kline_unit: CKLine_Unit):
         if kline_unit.idx >= 0:
             return
-        if len(self[lv_idx]) == 0:
-            kline_unit.set_idx(0)
-        else:
-            kline_unit.set_idx(self[lv_idx][-1][-1].idx + 1)
+        last_klu = self[lv_idx].get_last_klu()
+        kline_unit.set_idx(0 if last_klu is None else last_klu.idx + 1)
 
     def load_iterator(self, lv_idx, parent_klu, step):
         # 递归解析 KLine Unit
@@ -270,7 +542,7 @@ class CChan:
                 self.klu_cache[lv_idx] = klu
                 break
 
-            self.add_new_kl(lv_name, klu)
+            klu = self.add_new_kl(lv_name, klu)
             if parent_klu:
                 self.set_klu_parent_relation(parent_klu, klu, lv_idx)
             if lv_idx != len(self.lv_list)-1:
@@ -281,9 +553,7 @@ class CChan:
                 yield self
 
     def check_kl_consitent(self, parent_klu, sub_klu):
-        if (parent_klu.time.year != sub_klu.time.year or
-                parent_klu.time.month != sub_klu.time.month or
-                parent_klu.time.day != sub_klu.time.day):
+        if parent_klu.time.date_int != sub_klu.time.date_int:
             self.kl_inconsistent_detail[str(parent_klu.time)].append(sub_klu.time)
             if self.conf.print_warning:
                 print(f"[WARNING-{self.code}]父级别时间是{parent_klu.time}，次级别时间却是{sub_klu.time}")
@@ -291,7 +561,7 @@ class CChan:
                 raise CChanException(f"父&子级别K线时间不一致条数超过{self.conf.max_kl_inconsistent_cnt}！！", ErrCode.KL_TIME_INCONSISTENT)
 
     def check_kl_align(self, kline_unit, lv_idx):
-        if self.conf.kl_data_check and len(kline_unit.sub_kl_list) == 0:
+        if self.conf.kl_data_check and not self.conf.kl_resample and len(kline_unit.sub_kl_list) == 0:
             self.kl_misalign_cnt += 1
             if self.conf.print_warning:
                 print(f"[WARNING-{self.code}]当前{kline_unit.time}没在次级别{self.lv_list[lv_idx+1]}找到K线！！")
@@ -307,9 +577,43 @@ class CChan:
 
     def get_bsp(self, idx=None) -> List[CBSPoint]:
         """
-        默认返回lv_list中最大级别的买卖点
+        返回某个级别按时间排序的买卖点，idx 为 KL_TYPE 或者 lv_list 中的下标，默认lv_list中最大级别
+        只需要最近的买卖点时用 get_latest_bsp/get_bsp_since，不用拷贝整个列表
         """
-        # if idx is not None:  # TODO 没见到有这个调用啊
-        #     return sorted(self[idx].bs_point_lst.lst, key=lambda x: x.klu.time)
-        assert len(self.lv_list) == 1
-        return sorted(self[0].bs_point_lst.lst, key=lambda x: x.klu.time)
+        return list(self[0 if idx is None else idx].bs_point_lst.lst)
+
+    def get_latest_bsp(self, idx=None, is_buy: Optional[bool] = None, bsp_type: Optional[BSP_TYPE] = None) -> Optional[CBSPoint]:
+        # 某个级别最后一个买卖点，可以限定买/卖以及类别，没有则返回None
+        return self[0 if idx is None else idx].bs_point_lst.get_latest_bsp(is_buy, bsp_type)
+
+    def get_bsp_since(self, klu_idx: int, idx=None) -> List[CBSPoint]:
+        # 某个级别所在K线idx >= klu_idx的买卖点，按时间排序
+        return self[0 if idx is None else idx].bs_point_lst.get_bsp_since(klu_idx)
+
+    def get_profile(self) -> Dict[str, dict]:
+        """
+        配置 profile=True 时，返回每个级别（key为级别名）各计算阶段的累计耗时/调用次数以及计数，格式为
+            {"K_DAY": {"stages": {"cal_seg": {"time": 秒, "calls": 次数}, ...}, "counters": {"virtual_bi_rewrite": 次数, ...}}}
+        阶段和计数的含义参见 CKLineProfiler
+        """
+        if not self.conf.profile:
+            raise CChanException("没有配置profile=True", ErrCode.PARA_ERROR)
+        return {kl_type.name: kl_list.profiler.to_dict() for kl_type, kl_list in self.kl_datas.items()}
+
+    def reset_profile(self):
+        for kl_list in self.kl_datas.values():
+            kl_list.reset_profile()
+
+    def dump_profile(self, path, fmt="json"):
+        # fmt: json 或者 prometheus（Prometheus 文本格式，带 code 标签）
+        profile = self.get_profile()
+        if fmt == "json":
+            content = json.dumps(profile, ensure_ascii=False, indent=2)
+        elif fmt == "prometheus":
+            from KLine.KLine_Profiler import profile_to_prometheus
+            content = profile_to_prometheus(profile, labels={"code": self.code})
+        else:
+            raise CChanException(f"不支持的profile格式：{fmt}", ErrCode.PARA_ERROR)
+        with open(f"{path}.tmp", "w") as f:  # 先写临时文件再改名，读取方（如 node_exporter）不会读到写了一半的文件
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
@@ -53,6 +53,8 @@ class CChanConfig:
         self.trigger_step = conf.get("trigger_step", False)
         # trigger_step 为 True 时有效，指定跳过前面几根K线，默认为 0；
         self.skip_step = conf.get("skip_step", 0)
+        # trigger_step 为 True 时有效，每次增量计算线段中枢买卖点后，都和全量重算的结果对比，不一致会抛异常；很慢，仅用于调试，默认为 False
+        self.step_check = conf.get("step_check", False)
 
         # 是否需要检验K线数据，检查项包括时间线是否有乱序，大小级别K线是否有缺失；默认为 True
         self.kl_data_check = conf.get("kl_data_check", True)
@@ -63,6 +65,38 @@ class CChanConfig:
 
         # 如果获取次级别数据失败，自动删除该级别（比如指数数据一般不提供分钟线），默认为 False
         self.auto_skip_illegal_sub_lv = conf.get("auto_skip_illegal_sub_lv", False)
+        # 非逐步模式下，K线全部读入后再用numpy批量计算MACD/BOLL/均线/RSI/KDJ等指标（结果和逐根计算一致），默认为 True
+        self.batch_metric = conf.get("batch_metric", True)
+        # 非逐步模式下，K线先攒着，计算线段/中枢前一次性批量合并（包含关系），结果和逐根合并一致，默认为 True
+        self.batch_combine = conf.get("batch_combine", True)
+        # K线数据是否改用numpy列式存储（CKLine_Unit变成只记录行号的视图，大幅减少内存，但单根K线取值会变慢），默认为 False
+        self.kl_columnar = conf.get("kl_columnar", False)
+        # 每个级别至少保留的K线根数，设置后会裁掉更早的、已经确定的历史（K线，笔，线段，中枢，买卖点，指标的递推历史），
+        # 用于常驻进程一直 trigger_load 时保持内存不增长；优先在内部元素已确定的线段的线段起点处裁剪，默认为 None 不裁剪
+        self.retain_kl_cnt = conf.get("retain_kl_cnt", None)
+        # retain_kl_cnt 设置时有效，每个级别至少保留的线段个数，默认为 0
+        self.retain_seg_cnt = conf.get("retain_seg_cnt", 0)
+        # retain_kl_cnt 设置时有效，保留的K线根数超过这个值、而线段的线段起点处又裁剪不了时（比如单边行情里线段的线段一直不确定），
+        # 改为在内部元素已确定的线段起点处裁剪，线段的线段从这里重新开始算（线段也裁不下来时在已确定的笔的起点处裁剪，线段及以上重新算），
+        # 默认为 None 即 retain_kl_cnt 的4倍
+        self.retain_kl_max = conf.get("retain_kl_max", None)
+        if self.retain_kl_cnt is not None:
+            if self.seg_conf.seg_algo != "chan":
+                raise CChanException(f"retain_kl_cnt只支持seg_algo=chan，当前为{self.seg_conf.seg_algo}", ErrCode.PARA_ERROR)
+            if self.retain_kl_max is None:
+                self.retain_kl_max = 4*self.retain_kl_cnt
+            elif self.retain_kl_max < self.retain_kl_cnt:
+                raise CChanException(f"retain_kl_max({self.retain_kl_max})不能小于retain_kl_cnt({self.retain_kl_cnt})", ErrCode.PARA_ERROR)
+        # K线本地缓存目录，设置后所有数据源获取的K线都会按 代码/级别/复权方式 列式缓存到该目录，之后只从数据源获取缺失的尾部，默认为 None 不缓存
+        self.kl_cache_dir = conf.get("kl_cache_dir", None)
+        # 多级别时先并发获取所有级别的K线再开始计算，值为最大并发数，参见 CKLinePrefetcher，默认为 None 即边取边算
+        self.kl_fetch_concurrency = conf.get("kl_fetch_concurrency", None)
+        # 只从数据源获取lv_list中最小级别的K线，其余级别都由它逐根合成（包括还没走完的K线），参见 CKLineResampler，默认为 False
+        self.kl_resample = conf.get("kl_resample", False)
+        # kl_resample 时分钟级别K线的交易时段，如 ["09:30-11:30", "13:00-15:00"]，默认为 None 即按自然时间每N分钟一根（全天交易）
+        self.kl_resample_session = conf.get("kl_resample_session", None)
+        # 统计每个级别各计算阶段的累计耗时/调用次数以及虚笔改写、线段重算的个数，参见 CChan.get_profile，默认为 False
+        self.profile = conf.get("profile", False)
         # 打印K线不一致的明细，默认为 True
         self.print_warning = conf.get("print_warning", True)
         # 计算发生错误时打印因为什么时间的K线数据导致的，默认为 False
@@ -11,7 +11,7 @@ class CCombine_Item:
             self.time_end = item.end_klc.idx
             self.high = item._high()
             self.low = item._low()
-        elif type(item) == CKLine_Unit:
+        elif isinstance(item, CKLine_Unit):
             self.time_begin = item.time
             self.time_end = item.time
             self.high = item.high
@@ -1,6 +1,6 @@
 from typing import Generic, Iterable, List, Optional, Self, TypeVar, Union, overload
 
-from Common.cache import make_cache
+from Common.cache import cache_slots, make_cache, new_cache_gen
 from Common.CEnum import FX_TYPE, KLINE_DIR
 from Common.ChanException import CChanException, ErrCode
 from KLine.KLine_Unit import CKLine_Unit
@@ -14,6 +14,11 @@ class CKLineCombiner(Generic[T]):
     """
     K线合并器
     """
+    __slots__ = (
+        "__time_begin", "__time_end", "__high", "__low", "__lst", "__dir", "__fx", "__pre", "__next",
+        "_time_end",  # try_add 合并时写入的结束时间，注意不是 time_end 属性
+    ) + cache_slots("get_high_peak_klu", "get_low_peak_klu")
+
     def __init__(self, kl_unit: T, _dir):
         item = CCombine_Item(kl_unit)
         self.__time_begin = item.time_begin
@@ -27,9 +32,10 @@ class CKLineCombiner(Generic[T]):
         self.__fx = FX_TYPE.UNKNOWN
         self.__pre: Optional[Self] = None
         self.__next: Optional[Self] = None
+        self.clean_cache()
 
     def clean_cache(self):
-        self._memoize_cache = {}
+        self._cache_gen = new_cache_gen()
 
     @property
     def time_begin(self): return self.__time_begin
@@ -88,6 +94,11 @@ class CKLineCombiner(Generic[T]):
         # only for deepcopy
         self.__fx = fx
 
+    def set_high_low(self, high, low):
+        # only for deepcopy
+        self.__high = high
+        self.__low = low
+
     def try_add(self, unit_kl: T, exclude_included=False, allow_top_equal=None):
         # allow_top_equal = None普通模式
         # allow_top_equal = 1 被包含，顶部相等不合并
@@ -115,6 +115,26 @@ class MACD_ALGO(Enum):
     RSI = auto()
 
 
+class CHAN_EVENT(Enum):
+    # 参见 CChan.add_event_listener
+    BI_NEW = auto()  # 新增一笔（可能是虚笔）
+    BI_EXTEND = auto()  # 笔的终点变了
+    BI_SURE = auto()  # 笔确定
+    BI_REMOVE = auto()  # 笔被删掉
+    SEG_NEW = auto()
+    SEG_EXTEND = auto()
+    SEG_SURE = auto()
+    SEG_REMOVE = auto()
+    ZS_NEW = auto()  # 新形成中枢
+    ZS_EXTEND = auto()  # 中枢的终点变了
+    ZS_COMBINE = auto()  # 中枢合并了后面的中枢
+    ZS_REMOVE = auto()
+    BSP_ADD = auto()  # 新增买卖点；已有买卖点的类别变化时先REMOVE再ADD
+    BSP_REMOVE = auto()
+    SEG_BSP_ADD = auto()  # 线段买卖点
+    SEG_BSP_REMOVE = auto()
+
+
 class DataField:
     FIELD_TIME = "time_key"
     FIELD_OPEN = "open"  # 开盘价
@@ -1,7 +1,13 @@
-from datetime import datetime
+import time
+from datetime import date
+
+_DAY_MINUTES = {}  # YYYYMMDD -> 当天0点距离公元元年的分钟数
 
 
 class CTime:
+    # ts: 不经过时区换算的整数秒，只用来比较先后；date_int: YYYYMMDD 形式的日期
+    __slots__ = ("year", "month", "day", "hour", "minute", "second", "auto", "ts", "date_int", "_str")
+
     def __init__(self, year, month, day, hour, minute, second=0, auto=True):
         self.year = year
         self.month = month
@@ -10,19 +16,46 @@ class CTime:
         self.minute = minute
         self.second = second
         self.auto = auto  # 自适应对天的理解。很奇怪的设计，自动把0点0分的K线改成23点59分，如果是B圈的分钟线，会强行改错，无法继续读入
-        self.set_timestamp()  # set self.ts
+        self._str = None
+        # set_timestamp 的内联版本，构造非常频繁
+        self.date_int = date_int = (year*100 + month)*100 + day
+        day_minutes = _DAY_MINUTES.get(date_int)
+        if day_minutes is None:
+            day_minutes = _DAY_MINUTES[date_int] = date(year, month, day).toordinal()*1440
+        if hour == 0 and minute == 0 and auto:
+            self.ts = (day_minutes + 1439)*60 + second
+        else:
+            self.ts = (day_minutes + hour*60 + minute)*60 + second
+
+    @classmethod
+    def from_packed(cls, v: int, auto=True) -> 'CTime':
+        # YYYYMMDDhhmmss 形式的整数（列式存储/缓存里的时间）
+        v, second = divmod(v, 100)
+        v, minute = divmod(v, 100)
+        v, hour = divmod(v, 100)
+        v, day = divmod(v, 100)
+        year, month = divmod(v, 100)
+        return cls(year, month, day, hour, minute, second, auto=auto)
+
+    @classmethod
+    def from_epoch(cls, epoch: float, auto=True) -> 'CTime':
+        # unix 时间戳（秒），按本地时区转换，如 ccxt 返回的毫秒时间戳/1000
+        t = time.localtime(epoch)
+        return cls(t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, auto=auto)
+
+    def packed(self) -> int:
+        return ((self.date_int*100 + self.hour)*100 + self.minute)*100 + self.second
 
     def __str__(self):
-        if self.hour == 0 and self.minute == 0:
-            return f"{self.year:04}/{self.month:02}/{self.day:02}"
-        else:
-            return f"{self.year:04}/{self.month:02}/{self.day:02} {self.hour:02}:{self.minute:02}"
+        return self.to_str()
 
     def to_str(self):
-        if self.hour == 0 and self.minute == 0:
-            return f"{self.year:04}/{self.month:02}/{self.day:02}"
-        else:
-            return f"{self.year:04}/{self.month:02}/{self.day:02} {self.hour:02}:{self.minute:02}"
+        if self._str is None:
+            if self.hour == 0 and self.minute == 0:
+                self._str = f"{self.year:04}/{self.month:02}/{self.day:02}"
+            else:
+                self._str = f"{self.year:04}/{self.month:02}/{self.day:02} {self.hour:02}:{self.minute:02}"
+        return self._str
 
     def toDateStr(self, splt=''):
         return f"{self.year:04}{splt}{self.month:02}{splt}{self.day:02}"
@@ -31,11 +64,27 @@ class CTime:
         return CTime(self.year, self.month, self.day, 0, 0, auto=False)
 
     def set_timestamp(self):
+        self.date_int = (self.year*100 + self.month)*100 + self.day
         if self.hour == 0 and self.minute == 0 and self.auto:
-            date = datetime(self.year, self.month, self.day, 23, 59, self.second)
+            minutes = 23*60 + 59
         else:
-            date = datetime(self.year, self.month, self.day, self.hour, self.minute, self.second)
-        self.ts = date.timestamp()
+            minutes = self.hour*60 + self.minute
+        self.ts = (date(self.year, self.month, self.day).toordinal()*1440 + minutes)*60 + self.second
+
+    def __eq__(self, t2):
+        return isinstance(t2, CTime) and self.ts == t2.ts
+
+    def __ne__(self, t2):
+        return not self.__eq__(t2)
+
+    def __hash__(self):
+        return hash(self.ts)
+
+    def __lt__(self, t2):
+        return self.ts < t2.ts
+
+    def __le__(self, t2):
+        return self.ts <= t2.ts
 
     def __gt__(self, t2):
         return self.ts > t2.ts
@@ -21,6 +21,8 @@ class ErrCode(IntEnum):
     FEATURE_ERROR = 16
     CONFIG_ERROR = 17
     SRC_DATA_FORMAT_ERROR = 18
+    STEP_CHECK_ERR = 19
+    CHAN_FILE_ERR = 20
     _CHAN_ERR_END = 99
 
     # Trade Error
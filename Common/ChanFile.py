@@ -0,0 +1,372 @@
+"""
+CChan.save/CChan.load_file 使用的二进制格式
+
+整体是一个对象图：所有自定义类的对象按类分表，同一个类的所有对象的同一个属性存成一列，
+数值列（K线价格，指标，各种idx，枚举）都是连续的numpy数组，对象之间的引用存成对象编号
+K线这种数量最多的对象天然就是列式存储，笔/线段/中枢/买卖点通过编号互相引用，不需要pickle那样递归展开
+
+文件结构：
+    MAGIC(8字节) + 版本号(uint32) + 保留(uint32) + header长度(uint64)
+    header: utf-8 json，描述每张表每一列的类型以及数据在data区的位置
+    data: 按ALIGN对齐的各个数组，可以直接mmap之后np.frombuffer读取
+"""
+
+import importlib
+import json
+import mmap
+import os
+import struct
+from collections import defaultdict, deque
+from enum import Enum
+from typing import Dict, List
+
+import numpy as np
+
+from .cache import CACHE_ATTR_PREFIX, CACHE_GEN_ATTR
+from .ChanException import CChanException, ErrCode
+
+MAGIC = b"CCHANBIN"
+FORMAT_VERSION = 1
+ALIGN = 64
+PREFIX = struct.Struct("<8sIIQ")
+
+# 不保存的属性：泛型信息，迭代器，检查点，事件监听；另外 make_cache 的缓存值也不保存（只保留缓存代数）
+SKIP_ATTR = {"__orig_class__", "g_kl_iters", "chan_checkpoint", "checkpoint", "last_klu_checkpoint", "event_tracker", "event_listener_lst", "profiler"}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FACTORY = {"list": list, "dict": dict, "int": int, "float": float, "set": set}
+
+
+SCALAR_TYPES = {type(None), bool, int, float, str}
+
+
+class _Missing:
+    pass
+
+
+MISSING = _Missing()  # 同一个类的对象属性不完全一致时（比如没有计算rsi），缺失的位置用这个占位
+
+
+def cls_path(cls) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def import_cls(path: str):
+    module_name, qualname = path.split(":")
+    # 只允许加载本项目里的类
+    top_name = module_name.split(".")[0]
+    if not (os.path.isdir(os.path.join(REPO_ROOT, top_name)) or os.path.isfile(os.path.join(REPO_ROOT, f"{top_name}.py"))):
+        raise CChanException(f"不支持加载{path}", ErrCode.CHAN_FILE_ERR)
+    obj = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+_slot_names_cache: Dict[type, List[str]] = {}
+
+
+def slot_names(cls) -> List[str]:
+    if cls in _slot_names_cache:
+        return _slot_names_cache[cls]
+    res = []
+    for klass in cls.__mro__:
+        for name in getattr(klass, "__slots__", ()):
+            if name in ("__dict__", "__weakref__"):
+                continue
+            if name.startswith("__") and not name.endswith("__"):
+                name = f"_{klass.__name__.lstrip('_')}{name}"
+            res.append(name)
+    _slot_names_cache[cls] = res
+    return res
+
+
+def get_state(obj) -> dict:
+    state = {}
+    for name in slot_names(type(obj)):
+        if hasattr(obj, name):
+            state[name] = getattr(obj, name)
+    state.update(getattr(obj, "__dict__", {}))
+    return {k: v for k, v in state.items() if k not in SKIP_ATTR and not (k.startswith(CACHE_ATTR_PREFIX) and k != CACHE_GEN_ATTR)}
+
+
+def set_state(obj, state: dict, slots: set):
+    if not slots:
+        obj.__dict__ = state
+        return
+    for k, v in state.items():
+        if k in slots:
+            object.__setattr__(obj, k, v)
+        else:
+            obj.__dict__[k] = v
+
+
+def int_array(values) -> np.ndarray:
+    arr = np.asarray(values, dtype=np.int64)
+    if len(arr) == 0:
+        return arr.astype(np.int8)
+    lo, hi = int(arr.min()), int(arr.max())
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return arr.astype(dtype)
+    return arr
+
+
+class CChanFileWriter:
+    def __init__(self):
+        self.obj_id: Dict[int, int] = {}
+        self.tables: Dict[type, list] = {}
+        self.states: Dict[int, dict] = {}
+        self.blobs: List[bytes] = []
+        self.size = 0
+        # 除了defaultdict，值的类型只取决于type(v)，缓存起来
+        self.type_kind: Dict[type, str] = {
+            _Missing: "missing", type(None): "none", bool: "bool", int: "int", float: "float", str: "str",
+            list: "list", tuple: "tuple", deque: "deque", dict: "dict", np.ndarray: "ndarray",
+        }
+
+    def value_kind(self, v) -> str:
+        t = type(v)
+        if t in self.type_kind:
+            return self.type_kind[t]
+        if t is defaultdict:
+            factory = v.default_factory
+            if factory is not None and DEFAULT_FACTORY.get(factory.__name__) is not factory:
+                raise CChanException(f"defaultdict不支持{factory}", ErrCode.CHAN_FILE_ERR)
+            return f"defaultdict:{'' if factory is None else factory.__name__}"
+        if issubclass(t, (bool, np.bool_)):
+            kind = "bool"
+        elif issubclass(t, (int, np.integer)) and not issubclass(t, Enum):
+            kind = "int"
+        elif issubclass(t, (float, np.floating)):
+            kind = "float"
+        elif issubclass(t, Enum):
+            kind = f"enum:{cls_path(t)}"
+        elif issubclass(t, type):
+            kind = "cls"
+        elif (hasattr(v, "__dict__") or slot_names(t)) and not callable(v) and not issubclass(t, (str, list, tuple, dict)):
+            kind = "ref"
+        else:
+            raise CChanException(f"不支持保存{t}", ErrCode.CHAN_FILE_ERR)
+        self.type_kind[t] = kind
+        return kind
+
+    def collect(self, root):
+        # 广度优先找到所有需要保存的对象，按类分表
+        queue = [root]
+        self.obj_id[id(root)] = -1
+        self.tables.setdefault(type(root), []).append(root)
+        queue_idx = 0
+        while queue_idx < len(queue):
+            obj = queue[queue_idx]
+            queue_idx += 1
+            state = self.states[id(obj)] = get_state(obj)
+            stack = list(state.values())
+            while stack:
+                v = stack.pop()
+                t = type(v)
+                if t in SCALAR_TYPES:
+                    continue
+                if t is list or t is tuple or t is deque:
+                    stack.extend(v)
+                elif t is dict or t is defaultdict:
+                    stack.extend(v.keys())
+                    stack.extend(v.values())
+                elif id(v) not in self.obj_id and self.value_kind(v) == "ref":
+                    self.obj_id[id(v)] = -1
+                    self.tables.setdefault(type(v), []).append(v)
+                    queue.append(v)
+        global_idx = 0
+        for objs in self.tables.values():
+            for obj in objs:
+                self.obj_id[id(obj)] = global_idx
+                global_idx += 1
+
+    def add_buffer(self, arr: np.ndarray) -> list:
+        arr = np.ascontiguousarray(arr)
+        pad = (-self.size) % ALIGN
+        if pad:
+            self.blobs.append(b"\0" * pad)
+            self.size += pad
+        offset = self.size
+        self.blobs.append(arr.tobytes())
+        self.size += arr.nbytes
+        return [offset, arr.dtype.str, list(arr.shape)]
+
+    def encode_column(self, values: list) -> dict:
+        kinds = [self.value_kind(v) for v in values]
+        kind_lst = list(dict.fromkeys(kinds))
+        if len(kind_lst) == 1:
+            return self.encode_kind(kind_lst[0], values)
+        # 混合类型：记录每个元素的类型，各个类型的元素分别成列
+        code = {kind: i for i, kind in enumerate(kind_lst)}
+        return {
+            "t": "union",
+            "tag": self.add_buffer(np.array([code[kind] for kind in kinds], dtype=np.uint8)),
+            "cols": [self.encode_kind(kind, [v for v, k in zip(values, kinds) if k == kind]) for kind in kind_lst],
+        }
+
+    def encode_kind(self, kind: str, values: list) -> dict:
+        if kind in ("missing", "none"):
+            return {"t": kind, "n": len(values)}
+        if kind == "bool":
+            return {"t": kind, "v": self.add_buffer(np.array(values, dtype=np.bool_))}
+        if kind == "int":
+            return {"t": kind, "v": self.add_buffer(int_array(values))}
+        if kind == "float":
+            return {"t": kind, "v": self.add_buffer(np.array(values, dtype=np.float64))}
+        if kind == "str":
+            return {"t": kind, "v": values}
+        if kind == "cls":
+            return {"t": kind, "v": [cls_path(v) for v in values]}
+        if kind.startswith("enum:"):
+            member_idx = {member: i for i, member in enumerate(type(values[0]))}
+            return {"t": "enum", "cls": kind[5:], "v": self.add_buffer(int_array([member_idx[v] for v in values]))}
+        if kind == "ndarray":
+            return {"t": kind, "v": [self.add_buffer(v) for v in values]}
+        if kind == "ref":
+            return {"t": kind, "v": self.add_buffer(int_array([self.obj_id[id(v)] for v in values]))}
+        if kind in ("list", "tuple", "deque"):
+            res = {
+                "t": kind,
+                "len": self.add_buffer(int_array([len(v) for v in values])),
+                "item": self.encode_column([item for v in values for item in v]),
+            }
+            if kind == "deque":
+                res["maxlen"] = self.encode_column([v.maxlen for v in values])
+            return res
+        assert kind == "dict" or kind.startswith("defaultdict:")
+        return {
+            "t": kind,
+            "len": self.add_buffer(int_array([len(v) for v in values])),
+            "key": self.encode_column([k for v in values for k in v.keys()]),
+            "val": self.encode_column([val for v in values for val in v.values()]),
+        }
+
+    def dump(self, root, path: str):
+        self.collect(root)
+        tables = []
+        for cls, objs in self.tables.items():
+            states = [self.states[id(obj)] for obj in objs]
+            attrs = list(dict.fromkeys(k for state in states for k in state))
+            tables.append({
+                "cls": cls_path(cls),
+                "n": len(objs),
+                "cols": {attr: self.encode_column([state.get(attr, MISSING) for state in states]) for attr in attrs},
+            })
+        header = json.dumps({"root": self.obj_id[id(root)], "tables": tables}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        data_begin = PREFIX.size + len(header)
+        header += b" " * ((-data_begin) % ALIGN)
+        with open(path, "wb") as f:
+            f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+            f.write(header)
+            for blob in self.blobs:
+                f.write(blob)
+
+
+class CChanFileReader:
+    def __init__(self, path: str, use_mmap=True):
+        with open(path, "rb") as f:
+            prefix = f.read(PREFIX.size)
+            if len(prefix) < PREFIX.size:
+                raise CChanException(f"{path}不是CChan文件", ErrCode.CHAN_FILE_ERR)
+            magic, version, _, header_len = PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise CChanException(f"{path}不是CChan文件", ErrCode.CHAN_FILE_ERR)
+            if version != FORMAT_VERSION:
+                raise CChanException(f"{path}的格式版本为{version}，当前只支持{FORMAT_VERSION}", ErrCode.CHAN_FILE_ERR)
+            self.header = json.loads(f.read(header_len).decode("utf-8"))
+            self.data_begin = PREFIX.size + header_len
+            if use_mmap:
+                # 写时复制：加载出来的数组可以修改，但不会写回文件
+                self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            else:
+                f.seek(0)
+                self.buf = bytearray(f.read())
+        self.objs: list = []
+
+    def get_buffer(self, ref: list) -> np.ndarray:
+        offset, dtype, shape = ref
+        count = int(np.prod(shape))
+        if count == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.frombuffer(self.buf, dtype=dtype, count=count, offset=self.data_begin + offset).reshape(shape)
+
+    def decode_column(self, desc: dict) -> list:
+        t = desc["t"]
+        if t == "union":
+            cols = [iter(self.decode_column(col)) for col in desc["cols"]]
+            return [next(cols[tag]) for tag in self.get_buffer(desc["tag"]).tolist()]
+        if t == "missing":
+            return [MISSING] * desc["n"]
+        if t == "none":
+            return [None] * desc["n"]
+        if t in ("bool", "int", "float"):
+            return self.get_buffer(desc["v"]).tolist()
+        if t == "str":
+            return desc["v"]
+        if t == "cls":
+            return [import_cls(path) for path in desc["v"]]
+        if t == "enum":
+            members = list(import_cls(desc["cls"]))
+            return [members[i] for i in self.get_buffer(desc["v"]).tolist()]
+        if t == "ndarray":
+            return [self.get_buffer(ref) for ref in desc["v"]]
+        if t == "ref":
+            objs = self.objs
+            return [objs[i] for i in self.get_buffer(desc["v"]).tolist()]
+        lens = self.get_buffer(desc["len"]).tolist()
+        if t in ("list", "tuple", "deque"):
+            items = self.decode_column(desc["item"])
+            res = []
+            begin = 0
+            for n in lens:
+                res.append(items[begin:begin+n])
+                begin += n
+            if t == "tuple":
+                return [tuple(v) for v in res]
+            if t == "deque":
+                return [deque(v, maxlen=maxlen) for v, maxlen in zip(res, self.decode_column(desc["maxlen"]))]
+            return res
+        keys = self.decode_column(desc["key"])
+        vals = self.decode_column(desc["val"])
+        res = []
+        begin = 0
+        for n in lens:
+            d = dict(zip(keys[begin:begin+n], vals[begin:begin+n]))
+            if t.startswith("defaultdict:"):
+                factory_name = t.split(":")[1]
+                d = defaultdict(DEFAULT_FACTORY[factory_name] if factory_name else None, d)
+            res.append(d)
+            begin += n
+        return res
+
+    def load(self):
+        # 先创建所有对象，引用才能直接解析成对象
+        table_cls = []
+        for table in self.header["tables"]:
+            cls = import_cls(table["cls"])
+            table_cls.append(cls)
+            self.objs.extend(cls.__new__(cls) for _ in range(table["n"]))
+        begin = 0
+        for table, cls in zip(self.header["tables"], table_cls):
+            objs = self.objs[begin:begin+table["n"]]
+            begin += table["n"]
+            states: List[dict] = [{} for _ in objs]
+            for attr, desc in table["cols"].items():
+                for state, v in zip(states, self.decode_column(desc)):
+                    if v is not MISSING:
+                        state[attr] = v
+            slots = set(slot_names(cls))
+            for obj, state in zip(objs, states):
+                set_state(obj, state, slots)
+        return self.objs[self.header["root"]]
+
+
+def dump_obj(obj, path: str):
+    CChanFileWriter().dump(obj, path)
+
+
+def load_obj(path: str, use_mmap=True):
+    return CChanFileReader(path, use_mmap).load()
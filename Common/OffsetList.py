@@ -0,0 +1,80 @@
+from typing import Generic, Iterator, List, TypeVar, Union, overload
+
+T = TypeVar('T')
+
+
+class COffsetList(Generic[T]):
+    """
+    按元素idx（从0开始连续递增）访问的列表，头部已经确定的历史可以裁掉（参见 CKLine_List.trim_history）
+    offset 是第一个保留元素的idx，len() 返回 offset + 保留的个数，和没有裁剪时一致
+    非负下标和切片都按idx理解，负下标仍然从尾部数；访问裁掉的元素抛 IndexError，切片自动去掉裁掉的部分
+    """
+    __slots__ = ("offset", "lst")
+
+    def __init__(self):
+        self.offset = 0
+        self.lst: List[T] = []
+
+    def __len__(self):
+        return self.offset + len(self.lst)
+
+    def __bool__(self):
+        return len(self.lst) > 0
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self.lst)
+
+    def __reversed__(self) -> Iterator[T]:
+        return reversed(self.lst)
+
+    def pos(self, index: int) -> int:
+        if index < 0:
+            return index
+        if index < self.offset:
+            raise IndexError(f"index {index} has been trimmed, offset={self.offset}")
+        return index - self.offset
+
+    def pos_slice(self, index: slice) -> slice:
+        start, stop, step = index.indices(len(self))
+        if step > 0:
+            if start < self.offset:
+                start += (self.offset - start + step - 1) // step * step
+            return slice(start - self.offset, max(stop - self.offset, 0), step)
+        if start < self.offset:
+            return slice(0, 0)
+        return slice(start - self.offset, stop - self.offset if stop >= self.offset else None, step)
+
+    @overload
+    def __getitem__(self, index: int) -> T: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[T]: ...
+
+    def __getitem__(self, index: Union[slice, int]) -> Union[List[T], T]:
+        if type(index) is slice:
+            return self.lst[self.pos_slice(index)]
+        return self.lst[self.pos(index)] if self.offset else self.lst[index]
+
+    def __delitem__(self, index: Union[slice, int]):
+        if isinstance(index, slice):
+            del self.lst[self.pos_slice(index)]
+        else:
+            del self.lst[self.pos(index)]
+
+    def append(self, item: T):
+        self.lst.append(item)
+
+    def extend(self, items):
+        self.lst.extend(items)
+
+    def pop(self, index: int = -1) -> T:
+        return self.lst.pop(self.pos(index))
+
+    def trim(self, begin: int) -> List[T]:
+        # 裁掉idx小于begin的元素，返回裁掉的部分
+        if begin <= self.offset:
+            return []
+        trimmed = self.lst[:begin - self.offset]
+        del self.lst[:begin - self.offset]
+        self.offset = begin
+        return trimmed
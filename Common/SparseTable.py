@@ -0,0 +1,78 @@
+from typing import List
+
+import numpy as np
+
+LINEAR_SCAN_MAX = 32  # 区间长度不超过这个值时直接遍历比查稀疏表（需要先增量更新）更快
+
+
+def grow_array(arr: np.ndarray, size: int, fill=np.nan) -> np.ndarray:
+    if size <= len(arr):
+        return arr
+    new_arr = np.full(max(size, len(arr)*2, 1024), fill, dtype=arr.dtype)
+    new_arr[:len(arr)] = arr
+    return new_arr
+
+
+class CSparseTable:
+    # table[k][j] = op(values[j:j+2**k])，可以在尾部增量扩展，区间最值O(1)查询
+    def __init__(self, is_max: bool):
+        self.is_max = is_max
+        self.size = 0
+        self.table: List[np.ndarray] = []
+
+    def extend(self, values: np.ndarray, size: int):
+        if size <= self.size:
+            return
+        k = 0
+        while (1 << k) <= size:
+            if k == len(self.table):
+                self.table.append(np.full(0, np.nan))
+            self.table[k] = grow_array(self.table[k], size)
+            lo, hi = max(self.size - (1 << k) + 1, 0), size - (1 << k) + 1
+            if k == 0:
+                self.table[0][lo:hi] = values[lo:hi]
+            else:
+                half = 1 << (k-1)
+                self.table[k][lo:hi] = self.op()(self.table[k-1][lo:hi], self.table[k-1][lo+half:hi+half])
+            k += 1
+        self.size = size
+
+    def query(self, begin, end) -> float:
+        k = (end - begin + 1).bit_length() - 1
+        return float(self.op()(self.table[k][begin], self.table[k][end - (1 << k) + 1]))
+
+    def op(self):
+        return np.fmax if self.is_max else np.fmin
+
+
+class CArgSparseTable:
+    # 和 CSparseTable 一样，但是记录的是最大值所在的下标，相同的最大值取最靠后的那个
+    def __init__(self):
+        self.size = 0
+        self.values = np.full(1024, -np.inf)
+        self.table: List[np.ndarray] = []
+
+    def extend(self, values: np.ndarray, size: int):
+        if size <= self.size:
+            return
+        self.values = grow_array(self.values, size, -np.inf)
+        self.values[self.size:size] = values[self.size:size]
+        k = 0
+        while (1 << k) <= size:
+            if k == len(self.table):
+                self.table.append(np.zeros(0, dtype=np.int64))
+            self.table[k] = grow_array(self.table[k], size, 0)
+            lo, hi = max(self.size - (1 << k) + 1, 0), size - (1 << k) + 1
+            if k == 0:
+                self.table[0][lo:hi] = np.arange(lo, hi)
+            else:
+                half = 1 << (k-1)
+                left, right = self.table[k-1][lo:hi], self.table[k-1][lo+half:hi+half]
+                self.table[k][lo:hi] = np.where(self.values[right] >= self.values[left], right, left)
+            k += 1
+        self.size = size
+
+    def query(self, begin, end) -> int:
+        k = (end - begin + 1).bit_length() - 1
+        left, right = int(self.table[k][begin]), int(self.table[k][end - (1 << k) + 1])
+        return right if self.values[right] >= self.values[left] else left
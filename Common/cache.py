@@ -1,8 +1,28 @@
 import inspect
-import types
+import itertools
+
+CACHE_GEN_ATTR = "_cache_gen"  # 对象当前的缓存代数，clean_cache 时换成新的代数，旧代数的缓存值全部失效
+CACHE_ATTR_PREFIX = "_cache_"
+
+_CACHE_GEN = itertools.count(1)
+
+
+def new_cache_gen() -> int:
+    # 全局递增，任何两次 clean_cache 得到的代数都不相同
+    return next(_CACHE_GEN)
+
+
+def cache_slots(*func_names: str) -> tuple:
+    # 使用 __slots__ 的类需要为每个 @make_cache 的方法预留字段
+    return (CACHE_GEN_ATTR,) + tuple(CACHE_ATTR_PREFIX + name for name in func_names)
 
 
 class make_cache:
+    """
+    无参方法的结果缓存，每个方法的结果存在对象自己的字段 _cache_<方法名> 里，内容是 (代数, 结果)
+    类创建完成后会把自己换成普通函数，调用时不再经过描述符，也不用每次创建绑定方法
+    使用的类需要实现 clean_cache 方法：self._cache_gen = new_cache_gen()，并在 __init__ 中调用一次
+    """
     def __init__(self, func):
         self.func = func
 
@@ -10,25 +30,25 @@ class make_cache:
         if len(fargspec.args) != 1 or fargspec.args[0] != "self":
             raise Exception("@memoize must be `(self)`")
 
-        # set key for this function
-        self.func_key = str(func)
+    def __set_name__(self, owner, name):
+        func = self.func
+        attr = CACHE_ATTR_PREFIX + name
+        if owner.__dictoffset__ == 0 and not any(attr in getattr(klass, "__slots__", ()) for klass in owner.__mro__):
+            raise Exception(f"{owner.__name__}.__slots__ must contain {attr}, see cache_slots")
+
+        def cached_func(self):
+            entry = getattr(self, attr, None)
+            if entry is not None and entry[0] == self._cache_gen:
+                return entry[1]
+            result = func(self)
+            setattr(self, attr, (self._cache_gen, result))
+            return result
+
+        cached_func.__name__ = func.__name__
+        cached_func.__qualname__ = func.__qualname__
+        cached_func.__doc__ = func.__doc__
+        cached_func.__wrapped__ = func
+        setattr(owner, name, cached_func)
 
     def __get__(self, instance, cls):
-        if instance is None:
-            raise Exception("@memoize's must be bound")
-
-        if not hasattr(instance, "_memoize_cache"):
-            setattr(instance, "_memoize_cache", {})
-
-        return types.MethodType(self, instance)
-
-    def __call__(self, *args, **kwargs):
-        instance = args[0]
-        cache = instance._memoize_cache
-
-        if self.func_key in cache:
-            return cache[self.func_key]
-
-        result = self.func(*args, **kwargs)
-        cache[self.func_key] = result
-        return result
+        raise Exception("@memoize's must be bound")
@@ -1,4 +1,8 @@
+import re
+from typing import Optional
+
 from .CEnum import BI_DIR, KL_TYPE
+from .ChanException import CChanException, ErrCode
 
 
 def kltype_lt_day(_type):
@@ -53,3 +57,20 @@ def _parse_inf(v):
         if v == float("-inf"):
             v = 'float("-inf")'
     return v
+
+
+def date2int(date: Optional[str], is_end: bool) -> Optional[int]:
+    # '2023-09-10' / '2023-09-10 10:30' / '20230910' -> 和 pack_time 一样的 YYYYMMDDhhmmss 整数
+    if date is None:
+        return None
+    digits = re.sub(r"\D", "", str(date))[:14]
+    if len(digits) < 8:
+        raise CChanException(f"unknown date format: {date}", ErrCode.PARA_ERROR)
+    if len(digits) == 8 and is_end:
+        return int(digits) * 1000000 + 235959
+    return int(digits.ljust(14, "0"))
+
+
+def int2date(v: int) -> str:
+    day = v // 1000000
+    return f"{day//10000:04}-{day//100 % 100:02}-{day % 100:02}"
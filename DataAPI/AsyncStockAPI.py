@@ -0,0 +1,196 @@
+import abc
+import asyncio
+import threading
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Type
+
+from Common.CEnum import AUTYPE, KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+from KLine.KLine_Unit import CKLine_Unit
+
+from .CacheAPI import CKLineCacheData
+from .CommonStockAPI import CCommonStockApi, get_api_lock
+
+
+def run_coroutine(coro):
+    # 在同步代码里运行协程；当前线程已经有事件循环在跑（如jupyter）时放到新线程里运行
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    res = {}
+
+    def run():
+        try:
+            res["value"] = asyncio.run(coro)
+        except BaseException as e:
+            res["error"] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if "error" in res:
+        raise res["error"]
+    return res["value"]
+
+
+class CAsyncStockApi(CCommonStockApi):
+    """
+    异步数据源：实现 get_kl_data_async（async generator），网络请求用 aiohttp 等异步库，CKLinePrefetcher 可以同时获取多个代码/级别
+    同步的 get_kl_data 由 get_kl_data_async 转换而来，所以也可以直接作为 CChan 的数据源使用（每次调用单独跑一个事件循环）
+    do_init/do_close（异步调用方用 do_init_async/do_close_async）由调用方负责，get_kl_data 里不会调用：
+        CChan.load 调用 do_init/do_close，CKLinePrefetcher 在自己的事件循环里 await do_init_async/do_close_async
+    需要绑定事件循环的资源（如 aiohttp.ClientSession）在 get_kl_data_async 里面创建和释放
+    """
+    @abc.abstractmethod
+    async def get_kl_data_async(self) -> AsyncIterator[CKLine_Unit]:
+        yield  # 让子类看到这是一个 async generator
+
+    def get_kl_data(self) -> Iterable[CKLine_Unit]:
+        async def collect():
+            return [klu async for klu in self.get_kl_data_async()]
+        yield from run_coroutine(collect())
+
+    @classmethod
+    async def do_init_async(cls):
+        cls.do_init()
+
+    @classmethod
+    async def do_close_async(cls):
+        cls.do_close()
+
+
+async def fetch_kl_data(api_cls: Type[CCommonStockApi], code, k_type: KL_TYPE, begin_date, end_date, autype) -> List[CKLine_Unit]:
+    """
+    异步获取一个代码/级别的全部K线，同步数据源也可以用：
+        异步数据源直接 await
+        同步数据源放到线程池里跑，thread_safe 为 False 的数据源（如 BaoStock 全局共用一个登录连接）同一时间只有一个线程在取
+    """
+    if issubclass(api_cls, CAsyncStockApi):
+        api = api_cls(code=code, k_type=k_type, begin_date=begin_date, end_date=end_date, autype=autype)
+        return [klu async for klu in api.get_kl_data_async()]
+
+    def load():
+        with get_api_lock(api_cls):
+            api = api_cls(code=code, k_type=k_type, begin_date=begin_date, end_date=end_date, autype=autype)
+            return list(api.get_kl_data())
+    return await asyncio.to_thread(load)
+
+
+class CKLinePrefetcher:
+    """
+    并发预取多个代码、多个级别的K线，同时进行的请求数不超过 max_concurrency，取到的K线按列存在内存里
+    get_api_cls() 返回一个从预取结果读取的数据源，直接作为 CChan 的 data_src，用法：
+        prefetcher = CKLinePrefetcher(CBaoStock, lv_list, begin_date, end_date)
+        prefetcher.fetch(code_list)
+        for code in code_list:
+            chan = CChan(code, begin_date, end_date, data_src=prefetcher.get_api_cls(), lv_list=lv_list)
+    某个代码/级别获取失败时记录异常，CChan 读取它时再抛出，和直接访问数据源的表现一致（如 auto_skip_illegal_sub_lv 依然生效）
+    """
+    def __init__(
+        self,
+        api_cls: Type[CCommonStockApi],
+        lv_list: List[KL_TYPE],
+        begin_date=None,
+        end_date=None,
+        autype: AUTYPE = AUTYPE.QFQ,
+        max_concurrency: int = 8,
+    ):
+        if max_concurrency < 1:
+            raise CChanException(f"max_concurrency必须大于0，当前为{max_concurrency}", ErrCode.PARA_ERROR)
+        self.api_cls = api_cls
+        self.lv_list = lv_list
+        self.begin_date = begin_date
+        self.end_date = end_date
+        self.autype = autype
+        self.max_concurrency = max_concurrency
+        self.data_dict: Dict[Tuple[str, KL_TYPE], CKLineCacheData] = {}
+        self.error_dict: Dict[Tuple[str, KL_TYPE], Exception] = {}
+        self.api_cls_cache: Optional[Type['CPrefetchStockApi']] = None
+
+    async def fetch_async(self, code_list: List[str], init_api=True):
+        # init_api 为 False 时调用方负责数据源的 do_init/do_close
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_one(code, lv):
+            async with semaphore:
+                try:
+                    klu_lst = await fetch_kl_data(self.api_cls, code, lv, self.begin_date, self.end_date, self.autype)
+                except Exception as e:
+                    self.error_dict[(code, lv)] = e
+                    return
+            self.error_dict.pop((code, lv), None)
+            self.data_dict[(code, lv)] = CKLineCacheData.from_klus(0, klu_lst)
+
+        if init_api:
+            await self.api_init()
+        try:
+            await asyncio.gather(*[fetch_one(code, lv) for code in code_list for lv in self.lv_list])
+        finally:
+            if init_api:
+                await self.api_close()
+
+    def fetch(self, code_list: List[str], init_api=True):
+        run_coroutine(self.fetch_async(code_list, init_api))
+
+    async def api_init(self):
+        if issubclass(self.api_cls, CAsyncStockApi):
+            await self.api_cls.do_init_async()
+        else:
+            await asyncio.to_thread(self.api_cls.do_init)
+
+    async def api_close(self):
+        if issubclass(self.api_cls, CAsyncStockApi):
+            await self.api_cls.do_close_async()
+        else:
+            await asyncio.to_thread(self.api_cls.do_close)
+
+    def get_klus(self, code, k_type: KL_TYPE) -> Iterable[CKLine_Unit]:
+        # 每次都生成新的K线，同一份预取结果可以给多个CChan用
+        if (code, k_type) in self.error_dict:
+            raise self.error_dict[(code, k_type)]
+        if (code, k_type) not in self.data_dict:
+            raise CChanException(f"{code}的{k_type}级别没有预取", ErrCode.SRC_DATA_NOT_FOUND)
+        return self.data_dict[(code, k_type)].iter_klu(None, None)
+
+    def remove(self, code):
+        # 用完之后释放内存
+        for lv in self.lv_list:
+            self.data_dict.pop((code, lv), None)
+            self.error_dict.pop((code, lv), None)
+
+    def get_api_cls(self) -> Type['CPrefetchStockApi']:
+        if self.api_cls_cache is None:
+            self.api_cls_cache = type(f"CPrefetch_{self.api_cls.__name__}", (CPrefetchStockApi,), {"prefetcher": self})
+        return self.api_cls_cache
+
+
+class CPrefetchStockApi(CCommonStockApi):
+    # 读取 CKLinePrefetcher 的预取结果，通过 CKLinePrefetcher.get_api_cls 生成子类
+    prefetcher: CKLinePrefetcher
+    thread_safe = True
+
+    def __init__(self, code, k_type, begin_date=None, end_date=None, autype=None):
+        super(CPrefetchStockApi, self).__init__(code, k_type, begin_date, end_date, autype)
+
+    def get_kl_data(self):
+        yield from self.klu_iter
+
+    def SetBasciInfo(self):
+        # 和其他数据源一样在创建时就检查数据是否存在，获取失败的级别可以被 auto_skip_illegal_sub_lv 跳过
+        prefetcher = self.prefetcher
+        if (self.begin_date, self.end_date, self.autype) != (prefetcher.begin_date, prefetcher.end_date, prefetcher.autype):
+            raise CChanException(
+                f"预取的时间范围/复权方式为{prefetcher.begin_date}~{prefetcher.end_date}/{prefetcher.autype}，"
+                f"当前请求为{self.begin_date}~{self.end_date}/{self.autype}",
+                ErrCode.PARA_ERROR,
+            )
+        self.klu_iter = prefetcher.get_klus(self.code, self.k_type)
+        self.name = self.code
+        self.is_stock = None
+
+    @classmethod
+    def do_init(cls):
+        pass
+
+    @classmethod
+    def do_close(cls):
+        pass
@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Type
+
+import numpy as np
+
+from Common.CEnum import DataField, TRADE_INFO_LST
+from Common.func_util import date2int, int2date
+from KLine.KLine_Store import pack_time, unpack_time
+from KLine.KLine_Unit import CKLine_Unit
+
+from .CommonStockAPI import CCommonStockApi, get_api_lock
+
+CACHE_VERSION = 1
+PRICE_COLUMNS = [DataField.FIELD_OPEN, DataField.FIELD_HIGH, DataField.FIELD_LOW, DataField.FIELD_CLOSE]
+VALUE_COLUMNS = PRICE_COLUMNS + TRADE_INFO_LST
+OVERLAP_CNT = 2  # 增量获取时和缓存重叠的K线数，用来检查除权除息等导致的历史价格变化
+
+
+class CKLineCacheData:
+    """
+    单个 代码/级别/复权方式 的缓存K线，按列存储
+    begin: 缓存覆盖的起始时间（首次下载时的 begin_date），0 表示从最早开始
+    """
+    def __init__(self, begin: int, time: np.ndarray, time_auto: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.begin = begin
+        self.time = time
+        self.time_auto = time_auto
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_klus(cls, begin: int, klu_lst: List[CKLine_Unit]) -> 'CKLineCacheData':
+        columns = {name: np.array([getattr(klu, name) for klu in klu_lst], dtype=np.float64) for name in PRICE_COLUMNS}
+        for name in TRADE_INFO_LST:
+            columns[name] = np.array([np.nan if klu.trade_info.metric[name] is None else klu.trade_info.metric[name] for klu in klu_lst], dtype=np.float64)
+        return cls(
+            begin,
+            np.array([pack_time(klu.time) for klu in klu_lst], dtype=np.int64),
+            np.array([klu.time.auto for klu in klu_lst], dtype=np.bool_),
+            columns,
+        )
+
+    def slice(self, begin_idx, end_idx) -> 'CKLineCacheData':
+        return CKLineCacheData(
+            self.begin,
+            self.time[begin_idx:end_idx],
+            self.time_auto[begin_idx:end_idx],
+            {name: arr[begin_idx:end_idx] for name, arr in self.columns.items()},
+        )
+
+    def concat(self, other: 'CKLineCacheData') -> 'CKLineCacheData':
+        return CKLineCacheData(
+            self.begin,
+            np.concatenate([self.time, other.time]),
+            np.concatenate([self.time_auto, other.time_auto]),
+            {name: np.concatenate([arr, other.columns[name]]) for name, arr in self.columns.items()},
+        )
+
+    def is_consistent(self, new_data: 'CKLineCacheData') -> bool:
+        # 新获取的K线和缓存重叠部分价格不一致（除权除息，数据源修正等），说明缓存已经失效
+        # 缓存的最后一根可能是未走完的K线，不参与比较
+        _, old_idx, new_idx = np.intersect1d(self.time[:-1], new_data.time, assume_unique=True, return_indices=True)
+        for name in PRICE_COLUMNS:
+            if not np.allclose(self.columns[name][old_idx], new_data.columns[name][new_idx], rtol=1e-6, atol=0):
+                return False
+        return True
+
+    def iter_klu(self, begin: Optional[int], end: Optional[int]) -> Iterable[CKLine_Unit]:
+        begin_idx = 0 if begin is None else int(np.searchsorted(self.time, begin, side="left"))
+        end_idx = len(self.time) if end is None else int(np.searchsorted(self.time, end, side="right"))
+        columns = {name: self.columns[name][begin_idx:end_idx].tolist() for name in VALUE_COLUMNS}
+        time_auto = self.time_auto[begin_idx:end_idx].tolist()
+        for i, t in enumerate(self.time[begin_idx:end_idx].tolist()):
+            item_dict = {DataField.FIELD_TIME: unpack_time(t, time_auto[i])}
+            for name in VALUE_COLUMNS:
+                value = columns[name][i]
+                if value == value:  # 跳过nan，即数据源没有提供的字段
+                    item_dict[name] = value
+            yield CKLine_Unit(item_dict, autofix=True)
+
+    def save(self, path):
+        # 先写临时文件再改名，避免多进程/多线程同时读写或者中途退出导致缓存文件损坏
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, version=np.array(CACHE_VERSION), begin=np.array(self.begin), time=self.time, time_auto=self.time_auto, **self.columns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> Optional['CKLineCacheData']:
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != CACHE_VERSION:
+                    return None
+                return cls(int(data["begin"]), data["time"], data["time_auto"], {name: data[name] for name in VALUE_COLUMNS})
+        except Exception:
+            return None  # 缓存文件损坏当作没有缓存
+
+
+class CCacheStockApi(CCommonStockApi):
+    """
+    K线本地缓存，套在任意数据源前面使用（通过 make_cache_api 生成子类）
+    - 每个 数据源/代码/级别/复权方式 一个列式存储的 npz 文件，复权方式不同互不影响
+    - 请求范围被缓存覆盖时直接从磁盘读取，只从数据源获取缓存最后一根K线之后缺失的部分
+    - 增量获取时会和缓存重叠 OVERLAP_CNT 根K线，重叠部分价格变了（除权除息等）就丢弃缓存全部重新获取
+    - 数据源获取失败（如断网）时，如果有缓存则直接使用缓存
+    """
+    api_cls: Type[CCommonStockApi]
+    cache_dir: str
+    api_inited = False
+    thread_safe = True  # 读写缓存可以并发，访问数据源时按 api_cls 的要求加锁
+
+    def __init__(self, code, k_type, begin_date=None, end_date=None, autype=None):
+        super(CCacheStockApi, self).__init__(code, k_type, begin_date, end_date, autype)
+
+    def get_cache_path(self):
+        file_name = re.sub(r"[^\w.\-]", "_", f"{self.code}_{self.k_type.name}_{getattr(self.autype, 'name', self.autype)}")
+        return os.path.join(self.cache_dir, self.api_cls.__name__, f"{file_name}.npz")
+
+    def invalidate(self):
+        path = self.get_cache_path()
+        if os.path.exists(path):
+            os.remove(path)
+
+    @classmethod
+    def invalidate_all(cls):
+        cache_dir = os.path.join(cls.cache_dir, cls.api_cls.__name__)
+        if os.path.isdir(cache_dir):
+            for file_name in os.listdir(cache_dir):
+                if file_name.endswith(".npz"):
+                    os.remove(os.path.join(cache_dir, file_name))
+
+    def fetch(self, begin: int, end_date) -> CKLineCacheData:
+        with get_api_lock(self.api_cls):
+            if not self.api_inited:
+                self.api_cls.do_init()
+                type(self).api_inited = True
+            begin_date = None if begin == 0 else int2date(begin)
+            api = self.api_cls(code=self.code, k_type=self.k_type, begin_date=begin_date, end_date=end_date, autype=self.autype)
+            self.name, self.is_stock = api.name, api.is_stock
+            return CKLineCacheData.from_klus(begin, list(api.get_kl_data()))
+
+    def update_cache(self, cache: Optional[CKLineCacheData]) -> Optional[CKLineCacheData]:
+        # 返回有变化的新缓存，不需要更新时返回 None
+        begin = date2int(self.begin_date, is_end=False) or 0
+        end = date2int(self.end_date, is_end=True)
+        if cache is None or cache.begin > begin:
+            new_data = self.fetch(begin, self.end_date)
+            if cache is None or len(new_data) == 0:
+                return new_data
+            if not cache.is_consistent(new_data):
+                return new_data  # 旧缓存失效，只保留这次获取的范围
+            return new_data.concat(cache.slice(int(np.searchsorted(cache.time, new_data.time[-1], side="right")), None))
+
+        if len(cache) > 0 and end is not None and cache.time[-1] >= end:
+            return None  # 缓存已覆盖请求范围
+        overlap_begin = date2int(int2date(int(cache.time[max(len(cache)-OVERLAP_CNT, 0)])), is_end=False) if len(cache) > 0 else cache.begin
+        try:
+            new_data = self.fetch(overlap_begin, self.end_date)
+        except Exception as e:
+            if len(cache) == 0:
+                raise e
+            print(f"[WARNING-{self.code}]{self.k_type}级别从数据源获取数据失败，使用本地缓存: {e}")
+            return None
+        if len(new_data) == 0:
+            return None
+        if not cache.is_consistent(new_data):
+            print(f"[WARNING-{self.code}]{self.k_type}级别历史数据发生变化（除权除息等），重新获取全部数据")
+            return self.fetch(cache.begin, self.end_date)
+        return cache.slice(None, int(np.searchsorted(cache.time, new_data.time[0], side="left"))).concat(new_data)
+
+    def get_kl_data(self):
+        path = self.get_cache_path()
+        cache = CKLineCacheData.load(path)
+        new_cache = self.update_cache(cache)
+        if new_cache is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            new_cache.save(path)
+            cache = new_cache
+        yield from cache.iter_klu(date2int(self.begin_date, is_end=False), date2int(self.end_date, is_end=True))
+
+    def SetBasciInfo(self):
+        pass  # 名称等信息只有真正访问数据源时才会设置，保证断网时可以只用缓存
+
+    @classmethod
+    def do_init(cls):
+        pass  # 数据源真正需要时才初始化（如登录）
+
+    @classmethod
+    def do_close(cls):
+        if cls.api_inited:
+            cls.api_cls.do_close()
+            cls.api_inited = False
+
+
+_CACHE_API_DICT: Dict[tuple, Type[CCacheStockApi]] = {}
+
+
+def make_cache_api(api_cls: Type[CCommonStockApi], cache_dir: str) -> Type[CCacheStockApi]:
+    key = (api_cls, os.path.abspath(cache_dir))
+    if key not in _CACHE_API_DICT:
+        _CACHE_API_DICT[key] = type(f"CCache_{api_cls.__name__}", (CCacheStockApi,), {"api_cls": api_cls, "cache_dir": key[1]})
+    return _CACHE_API_DICT[key]
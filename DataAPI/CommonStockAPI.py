@@ -1,10 +1,14 @@
 import abc
-from typing import Iterable
+import contextlib
+import threading
+from typing import Dict, Iterable, Type
 
 from KLine.KLine_Unit import CKLine_Unit
 
 
 class CCommonStockApi:
+    thread_safe = False  # 不同实例能否在多个线程里同时获取数据，参见 DataAPI/AsyncStockAPI.py
+
     def __init__(self, code, k_type, begin_date, end_date, autype):
         self.code = code
         self.name = None
@@ -32,3 +36,15 @@ class CCommonStockApi:
     @abc.abstractmethod
     def do_close(cls):
         pass
+
+
+_API_LOCK_DICT: Dict[type, contextlib.AbstractContextManager] = {}
+_API_LOCK_DICT_LOCK = threading.Lock()
+
+
+def get_api_lock(api_cls: Type[CCommonStockApi]):
+    # thread_safe 为 False 的数据源多线程访问时需要加的锁，每个数据源类一把
+    with _API_LOCK_DICT_LOCK:
+        if api_cls not in _API_LOCK_DICT:
+            _API_LOCK_DICT[api_cls] = contextlib.nullcontext() if api_cls.thread_safe else threading.Lock()
+        return _API_LOCK_DICT[api_cls]
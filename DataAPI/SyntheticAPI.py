@@ -0,0 +1,30 @@
+from Benchmark.SyntheticData import iter_klu
+from Common.CEnum import AUTYPE, KL_TYPE
+
+from .CommonStockAPI import CCommonStockApi
+
+
+class CSyntheticAPI(CCommonStockApi):
+    """
+    模拟K线数据源，不需要网络，用于基准测试
+    data_src="custom:SyntheticAPI.CSyntheticAPI"，code 格式为 kind:seed:K线数量，如 rw:1:10000，参见 Benchmark/SyntheticData.py
+    """
+    thread_safe = True
+
+    def __init__(self, code, k_type=KL_TYPE.K_DAY, begin_date=None, end_date=None, autype=AUTYPE.QFQ):
+        super(CSyntheticAPI, self).__init__(code, k_type, begin_date, end_date, autype)
+
+    def get_kl_data(self):
+        yield from iter_klu(self.code, self.k_type)
+
+    def SetBasciInfo(self):
+        self.name = self.code
+        self.is_stock = False
+
+    @classmethod
+    def do_init(cls):
+        pass
+
+    @classmethod
+    def do_close(cls):
+        pass
@@ -1,5 +1,3 @@
-from datetime import datetime
-
 import ccxt
 
 from Common.CEnum import AUTYPE, DataField, KL_TYPE
@@ -35,10 +33,8 @@ class CCXT(CCommonStockApi):
         data = exchange.fetch_ohlcv(self.code, timeframe, since=since_date)
 
         for item in data:
-            time_obj = datetime.fromtimestamp(item[0] / 1000)
-            time_str = time_obj.strftime('%Y-%m-%d %H:%M:%S')
             item_data = [
-                time_str,
+                CTime.from_epoch(item[0] / 1000, auto=not kltype_lt_day(self.k_type)),
                 item[1],
                 item[2],
                 item[3],
@@ -93,5 +89,8 @@ class CCXT(CCommonStockApi):
 
     def create_item_dict(self, data, column_name):
         for i in range(len(data)):
-            data[i] = self.parse_time_column(data[i]) if i == 0 else str2float(data[i])
+            if i == 0:
+                data[i] = data[i] if isinstance(data[i], CTime) else self.parse_time_column(data[i])
+            else:
+                data[i] = str2float(data[i])
         return dict(zip(column_name, data))
@@ -1,9 +1,11 @@
 import os
 
+import numpy as np
+
 from Common.CEnum import DataField, KL_TYPE
 from Common.ChanException import CChanException, ErrCode
 from Common.CTime import CTime
-from Common.func_util import str2float
+from Common.func_util import date2int, str2float
 from KLine.KLine_Unit import CKLine_Unit
 
 from .CommonStockAPI import CCommonStockApi
@@ -40,7 +42,47 @@ def parse_time_column(inp):
     return CTime(year, month, day, hour, minute)
 
 
+# 各种长度的时间字符串里 年月日时分 每一位数字所在的位置，None 表示补 0
+TIME_DIGIT_POS = {
+    10: [0, 1, 2, 3, 5, 6, 8, 9, None, None, None, None],  # 2021-09-13
+    17: list(range(12)),  # 20210902113000000
+    19: [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15],  # 2021-09-13 11:30:00
+}
+
+
+def parse_time_array(time_lst) -> np.ndarray:
+    # 批量解析时间列，返回 YYYYMMDDhhmmss 格式的 int64 数组，支持的格式同 parse_time_column
+    time_arr = np.array(time_lst, dtype=np.bytes_)
+    res = np.zeros(len(time_arr), dtype=np.int64)
+    lens = np.char.str_len(time_arr)
+    for length in np.unique(lens).tolist():
+        if length not in TIME_DIGIT_POS:
+            bad_idx = int(np.nonzero(lens == length)[0][0])
+            raise Exception(f"unknown time column from csv:{time_lst[bad_idx]}")
+        sel = lens == length
+        digits = time_arr[sel].astype(f"S{length}").view(np.uint8).reshape(-1, length).astype(np.int64) - ord("0")
+        digit_pos = [pos for pos in TIME_DIGIT_POS[length] if pos is not None]
+        is_digit = ((digits[:, digit_pos] >= 0) & (digits[:, digit_pos] <= 9)).all(axis=1)
+        if not is_digit.all():
+            bad_idx = int(np.nonzero(sel)[0][np.argmin(is_digit)])
+            raise Exception(f"unknown time column from csv:{time_lst[bad_idx]}")
+        value = np.zeros(len(digits), dtype=np.int64)
+        for pos in TIME_DIGIT_POS[length]:
+            value = value * 10 + (digits[:, pos] if pos is not None else 0)
+        res[sel] = value * 100
+    return res
+
+
+def parse_float_array(value_lst) -> np.ndarray:
+    try:
+        return np.array(list(map(float, value_lst)), dtype=np.float64)
+    except ValueError:  # 有非法数值时逐个处理，和 str2float 行为一致
+        return np.array([str2float(v) for v in value_lst], dtype=np.float64)
+
+
 class CSV_API(CCommonStockApi):
+    thread_safe = True
+
     def __init__(self, code, k_type=KL_TYPE.K_DAY, begin_date=None, end_date=None, autype=None):
         self.headers_exist = True  # 第一行是否是标题，如果是数据，设置为False
         self.columns = [
@@ -62,17 +104,45 @@ class CSV_API(CCommonStockApi):
         if not os.path.exists(file_path):
             raise CChanException(f"file not exist: {file_path}", ErrCode.SRC_DATA_NOT_FOUND)
 
-        for line_number, line in enumerate(open(file_path, 'r')):
-            if self.headers_exist and line_number == 0:
-                continue
-            data = line.strip("\n").split(",")
-            if len(data) != len(self.columns):
-                raise CChanException(f"file format error: {file_path}", ErrCode.SRC_DATA_FORMAT_ERROR)
-            if self.begin_date is not None and data[self.time_column_idx] < self.begin_date:
-                continue
-            if self.end_date is not None and data[self.time_column_idx] > self.end_date:
-                continue
-            yield CKLine_Unit(create_item_dict(data, self.columns))
+        with open(file_path, 'r') as f:
+            lines = f.read().splitlines()
+        if self.headers_exist:
+            lines = lines[1:]
+        while lines and not lines[-1]:
+            lines.pop()
+        if not lines:
+            return
+        # 整个文件一次性按逗号切开，每一列就是一个步长切片
+        fields = ",".join(lines).split(",")
+        column_cnt = len(self.columns)
+        if len(fields) != len(lines) * column_cnt or any(line.count(",") != column_cnt - 1 for line in lines):
+            raise CChanException(f"file format error: {file_path}", ErrCode.SRC_DATA_FORMAT_ERROR)
+        columns = {name: fields[i::column_cnt] for i, name in enumerate(self.columns)}
+        time_arr = parse_time_array(columns[DataField.FIELD_TIME])
+        begin_idx, end_idx = 0, len(time_arr)
+        begin, end = date2int(self.begin_date, is_end=False), date2int(self.end_date, is_end=True)
+        if np.all(time_arr[1:] >= time_arr[:-1]):  # 时间有序时二分查找起止位置
+            if begin is not None:
+                begin_idx = int(np.searchsorted(time_arr, begin, side="left"))
+            if end is not None:
+                end_idx = int(np.searchsorted(time_arr, end, side="right"))
+            row_idx = np.arange(begin_idx, end_idx)
+        else:  # 乱序数据交给后面 kl_data_check 报错
+            mask = np.ones(len(time_arr), dtype=np.bool_)
+            if begin is not None:
+                mask &= time_arr >= begin
+            if end is not None:
+                mask &= time_arr <= end
+            row_idx = np.nonzero(mask)[0]
+
+        value_names = [name for name in self.columns if name != DataField.FIELD_TIME]
+        value_lst = [parse_float_array(columns[name])[row_idx].tolist() for name in value_names]
+        t = time_arr[row_idx] // 100
+        time_lst = [(t // 100000000).tolist(), (t // 1000000 % 100).tolist(), (t // 10000 % 100).tolist(), (t // 100 % 100).tolist(), (t % 100).tolist()]
+        for time_tuple, values in zip(zip(*time_lst), zip(*value_lst)):
+            item_dict = dict(zip(value_names, values))
+            item_dict[DataField.FIELD_TIME] = CTime(*time_tuple)
+            yield CKLine_Unit(item_dict)
 
     def SetBasciInfo(self):
         pass
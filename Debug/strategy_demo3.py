@@ -1,24 +1,7 @@
-import copy
-from typing import List
-
 from Chan import CChan
 from ChanConfig import CChanConfig
-from Common.CEnum import AUTYPE, DataField, DATA_SRC, KL_TYPE
+from Common.CEnum import AUTYPE, DATA_SRC, KL_TYPE
 from DataAPI.BaoStockAPI import CBaoStock
-from KLine.KLine_Unit import CKLine_Unit
-
-
-def combine_60m_klu_form_15m(klu_15m_lst: List[CKLine_Unit]) -> CKLine_Unit:
-    return CKLine_Unit(
-        {
-            DataField.FIELD_TIME: klu_15m_lst[-1].time,
-            DataField.FIELD_OPEN: klu_15m_lst[0].open,
-            DataField.FIELD_CLOSE: klu_15m_lst[-1].close,
-            DataField.FIELD_HIGH: max(klu.high for klu in klu_15m_lst),
-            DataField.FIELD_LOW: min(klu.low for klu in klu_15m_lst),
-        }
-    )
-
 
 if __name__ == "__main__":
     """
@@ -32,30 +15,26 @@ if __name__ == "__main__":
 
     config = CChanConfig({
         "trigger_step": True,
+        "kl_resample": True,  # 60分钟K线由15分钟K线合成
+        "kl_resample_session": ["09:30-11:30", "13:00-15:00"],
     })
 
-    # 快照
-    chan_snapshot = CChan(
+    chan = CChan(
         code=code,
         data_src=data_src_type,
         lv_list=lv_list,
         config=config,
     )
     CBaoStock.do_init()
-    data_src = CBaoStock(code, k_type=KL_TYPE.K_15M, begin_date=begin_time, end_date=end_time, autype=AUTYPE.QFQ)  # 获取最小级别
-
-    klu_15m_lst_tmp: List[CKLine_Unit] = []  # 存储用于合成当前60M K线的15M k线
+    data_src = CBaoStock(code, k_type=KL_TYPE.K_15M, begin_date=begin_time, end_date=end_time, autype=AUTYPE.QFQ)  # 只获取最小级别
 
     for klu_15m in data_src.get_kl_data():  # 获取单根15分钟K线
-        klu_15m_lst_tmp.append(klu_15m)
-        klu_60m = combine_60m_klu_form_15m(klu_15m_lst_tmp)  # 合成60分钟K线
-
         """
-        拷贝一份chan_snapshot
-        如果是用序列化方式，这里可以采用pickle.load()
+        只需要传入15分钟K线，还没走完的60分钟K线会自动合成并加入计算；
+        下一根15分钟K线到来时，CChan内部直接在原处修改这根还没走完的60分钟K线（update_last_klu），它走完之后再开始新的一根，
+        不需要自己 checkpoint/rollback/update_last_bar
         """
-        chan: CChan = copy.deepcopy(chan_snapshot)
-        chan.trigger_load({KL_TYPE.K_60M: [klu_60m], KL_TYPE.K_15M: klu_15m_lst_tmp})
+        chan.trigger_load({KL_TYPE.K_15M: [klu_15m]})
 
         """
         策略开始：
@@ -66,12 +45,4 @@ if __name__ == "__main__":
             print(klu_15m.time, kl_type, sum(len(klc) for klc in ele_manager))
         # 策略结束：
 
-        if len(klu_15m_lst_tmp) == 4:  # 已经完成4根15分钟K线了，说明这个最新的60分钟K线和里面的4根15分钟K线在将来不会再变化
-            """
-            把当前完整chan重新保存成chan_snapshot
-            如果是序列化方式，这里可以采用pickle.dump()
-            """
-            chan_snapshot = chan
-            klu_15m_lst_tmp = []  # 清空1分钟K线，用于下一个五分钟周期的合成
-
     CBaoStock.do_close()
@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from Combiner.KLine_Combiner import CKLineCombiner
 from Common.CEnum import FX_CHECK_METHOD, FX_TYPE, KLINE_DIR
 from Common.ChanException import CChanException, ErrCode
@@ -7,6 +9,8 @@ from KLine.KLine_Unit import CKLine_Unit
 
 # 合并后的K线， CKLine 类继承自泛型类 CKLineCombiner，且该泛型类使用 CKLine_Unit 作为其类型参数
 class CKLine(CKLineCombiner[CKLine_Unit]):
+    __slots__ = ("idx", "kl_type")
+
     def __init__(self, kl_unit: CKLine_Unit, idx, _dir=KLINE_DIR.UP):
         super(CKLine, self).__init__(kl_unit, _dir)
         self.idx: int = idx
@@ -95,3 +99,37 @@ class CKLine(CKLineCombiner[CKLine_Unit]):
                 return self.low < item2_low and item2.high > cur_high
         else:
             raise CChanException("only top/bottom fx can check_valid_top_button", ErrCode.BI_ERR)
+
+
+def batch_combine_klu(highs: List[float], lows: List[float], last_klc: Optional[CKLine]) -> List[list]:
+    """
+    批量计算K线包含合并，结果和逐根调用 CKLine.try_add 一致（包括一字K线的处理）
+    highs/lows: 待加入的K线的高低点；last_klc: 当前最后一根合并K线（之后的K线可能继续并入），没有时为None
+    返回每根合并K线的 [第一根K线在highs中的下标, 方向, 高, 低]（合并完之后的高低点），last_klc 的下标为-1
+    """
+    res = []
+    cur = None if last_klc is None else [-1, last_klc.dir, last_klc.high, last_klc.low]
+    for pos, (high, low) in enumerate(zip(highs, lows)):
+        if cur is None:
+            cur = [pos, KLINE_DIR.UP, high, low]
+            continue
+        cur_high, cur_low = cur[2], cur[3]
+        if (cur_high >= high and cur_low <= low) or (cur_high <= high and cur_low >= low):  # 包含，同 test_combine
+            if cur[1] == KLINE_DIR.UP:
+                if high != low or high != cur_high:  # 处理一字K线
+                    cur[2] = max(cur_high, high)
+                    cur[3] = max(cur_low, low)
+            elif high != low or low != cur_low:
+                cur[2] = min(cur_high, high)
+                cur[3] = min(cur_low, low)
+        elif cur_high > high and cur_low > low:
+            res.append(cur)
+            cur = [pos, KLINE_DIR.DOWN, high, low]
+        elif cur_high < high and cur_low < low:
+            res.append(cur)
+            cur = [pos, KLINE_DIR.UP, high, low]
+        else:
+            raise CChanException("combine type unknown", ErrCode.COMBINER_ERR)
+    if cur is not None:
+        res.append(cur)
+    return res
@@ -0,0 +1,235 @@
+from typing import Dict, List, Tuple
+
+from Common.ChanFile import slot_names
+from Seg.SegListComm import CSegListComm
+
+from .KLine_Unit import CKLine_Unit
+
+_MISSING = object()
+
+
+def copy_state(obj, exclude=()) -> dict:
+    # 对象属性（包括__slots__）的浅拷贝，内部的list/dict再多拷贝一层，防止之后原地修改影响快照
+    state = {}
+    for k in slot_names(type(obj)):
+        v = getattr(obj, k, _MISSING)
+        if v is not _MISSING and k not in exclude:
+            state[k] = v.copy() if isinstance(v, (list, dict)) else v
+    obj_dict = getattr(obj, "__dict__", None)
+    if obj_dict is not None:
+        state.update((k, (v.copy() if isinstance(v, (list, dict)) else v)) for k, v in obj_dict.items() if k not in exclude)
+    return state
+
+
+def restore_state(obj, state: dict, exclude=()):
+    slots = slot_names(type(obj))
+    obj_dict = getattr(obj, "__dict__", None)
+    if not exclude:
+        for k in slots:
+            if k not in state and hasattr(obj, k):
+                object.__delattr__(obj, k)  # 快照之后才设置的字段（如缓存）
+        if obj_dict is not None:
+            obj_dict.clear()
+    for k, v in copy_state_dict(state).items():
+        if obj_dict is None or k in slots:
+            object.__setattr__(obj, k, v)
+        else:
+            obj_dict[k] = v
+
+
+def copy_state_dict(state: dict) -> dict:
+    return {k: (v.copy() if isinstance(v, (list, dict)) else v) for k, v in state.items()}
+
+
+class CListJournal:
+    """
+    记录一个只会在尾部增删的列表（笔，线段，中枢，买卖点列表等）在checkpoint时的尾部
+    begin之前的元素在checkpoint之后不会再被删除/替换，回滚时只需要把begin之后的部分换回来
+    """
+    def __init__(self, owner, attr: str):
+        self.owner = owner
+        self.attr = attr
+        self.lst: list = getattr(owner, attr)  # checkpoint时的列表对象，之后owner可能会整体替换成新的列表
+        self.begin = len(self.lst)
+        self.tail: list = []
+
+    def is_origin_lst(self) -> bool:
+        return getattr(self.owner, self.attr) is self.lst
+
+    def extend_to(self, begin: int) -> list:
+        # 把记录范围往前扩展到begin，返回新纳入记录的元素
+        # 列表被整体替换过（比如买卖点在last_sure_pos回退时会重建）就没法按位置对应了，直接全部记录
+        begin = max(begin, 0) if self.is_origin_lst() else 0
+        if begin >= self.begin:
+            return []
+        new_items = self.lst[begin:self.begin]
+        self.tail = new_items + self.tail
+        self.begin = begin
+        return new_items
+
+    def current_tail(self) -> list:
+        # 当前列表中（回滚时会被丢掉的）begin之后的部分
+        return getattr(self.owner, self.attr)[self.begin:] if self.is_origin_lst() else getattr(self.owner, self.attr)
+
+    def rollback(self):
+        del self.lst[self.begin:]
+        self.lst.extend(self.tail)
+        setattr(self.owner, self.attr, self.lst)
+
+
+class CKLineListCheckpoint:
+    """
+    CKLine_List的检查点，配合CChan.checkpoint()/rollback()使用
+    不拷贝全部历史：每根K线加入之前，先把这一步可能会修改到的尾部（最后几根合并K线，最后几个确定线段之后的笔/线段/中枢/买卖点）
+    中还没有记录过的对象属性存一份，回滚时只恢复这部分，所以代价只和尾部大小有关
+    """
+    def __init__(self, kl_list):
+        self.kl_list = kl_list
+        self.obj_state: Dict[int, Tuple[object, dict]] = {}
+
+        self.klc_journal = CListJournal(kl_list, 'lst')
+        self.bi_journal = CListJournal(kl_list.bi_list, 'bi_list')
+        self.seg_journal = CListJournal(kl_list.seg_list, 'lst')
+        self.segseg_journal = CListJournal(kl_list.segseg_list, 'lst')
+        self.zs_journal = CListJournal(kl_list.zs_list, 'zs_lst')
+        self.segzs_journal = CListJournal(kl_list.segzs_list, 'zs_lst')
+        self.bsp_journal = [
+            (kl_list.bs_point_lst, CListJournal(kl_list.bs_point_lst, 'lst'), CListJournal(kl_list.bs_point_lst, 'bsp1_lst')),
+            (kl_list.seg_bs_point_lst, CListJournal(kl_list.seg_bs_point_lst, 'lst'), CListJournal(kl_list.seg_bs_point_lst, 'bsp1_lst')),
+        ]
+
+        # 各个管理类自身的属性（大列表/字典由上面的journal负责）
+        self.container_state: List[Tuple[object, tuple, dict]] = []
+        for container, exclude in [
+            (kl_list, ('lst', 'checkpoint', 'last_klu_checkpoint', 'event_tracker', 'profiler')),
+            (kl_list.bi_list, ('bi_list',)),
+            (kl_list.seg_list, ('lst',)),
+            (kl_list.segseg_list, ('lst',)),
+            (kl_list.zs_list, ('zs_lst',)),
+            (kl_list.segzs_list, ('zs_lst',)),
+            (kl_list.bs_point_lst, BSP_LIST_EXCLUDE),
+            (kl_list.seg_bs_point_lst, BSP_LIST_EXCLUDE),
+        ]:
+            self.container_state.append((container, exclude, copy_state(container, exclude)))
+
+        self.metric_snapshot = [metric_model.snapshot() for metric_model in kl_list.metric_model_lst]
+        self.store_size = kl_list.kl_store.size if kl_list.kl_store is not None else None
+        self.metric_index_size = len(kl_list.metric_index)
+        self.klc_cnt = len(kl_list.lst)
+
+        self.before_step()
+
+    def saved_klu_lst(self) -> List[CKLine_Unit]:
+        # 已经记录过的K线，回滚时这些K线的属性会被恢复
+        return [obj for obj, _ in self.obj_state.values() if isinstance(obj, CKLine_Unit)]
+
+    def save_obj(self, obj):
+        if id(obj) not in self.obj_state:
+            self.obj_state[id(obj)] = (obj, copy_state(obj))
+
+    def before_step(self):
+        # 加入新K线之前调用，把这一步可能修改到的尾部纳入记录
+        kl_list = self.kl_list
+        for klc in self.klc_journal.extend_to(len(kl_list.lst) - 2):
+            self.save_obj(klc)
+            for klu in klc.lst:
+                self.save_obj(klu)
+
+        segseg_begin = frontier_seg_idx(kl_list.segseg_list)
+        seg_begin = min(frontier_seg_idx(kl_list.seg_list), line_begin_idx(kl_list.segseg_list, segseg_begin, len(kl_list.seg_list)))
+        bi_begin = min(len(kl_list.bi_list) - 3, line_begin_idx(kl_list.seg_list, seg_begin, len(kl_list.bi_list)))
+
+        for journal, begin in [(self.bi_journal, bi_begin), (self.seg_journal, seg_begin), (self.segseg_journal, segseg_begin)]:
+            for line in journal.extend_to(begin):
+                self.save_obj(line)
+        for journal, begin in [(self.zs_journal, bi_begin), (self.segzs_journal, seg_begin)]:
+            for zs in journal.extend_to(frontier_zs_idx(getattr(journal.owner, journal.attr), begin)):
+                self.save_obj(zs)
+        for (bsp_list, lst_journal, bsp1_journal), begin in zip(self.bsp_journal, [bi_begin, seg_begin]):
+            for journal, checked_len in [(lst_journal, bsp_list.last_lst_len), (bsp1_journal, bsp_list.last_bsp1_lst_len)]:
+                for bsp in journal.extend_to(frontier_bsp_idx(getattr(bsp_list, journal.attr), begin, checked_len)):
+                    self.save_obj(bsp)
+                    self.save_obj(bsp.features)
+
+    def rollback(self):
+        kl_list = self.kl_list
+        if kl_list.event_tracker is not None:
+            kl_list.event_tracker.before_rollback(self)
+        for journal in [self.klc_journal, self.bi_journal, self.seg_journal, self.segseg_journal, self.zs_journal, self.segzs_journal]:
+            journal.rollback()
+        for obj, state in self.obj_state.values():
+            restore_state(obj, state)
+        for bsp_list, lst_journal, bsp1_journal in self.bsp_journal:  # 重建索引时需要用到已经恢复的笔
+            rollback_bsp_list(bsp_list, lst_journal, bsp1_journal)
+        for container, exclude, state in self.container_state:
+            restore_state(container, state, exclude)
+        for metric_model, snapshot in zip(kl_list.metric_model_lst, self.metric_snapshot):
+            metric_model.restore(snapshot)
+        if self.store_size is not None:
+            kl_list.kl_store.truncate(self.store_size)
+        kl_list.metric_index.truncate(self.metric_index_size)
+        kl_list.klc_index.truncate(self.klc_cnt)
+
+
+BSP_LIST_EXCLUDE = ('lst', 'bsp1_lst', 'bsp_dict', 'bsp_bi_idx_cnt', 'bsp1_dict', 'type_index', 'type_index_len')
+
+
+def frontier_seg_idx(seg_list: CSegListComm) -> int:
+    # 内部元素已经确定（ele_inside_is_sure）的线段不会再被修改，再多留一个作为余量
+    seg_idx = len(seg_list)
+    while seg_idx > seg_list.offset and not seg_list[seg_idx-1].ele_inside_is_sure:
+        seg_idx -= 1
+    return max(seg_idx - 1, seg_list.offset)
+
+
+def line_begin_idx(seg_list: CSegListComm, seg_idx: int, sub_line_cnt: int) -> int:
+    # seg_idx及之后的线段涉及到的最早的次级别线（笔）
+    if seg_list and seg_idx < len(seg_list):
+        return seg_list[max(seg_idx, seg_list.offset)].start_bi.idx
+    return seg_list[-1].end_bi.idx + 1 if seg_list else 0
+
+
+def frontier_zs_idx(zs_lst: list, line_begin: int) -> int:
+    # 结束在line_begin之后的中枢都可能被修改，中枢合并只会发生在同一线段内，再多留一个作为余量
+    zs_idx = len(zs_lst)
+    while zs_idx > 0 and zs_lst[zs_idx-1].end_bi.idx >= line_begin:
+        zs_idx -= 1
+    return zs_idx - 1
+
+
+def frontier_bsp_idx(bsp_lst: list, line_begin: int, checked_len: int) -> int:
+    # 上次cal新增的买卖点，以及所在线在line_begin之后的买卖点都可能被修改
+    bsp_idx = len(bsp_lst)
+    while bsp_idx > 0 and (bsp_idx > checked_len or bsp_lst[bsp_idx-1].bi.idx >= line_begin):
+        bsp_idx -= 1
+    return bsp_idx - 2
+
+
+def rollback_bsp_list(bsp_list, lst_journal: CListJournal, bsp1_journal: CListJournal):
+    # bsp_dict等索引只和列表里的买卖点有关，按回滚前后尾部的差异更新即可
+    bsp_list.invalid_type_index(lst_journal.begin if lst_journal.is_origin_lst() else 0)
+    if not lst_journal.is_origin_lst() or not bsp1_journal.is_origin_lst():
+        lst_journal.rollback()
+        bsp1_journal.rollback()
+        bsp_list.bsp_dict = {bsp.bi.get_end_klu().idx: bsp for bsp in bsp_list.lst}
+        bsp_list.bsp_bi_idx_cnt = {}
+        for bsp in bsp_list.lst:
+            bsp_list.bsp_bi_idx_cnt[bsp.bi.idx] = bsp_list.bsp_bi_idx_cnt.get(bsp.bi.idx, 0) + 1
+        bsp_list.bsp1_dict = {bsp.bi.idx: bsp for bsp in bsp_list.bsp1_lst}
+        return
+    for bsp in lst_journal.current_tail():
+        if bsp_list.bsp_dict.get(bsp.klu.idx) is bsp:
+            del bsp_list.bsp_dict[bsp.klu.idx]
+        bsp_list.bsp_bi_idx_cnt[bsp.bi.idx] -= 1
+        if bsp_list.bsp_bi_idx_cnt[bsp.bi.idx] == 0:
+            del bsp_list.bsp_bi_idx_cnt[bsp.bi.idx]
+    for bsp in bsp1_journal.current_tail():
+        if bsp_list.bsp1_dict.get(bsp.bi.idx) is bsp:
+            del bsp_list.bsp1_dict[bsp.bi.idx]
+    lst_journal.rollback()
+    bsp1_journal.rollback()
+    for bsp in lst_journal.tail:
+        bsp_list.bsp_dict[bsp.klu.idx] = bsp
+        bsp_list.bsp_bi_idx_cnt[bsp.bi.idx] = bsp_list.bsp_bi_idx_cnt.get(bsp.bi.idx, 0) + 1
+    for bsp in bsp1_journal.tail:
+        bsp_list.bsp1_dict[bsp.bi.idx] = bsp
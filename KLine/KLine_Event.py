@@ -0,0 +1,254 @@
+import abc
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from Common.CEnum import CHAN_EVENT
+
+from .KLine_Checkpoint import CListJournal, frontier_seg_idx
+
+
+class CChanEvent:
+    """
+    笔/线段/中枢/买卖点变化时通知给监听者的事件，参见 CChan.add_event_listener
+    ele 是对应的 CBi/CSeg/CZS/CBSPoint；REMOVE 类事件的 ele 是已经被删掉的对象
+    """
+    __slots__ = ("type", "kl_type", "ele", "klu")
+
+    def __init__(self, event_type: CHAN_EVENT, kl_type, ele, klu):
+        self.type = event_type
+        self.kl_type = kl_type
+        self.ele = ele
+        self.klu = klu  # 产生事件时的最后一根K线
+
+    def __str__(self):
+        return f"{self.kl_type} {self.klu.time} {self.type.name}: {self.ele}"
+
+
+class CEleTracker(abc.ABC):
+    """
+    记录一个列表尾部（key >= begin）的元素上次通知时的状态，begin 之前的元素认为不会再变
+    每次 update 只对比尾部的当前状态，元素对象被重新生成（比如中枢每次从last_sure_pos开始重算）但状态没变时不产生事件
+    """
+    REMOVE_EVENT: CHAN_EVENT
+
+    def __init__(self):
+        self.begin = self.get_begin()
+        self.known: Dict[int, Tuple[object, tuple]] = self.gather_state(self.begin)
+
+    @abc.abstractmethod
+    def gather(self, begin: int) -> Iterable:
+        # 返回 key >= begin 的所有元素，可以多返回
+        pass
+
+    @abc.abstractmethod
+    def get_begin(self) -> int:
+        # 之后只有 key >= 返回值的元素可能变化
+        pass
+
+    @abc.abstractmethod
+    def get_key(self, ele) -> int:
+        pass
+
+    @abc.abstractmethod
+    def get_state(self, ele) -> tuple:
+        pass
+
+    @abc.abstractmethod
+    def get_events(self, old_state, new_state) -> List[CHAN_EVENT]:
+        # old_state 为 None 表示新增，返回 REMOVE_EVENT 表示旧的元素要先删掉
+        pass
+
+    def gather_state(self, begin: int) -> Dict[int, Tuple[object, tuple]]:
+        return {key: (ele, self.get_state(ele)) for ele in self.gather(begin) if (key := self.get_key(ele)) >= begin}
+
+    def update(self) -> List[Tuple[CHAN_EVENT, object]]:
+        cur = self.gather_state(self.begin)
+        res = [(self.REMOVE_EVENT, self.known[key][0]) for key in sorted(self.known.keys() - cur.keys(), reverse=True)]
+        for key in sorted(cur.keys()):
+            ele, state = cur[key]
+            old_ele, old_state = self.known.get(key, (None, None))
+            res.extend((event, old_ele if event == self.REMOVE_EVENT else ele) for event in self.get_events(old_state, state))
+
+        new_begin = self.get_begin()
+        if new_begin < self.begin:  # 往前退了，之前没有记录的部分状态没变过，直接补上
+            cur.update({key: item for key, item in self.gather_state(new_begin).items() if key < self.begin})
+        self.begin = new_begin
+        self.known = {key: item for key, item in cur.items() if key >= new_begin}
+        return res
+
+    def widen(self, begin: int):
+        # 之后 key >= begin 的元素都可能变化（比如回滚），先记录它们当前的状态
+        if begin >= self.begin:
+            return
+        for key, item in self.gather_state(begin).items():
+            if key < self.begin:
+                self.known[key] = item
+        self.begin = begin
+
+    def trim(self, keep: Callable[[object], bool]):
+        self.known = {key: item for key, item in self.known.items() if keep(item[0])}
+
+
+class CLineTracker(CEleTracker):
+    # 笔/线段，key是idx
+    def __init__(self, line_list, get_begin: Callable[[], int], new_event, extend_event, sure_event, remove_event):
+        self.line_list = line_list
+        self.begin_func = get_begin
+        self.NEW_EVENT, self.EXTEND_EVENT, self.SURE_EVENT, self.REMOVE_EVENT = new_event, extend_event, sure_event, remove_event
+        super().__init__()
+
+    def gather(self, begin):
+        return self.line_list[max(begin, 0):]
+
+    def get_begin(self):
+        return self.begin_func()
+
+    def get_key(self, ele):
+        return ele.idx
+
+    def get_state(self, ele):
+        return ele.get_begin_klu().idx, ele.get_end_klu().idx, ele.is_sure
+
+    def get_events(self, old_state, new_state):
+        if old_state is not None and (old_state[0] != new_state[0] or (old_state[2] and not new_state[2])):
+            return [self.REMOVE_EVENT] + self.get_events(None, new_state)
+        if old_state is None:
+            return [self.NEW_EVENT, self.SURE_EVENT] if new_state[2] else [self.NEW_EVENT]
+        res = []
+        if old_state[1] != new_state[1]:
+            res.append(self.EXTEND_EVENT)
+        if new_state[2] and not old_state[2]:
+            res.append(self.SURE_EVENT)
+        return res
+
+
+class CZSTracker(CEleTracker):
+    # 中枢，key是起始笔的idx
+    REMOVE_EVENT = CHAN_EVENT.ZS_REMOVE
+
+    def __init__(self, zs_list):
+        self.zs_list = zs_list
+        super().__init__()
+
+    def gather(self, begin):
+        zs_lst = self.zs_list.zs_lst
+        zs_idx = len(zs_lst)
+        while zs_idx > 0 and zs_lst[zs_idx-1].begin_bi.idx >= begin:
+            zs_idx -= 1
+        return zs_lst[zs_idx:]
+
+    def get_begin(self):
+        # last_sure_pos 之后的中枢会被重算，再往前多留一个（可能被延伸或合并）
+        zs_lst = self.zs_list.zs_lst
+        zs_idx = len(zs_lst)
+        while zs_idx > 0 and zs_lst[zs_idx-1].begin_bi.idx >= self.zs_list.last_sure_pos:
+            zs_idx -= 1
+        return zs_lst[zs_idx-1].begin_bi.idx if zs_idx > 0 else self.zs_list.last_sure_pos
+
+    def get_key(self, ele):
+        return ele.begin_bi.idx
+
+    def get_state(self, ele):
+        return ele.end_bi.idx, len(ele.sub_zs_lst)
+
+    def get_events(self, old_state, new_state):
+        if old_state is None:
+            return [CHAN_EVENT.ZS_NEW]
+        if new_state[1] < old_state[1]:
+            return [CHAN_EVENT.ZS_REMOVE, CHAN_EVENT.ZS_NEW]
+        if new_state[1] > old_state[1]:
+            return [CHAN_EVENT.ZS_COMBINE]
+        return [CHAN_EVENT.ZS_EXTEND] if new_state[0] != old_state[0] else []
+
+
+class CBSPTracker(CEleTracker):
+    # 买卖点，key是所在K线的idx
+    def __init__(self, bsp_list, add_event, remove_event):
+        self.bsp_list = bsp_list
+        self.ADD_EVENT, self.REMOVE_EVENT = add_event, remove_event
+        super().__init__()
+
+    def gather(self, begin):
+        # lst[:last_lst_len] 是上次cal保留下来的，都在last_filter_pos及之前
+        bsp_lst = self.bsp_list.lst
+        return bsp_lst[self.bsp_list.last_lst_len:] if begin > self.bsp_list.last_filter_pos else bsp_lst
+
+    def get_begin(self):
+        return self.bsp_list.last_sure_pos + 1
+
+    def get_key(self, ele):
+        return ele.klu.idx
+
+    def get_state(self, ele):
+        return ele.is_buy, tuple(ele.type)
+
+    def get_events(self, old_state, new_state):
+        if old_state is None:
+            return [self.ADD_EVENT]
+        return [self.REMOVE_EVENT, self.ADD_EVENT] if old_state != new_state else []
+
+
+class CKLineEventTracker:
+    """
+    CKLine_List 的事件通知：每次计算完之后对比各列表尾部的变化，生成事件回调给监听者
+    代价只和尾部大小有关；没有监听者时 CKLine_List 不会创建它
+    """
+    def __init__(self, kl_list):
+        self.kl_list = kl_list
+        self.listener_lst: List[Callable[[CChanEvent], None]] = []
+        self.bi_tracker = CLineTracker(
+            kl_list.bi_list,
+            lambda: len(kl_list.bi_list) - 3,  # 笔只会修改最后两笔
+            CHAN_EVENT.BI_NEW, CHAN_EVENT.BI_EXTEND, CHAN_EVENT.BI_SURE, CHAN_EVENT.BI_REMOVE,
+        )
+        self.seg_tracker = CLineTracker(
+            kl_list.seg_list,
+            lambda: frontier_seg_idx(kl_list.seg_list),
+            CHAN_EVENT.SEG_NEW, CHAN_EVENT.SEG_EXTEND, CHAN_EVENT.SEG_SURE, CHAN_EVENT.SEG_REMOVE,
+        )
+        self.zs_tracker = CZSTracker(kl_list.zs_list)
+        self.bsp_tracker = CBSPTracker(kl_list.bs_point_lst, CHAN_EVENT.BSP_ADD, CHAN_EVENT.BSP_REMOVE)
+        self.seg_bsp_tracker = CBSPTracker(kl_list.seg_bs_point_lst, CHAN_EVENT.SEG_BSP_ADD, CHAN_EVENT.SEG_BSP_REMOVE)
+
+    def update(self):
+        event_lst = []
+        for tracker in [self.bi_tracker, self.seg_tracker, self.zs_tracker, self.bsp_tracker, self.seg_bsp_tracker]:
+            event_lst.extend(tracker.update())
+        if not event_lst:
+            return
+        klu = self.kl_list.lst[-1][-1] if len(self.kl_list.lst) else None
+        for event_type, ele in event_lst:
+            event = CChanEvent(event_type, self.kl_list.kl_type, ele, klu)
+            for listener in list(self.listener_lst):
+                listener(event)
+
+    def before_rollback(self, checkpoint):
+        # 回滚会修改检查点记录的尾部，先把这部分纳入对比范围（参见 CKLineListCheckpoint.rollback）
+        self.bi_tracker.widen(journal_begin(checkpoint.bi_journal))
+        self.seg_tracker.widen(journal_begin(checkpoint.seg_journal))
+        for tracker, journal in [
+            (self.zs_tracker, checkpoint.zs_journal),
+            (self.bsp_tracker, checkpoint.bsp_journal[0][1]),
+            (self.seg_bsp_tracker, checkpoint.bsp_journal[1][1]),
+        ]:
+            key_lst = [tracker.get_key(ele) for ele in journal.current_tail() + journal.tail]
+            if key_lst:
+                tracker.widen(min(key_lst))
+
+    def trim(self, bi_begin, seg_begin, restart_seg=False, restart_segseg=False):
+        # 和 CKLine_List.trim_history 裁剪的范围一致
+        # restart_seg/restart_segseg: 这一层的中枢/买卖点接下来会全部重算，先记录下保留的全部，之后和重算的结果整体对比
+        if restart_seg:
+            self.zs_tracker.widen(0)
+            self.bsp_tracker.widen(0)
+        if restart_segseg:
+            self.seg_bsp_tracker.widen(0)
+        self.bi_tracker.trim(lambda bi: bi.idx >= bi_begin)
+        self.seg_tracker.trim(lambda seg: seg.idx >= seg_begin)
+        self.zs_tracker.trim(lambda zs: zs.end_bi.idx >= bi_begin)
+        self.bsp_tracker.trim(lambda bsp: bsp.bi.idx >= bi_begin)
+        self.seg_bsp_tracker.trim(lambda bsp: bsp.bi.idx >= seg_begin)
+
+
+def journal_begin(journal: CListJournal) -> int:
+    # 按idx访问的列表（笔/线段），回滚会修改begin之后的部分；列表被整体替换过时全部都可能变
+    return journal.begin if journal.is_origin_lst() else 0
@@ -1,18 +1,23 @@
 import copy
-from typing import List, Union, overload
+from typing import Callable, Dict, List, Optional, Union, overload
 
 from Bi.Bi import CBi
 from Bi.BiList import CBiList
 from BuySellPoint.BSPointList import CBSPointList
 from ChanConfig import CChanConfig
-from Common.CEnum import KLINE_DIR, SEG_TYPE
+from Common.CEnum import DataField, KLINE_DIR, SEG_TYPE
 from Common.ChanException import CChanException, ErrCode
+from Common.OffsetList import COffsetList
+from Math.Demark import CDemarkEngine
+from Math.KDJ import KDJ
 from Seg.Seg import CSeg
 from Seg.SegConfig import CSegConfig
 from Seg.SegListComm import CSegListComm
+from ZS.ZS import CZS
 from ZS.ZSList import CZSList
 
-from .KLine import CKLine
+from .KLine import CKLine, batch_combine_klu
+from .KLine_MetricIndex import CKLineExtremeIndex, CKLineMetricIndex
 from .KLine_Unit import CKLine_Unit
 
 
@@ -36,8 +41,12 @@ class CKLine_List:
     def __init__(self, kl_type, conf: CChanConfig):
         self.kl_type = kl_type
         self.config = conf
-        self.lst: List[CKLine] = []  # K线列表，可递归  元素KLine类型
+        self.lst: COffsetList[CKLine] = COffsetList()  # K线列表，可递归  元素KLine类型，按idx访问，头部可能被裁剪（参见trim_history）
+        self.metric_index = CKLineMetricIndex()  # 笔/线段计算macd等指标用的索引
         self.bi_list = CBiList(bi_conf=conf.bi_conf)  # CBiList 类，管理所有的笔
+        self.bi_list.metric_index = self.metric_index
+        self.klc_index = CKLineExtremeIndex()  # 判断笔的端点是不是区间极值用的索引
+        self.bi_list.klc_index = self.klc_index
         self.seg_list: CSegListComm[CBi] = get_seglist_instance(seg_config=conf.seg_conf, lv=SEG_TYPE.BI)  # CSegListComm 类，管理所有的线段
         self.segseg_list: CSegListComm[CSeg[CBi]] = get_seglist_instance(seg_config=conf.seg_conf, lv=SEG_TYPE.SEG)  # 线段的线段
 
@@ -49,11 +58,36 @@ class CKLine_List:
 
         self.metric_model_lst = conf.get_metric_model()
 
+        self.kl_store = None  # 列式存储，参见 CKLine_Store
+        if conf.kl_columnar:
+            from .KLine_Store import CKLine_Store
+            self.kl_store = CKLine_Store(kl_type)
+
         self.step_calculation = self.need_cal_step_by_step()
 
+        # 批量计算指标时，Demark依赖逐根状态，仍然在读入K线时计算，其余指标先攒着，在cal_batch_metric里一次算完
+        self.batch_metric_model_lst = []
+        if conf.batch_metric and not self.step_calculation:
+            self.batch_metric_model_lst = [model for model in self.metric_model_lst if not isinstance(model, CDemarkEngine)]
+        self.step_metric_model_lst = [model for model in self.metric_model_lst if model not in self.batch_metric_model_lst]
+        self.pending_metric_klu: List[CKLine_Unit] = []  # 还没有计算批量指标的K线
+        # 批量合并K线时，读入的K线先攒着，在flush_combine里一次合并，参见 batch_combine_klu
+        self.batch_combine = conf.batch_combine and not self.step_calculation
+        self.pending_combine_klu: List[CKLine_Unit] = []
+
+        self.checkpoint = None  # CChan.checkpoint()时设置，参见 CKLineListCheckpoint
+        self.last_klu_checkpoint = None  # 最后一根K线以forming=True加入时，加入之前的检查点，update_last_klu用
+        self.event_tracker = None  # 有监听者时才创建，参见 add_event_listener
+        self.profiler = None  # 配置 profile 时才创建，参见 CKLineProfiler
+        self.reset_profile()
+
     def __deepcopy__(self, memo):
+        self.flush_combine()
         new_obj = CKLine_List(self.kl_type, self.config)
         memo[id(self)] = new_obj
+        new_obj.lst.offset = self.lst.offset
+        if self.kl_store is not None:  # 先拷贝列式存储，K线视图拷贝时指向新的存储，参见 CKLine_UnitView.__deepcopy__
+            new_obj.kl_store = copy.deepcopy(self.kl_store, memo)
         for klc in self.lst:
             klus_new = []
             for klu in klc.lst:
@@ -62,6 +96,7 @@ class CKLine_List:
 
             new_klc = CKLine(klus_new[0], idx=klc.idx, _dir=klc.dir)
             new_klc.set_fx(klc.fx)
+            new_klc.set_high_low(klc.high, klc.low)
             new_klc.kl_type = klc.kl_type
             for idx, klu in enumerate(klus_new):
                 klu.set_klc(new_klc)
@@ -72,6 +107,8 @@ class CKLine_List:
                 new_obj.lst[-1].set_next(new_klc)
                 new_klc.set_pre(new_obj.lst[-1])
             new_obj.lst.append(new_klc)
+        new_obj.metric_index = copy.deepcopy(self.metric_index, memo)
+        new_obj.klc_index = copy.deepcopy(self.klc_index, memo)
         new_obj.bi_list = copy.deepcopy(self.bi_list, memo)
         new_obj.seg_list = copy.deepcopy(self.seg_list, memo)
         new_obj.segseg_list = copy.deepcopy(self.segseg_list, memo)
@@ -79,6 +116,9 @@ class CKLine_List:
         new_obj.segzs_list = copy.deepcopy(self.segzs_list, memo)
         new_obj.bs_point_lst = copy.deepcopy(self.bs_point_lst, memo)
         new_obj.metric_model_lst = copy.deepcopy(self.metric_model_lst, memo)
+        new_obj.batch_metric_model_lst = [memo[id(model)] for model in self.batch_metric_model_lst]
+        new_obj.step_metric_model_lst = [memo[id(model)] for model in self.step_metric_model_lst]
+        new_obj.pending_metric_klu = [memo[id(klu)] for klu in self.pending_metric_klu]
         new_obj.step_calculation = copy.deepcopy(self.step_calculation, memo)
         new_obj.seg_bs_point_lst = copy.deepcopy(self.seg_bs_point_lst, memo)
         return new_obj
@@ -90,69 +130,431 @@ class CKLine_List:
     def __getitem__(self, index: slice) -> List[CKLine]: ...
 
     def __getitem__(self, index: Union[slice, int]) -> Union[List[CKLine], CKLine]:
+        if self.pending_combine_klu:
+            self.flush_combine()
         return self.lst[index]
 
     def __len__(self):
+        if self.pending_combine_klu:
+            self.flush_combine()
         return len(self.lst)
 
-    def cal_seg_and_zs(self):
+    def get_last_klu(self) -> Optional[CKLine_Unit]:
+        # 最后读入的K线，不触发批量合并
+        if self.pending_combine_klu:
+            return self.pending_combine_klu[-1]
+        return self.lst[-1][-1] if len(self.lst) else None
+
+    def cal_seg_and_zs(self, full_cal=False):
+        # full_cal: 不走增量逻辑，从头重新计算笔所属线段以及买卖点的索引，仅用于校验增量计算结果
+        self.run_stage("cal_seg_and_zs", self._cal_seg_and_zs, full_cal)
+
+    def _cal_seg_and_zs(self, full_cal):
+        self.flush_combine()
+        self.run_stage("cal_batch_metric", self.cal_batch_metric)
+        ref_kl_list = None
+        if self.step_calculation and self.config.step_check and not full_cal:
+            ref_kl_list = copy.deepcopy(self)
+            ref_kl_list.cal_seg_and_zs(full_cal=True)
+
         if not self.step_calculation:
-            self.bi_list.try_add_virtual_bi(self.lst[-1])
-        cal_seg(self.bi_list, self.seg_list)
-        self.zs_list.cal_bi_zs(self.bi_list, self.seg_list)
-        update_zs_in_seg(self.bi_list, self.seg_list, self.zs_list)  # 计算seg的zs_lst，以及中枢的bi_in, bi_out
+            self.run_bi_stage("virtual_bi", self.bi_list.try_add_virtual_bi, self.lst[-1])
+        self.cal_line_levels(full_cal)
 
-        cal_seg(self.seg_list, self.segseg_list)
-        self.segzs_list.cal_bi_zs(self.seg_list, self.segseg_list)
-        update_zs_in_seg(self.seg_list, self.segseg_list, self.segzs_list)  # 计算segseg的zs_lst，以及中枢的bi_in, bi_out
+        if ref_kl_list is not None:
+            self.check_step_result(ref_kl_list)
+
+        # 有检查点时不裁剪（回滚不了），CChan.checkpoint()时会先裁剪再记录；step_check全量重算的副本也不裁剪，保证和增量计算的结果对得上
+        if self.checkpoint is None and self.last_klu_checkpoint is None and not full_cal:
+            self.run_stage("trim_history", self.trim_history)
+        if not self.step_calculation:  # 逐根计算时在add_single_klu最后通知
+            self.notify_event()
+
+    def cal_line_levels(self, full_cal=False):
+        # 笔之上的线段/中枢/买卖点，trim_history从某一层重新开始算时也调用
+        self.run_seg_stage("cal_seg", "seg", self.bi_list, self.seg_list, full_cal)
+        self.run_stage("cal_bi_zs", self.zs_list.cal_bi_zs, self.bi_list, self.seg_list)
+        self.run_stage("update_zs_in_seg", update_zs_in_seg, self.bi_list, self.seg_list, self.zs_list)  # 计算seg的zs_lst，以及中枢的bi_in, bi_out
+
+        self.run_seg_stage("cal_segseg", "segseg", self.seg_list, self.segseg_list, full_cal)
+        self.run_stage("cal_segzs", self.segzs_list.cal_bi_zs, self.seg_list, self.segseg_list)
+        self.run_stage("update_zs_in_segseg", update_zs_in_seg, self.seg_list, self.segseg_list, self.segzs_list)  # 计算segseg的zs_lst，以及中枢的bi_in, bi_out
 
         # 计算买卖点
-        self.seg_bs_point_lst.cal(self.seg_list, self.segseg_list)  # 线段线段买卖点
-        self.bs_point_lst.cal(self.bi_list, self.seg_list)  # 再算笔买卖点
+        self.run_stage("cal_seg_bsp", self.seg_bs_point_lst.cal, self.seg_list, self.segseg_list, full_cal)  # 线段线段买卖点
+        self.run_stage("cal_bsp", self.bs_point_lst.cal, self.bi_list, self.seg_list, full_cal)  # 再算笔买卖点
+
+    def reset_profile(self):
+        self.profiler = None
+        if self.config.profile:
+            from .KLine_Profiler import CKLineProfiler
+            self.profiler = CKLineProfiler(self.kl_type)
+
+    def run_stage(self, stage: str, func, *args):
+        # 配置 profile 时统计这一步的耗时，否则直接调用
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.run(stage, func, *args)
+
+    def run_bi_stage(self, stage: str, func, *args):
+        # 同 run_stage，另外统计虚笔被改写的次数
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.run_bi_update(stage, self.bi_list, func, *args)
+
+    def run_seg_stage(self, stage: str, name: str, bi_list, seg_list, full_cal):
+        # 同 run_stage，另外统计线段重算的个数
+        if self.profiler is None:
+            return cal_seg(bi_list, seg_list, full_cal)
+        return self.profiler.run_seg_update(stage, name, seg_list, cal_seg, bi_list, seg_list, full_cal)
+
+    def add_event_listener(self, listener: Callable):
+        # 之后每次计算完，笔/线段/中枢/买卖点有变化时回调 listener(CChanEvent)，参见 CChan.add_event_listener
+        if self.event_tracker is None:
+            from .KLine_Event import CKLineEventTracker
+            self.event_tracker = CKLineEventTracker(self)
+        self.event_tracker.listener_lst.append(listener)
+
+    def remove_event_listener(self, listener: Callable):
+        if self.event_tracker is None or listener not in self.event_tracker.listener_lst:
+            return
+        self.event_tracker.listener_lst.remove(listener)
+        if not self.event_tracker.listener_lst:
+            self.event_tracker = None
+
+    def notify_event(self):
+        if self.event_tracker is not None:
+            self.event_tracker.update()
+
+    def get_trim_segseg(self) -> Optional[CSeg]:
+        """
+        裁剪历史的位置：从某个线段的线段的起点开始保留，要求
+            该线段的线段内部元素已经确定（ele_inside_is_sure），其之前的笔/线段/中枢/买卖点都不会再变，之后的增量计算也不会再往前看
+            保留下来的K线数不少于retain_kl_cnt，本级别线段数不少于retain_seg_cnt
+            之后还会被重新计算的中枢不能跨过裁剪位置
+        满足条件的取最靠后的一个，没有则返回None
+        """
+        last_klu_idx = self.lst[-1][-1].idx
+        zs_update_klu_idx, segzs_update_klu_idx = zs_update_begin(self.seg_list), zs_update_begin(self.segseg_list)
+        for segseg in reversed(self.segseg_list):
+            if not segseg.ele_inside_is_sure:
+                continue
+            first_seg = self.seg_list[segseg.start_bi.idx]
+            if last_klu_idx - first_seg.get_begin_klu().idx + 1 >= self.config.retain_kl_cnt and \
+               len(self.seg_list) - first_seg.idx >= self.config.retain_seg_cnt and \
+               self.segzs_list.can_trim(first_seg.idx, segzs_update_klu_idx) and self.zs_list.can_trim(first_seg.start_bi.idx, zs_update_klu_idx):
+                return segseg
+        return None
+
+    def get_trim_seg(self) -> Optional[CSeg]:
+        """
+        保留的K线超过retain_kl_max、而get_trim_segseg找不到裁剪位置时（比如单边行情里线段的线段一直不确定）的裁剪位置：从某个线段的起点开始保留，要求
+            不在frontier_seg_idx之后（内部元素已经确定），其之前的笔/线段/中枢/笔的买卖点都不会再变
+            保留下来的K线数在[retain_kl_cnt, retain_kl_max]内，本级别线段数不少于retain_seg_cnt
+            之后还会被重新计算的中枢不能跨过裁剪位置
+        满足条件的取最靠后的一个，没有则返回None
+        """
+        from .KLine_Checkpoint import frontier_seg_idx
+        last_klu_idx = self.lst[-1][-1].idx
+        zs_update_klu_idx = zs_update_begin(self.seg_list)
+        for seg in reversed(self.seg_list[self.seg_list.offset+1:frontier_seg_idx(self.seg_list)+1]):
+            if self.config.retain_kl_cnt <= last_klu_idx - seg.get_begin_klu().idx + 1 <= self.config.retain_kl_max and \
+               len(self.seg_list) - seg.idx >= self.config.retain_seg_cnt and \
+               self.zs_list.can_trim(seg.start_bi.idx, zs_update_klu_idx):
+                return seg
+        return None
+
+    def get_trim_bi(self) -> Optional[CBi]:
+        # get_trim_seg也找不到时（线段本身就很长）的裁剪位置：从最靠后的一个确定的笔开始保留（最后两笔还会变，不算），保留下来的K线数不少于retain_kl_cnt
+        last_klu_idx = self.lst[-1][-1].idx
+        for bi in reversed(self.bi_list[self.bi_list.offset+1:len(self.bi_list)-2]):
+            if bi.is_sure and last_klu_idx - bi.get_begin_klu().idx + 1 >= self.config.retain_kl_cnt:
+                return bi
+        return None
+
+    def trim_history(self):
+        """
+        裁掉已经确定的历史，只保留最近的一部分（参见配置retain_kl_cnt/retain_kl_max），常驻进程一直trigger_load时内存不再增长
+        所有列表仍然按原来的idx访问（COffsetList），裁掉的对象之间的引用会被断开，不要再使用
+        裁剪位置依次尝试：
+            get_trim_segseg: 保留的结果和不裁剪时完全一致
+            get_trim_seg: 保留的K线超过retain_kl_max时，线段的线段（以及线段中枢，线段线段买卖点）从第一个保留的线段开始重新算
+            get_trim_bi: 同上且线段级别也裁不下来时，线段及以上（以及笔中枢，笔的买卖点）从第一个保留的笔开始重新算
+        重新算的部分相当于K线从裁剪位置才开始，和不裁剪时可能不一样
+        """
+        if self.config.retain_kl_cnt is None or len(self.lst) == 0:
+            return
+        self.trim_metric()
+        kl_cnt = self.lst[-1][-1].idx + 1 - self.lst[self.lst.offset][0].idx
+        if kl_cnt <= self.config.retain_kl_cnt:
+            return
+        restart_seg, restart_segseg = False, False
+        if (segseg := self.get_trim_segseg()) is not None and segseg.idx > self.segseg_list.offset:
+            seg_begin, segseg_begin = segseg.start_bi.idx, segseg.idx
+            bi_begin = self.seg_list[seg_begin].start_bi.idx
+        elif kl_cnt <= self.config.retain_kl_max:
+            return
+        elif (seg := self.get_trim_seg()) is not None:
+            bi_begin, seg_begin, segseg_begin = seg.start_bi.idx, seg.idx, len(self.segseg_list)
+            restart_segseg = True
+        elif (bi := self.get_trim_bi()) is not None:
+            bi_begin, seg_begin, segseg_begin = bi.idx, len(self.seg_list), len(self.segseg_list)
+            restart_seg, restart_segseg = True, True
+        else:
+            return
+        klc_begin = self.bi_list[bi_begin].begin_klc.idx
+        first_klu = self.lst[klc_begin][0]
+
+        self.seg_bs_point_lst.trim(seg_begin)
+        self.bs_point_lst.trim(bi_begin)
+        self.segzs_list.trim(seg_begin)
+        self.zs_list.trim(bi_begin)
+        self.segseg_list.trim(segseg_begin)
+        self.seg_list.trim(seg_begin)
+        self.bi_list.trim(bi_begin)
+        self.last_klu_checkpoint = None
+        if self.event_tracker is not None:
+            self.event_tracker.trim(bi_begin, seg_begin, restart_seg, restart_segseg)
+        if restart_seg:
+            for bi in self.bi_list:
+                bi.parent_seg = None
+            self.zs_list.__init__(zs_config=self.config.zs_conf)
+            self.bs_point_lst.__init__(bs_point_config=self.config.bs_point_conf)
+        if restart_segseg:
+            for seg in self.seg_list:
+                seg.parent_seg = None
+            self.segzs_list.__init__(zs_config=self.config.zs_conf)
+            self.seg_bs_point_lst.__init__(bs_point_config=self.config.seg_bs_point_conf)
+        for line_lst, line_begin in [(self.bi_list, bi_begin), (self.seg_list, seg_begin)]:
+            for line in line_lst:
+                # 关联的一类买卖点已经被裁掉时断开引用，否则会通过它把裁掉的笔/线段都留在内存里
+                if line.bsp is not None and line.bsp.relate_bsp1 is not None and line.bsp.relate_bsp1.bi.idx < line_begin:
+                    line.bsp.relate_bsp1 = None
+
+        parent_klu_dict = {}
+        for klc in self.lst.trim(klc_begin):
+            for klu in klc.lst:
+                if klu.sup_kl is not None:  # 父级别保留下来的K线不再指向裁掉的次级别K线
+                    parent_klu_dict[id(klu.sup_kl)] = klu.sup_kl
+                    klu.set_parent(None)
+                for sub_klu in klu.sub_kl_list:
+                    sub_klu.set_parent(None)
+                klu.sub_kl_list = []
+            klc.set_pre(None)
+            klc.set_next(None)
+        self.lst[klc_begin].set_pre(None)
+        for parent_klu in parent_klu_dict.values():
+            parent_klu.sub_kl_list = [sub_klu for sub_klu in parent_klu.sub_kl_list if sub_klu.sup_kl is not None]
+
+        self.klc_index.trim(klc_begin)
+        self.metric_index.trim(first_klu.idx)
+        if self.kl_store is not None:
+            row_cnt = first_klu.row
+            self.kl_store.trim(row_cnt)
+            for klu in self.klu_iter():
+                klu.row -= row_cnt
+        if restart_segseg:
+            self.cal_line_levels()
+
+    def trim_metric(self):
+        # 指标的递推只用到最近的几个值，和裁不裁K线无关，设置了retain_kl_cnt时每根K线都裁（有检查点时不裁，回滚要用）
+        for metric_model in self.metric_model_lst:
+            metric_model.trim()
+
+    def check_step_result(self, ref_kl_list: 'CKLine_List'):
+        # 对比增量计算和全量重算的结果，不一致直接抛异常
+        for name in ["bi_list", "seg_list", "segseg_list", "zs_list", "segzs_list", "bs_point_lst", "seg_bs_point_lst"]:
+            cur_res = [ele_signature(ele) for ele in getattr(self, name)]
+            ref_res = [ele_signature(ele) for ele in getattr(ref_kl_list, name)]
+            if cur_res != ref_res:
+                last_klu = self.lst[-1][-1]
+                raise CChanException(f"{last_klu.time}增量计算{name}结果和全量计算不一致!", ErrCode.STEP_CHECK_ERR)
+
+    def cal_batch_metric(self):
+        if not self.pending_metric_klu:
+            return
+        closes = [klu.close for klu in self.pending_metric_klu]
+        for metric_model in self.batch_metric_model_lst:
+            if isinstance(metric_model, KDJ):
+                values = metric_model.add_batch([klu.high for klu in self.pending_metric_klu], [klu.low for klu in self.pending_metric_klu], closes)
+            else:
+                values = metric_model.add_batch(closes)
+            for klu, value in zip(self.pending_metric_klu, values):
+                klu.set_metric_value(metric_model, value)
+        self.pending_metric_klu = []
 
     def need_cal_step_by_step(self):
         return self.config.trigger_step
 
-    def add_single_klu(self, klu: CKLine_Unit):
-        klu.set_metric(self.metric_model_lst)
+    def add_single_klu(self, klu: CKLine_Unit, forming=False) -> CKLine_Unit:
+        # 列式存储时，实际加入的是CKLine_Store返回的视图，调用方需要改用返回值
+        # forming: 这根K线还没走完，先记录加入之前的检查点，之后可以用update_last_klu修改它
+        self.last_klu_checkpoint = None
+        if forming:
+            if not self.step_calculation:
+                raise CChanException("只有trigger_step模式才能修改最后一根K线", ErrCode.PARA_ERROR)
+            if self.checkpoint is None:
+                self.trim_history()
+            from .KLine_Checkpoint import CKLineListCheckpoint
+            self.last_klu_checkpoint = CKLineListCheckpoint(self)
+        return self.run_stage("add_single_klu", self.add_klu_step, klu)
+
+    def update_last_klu(self, kl_dict: Dict[str, float], allow_time=False) -> CKLine_Unit:
+        """
+        修改最后一根K线（以forming=True加入的）的开高低收和成交信息，kl_dict的key同DataField，没有给出的保持不变，时间不能改
+        回滚到这根K线加入之前的检查点再重新加入，只重算它影响到的尾部：合并K线，分型，虚笔，最后的线段/中枢/买卖点，以及指标的最后一步
+        可以连续调用多次，返回修改后的K线（列式存储时是新的视图）
+        allow_time: 允许修改时间（kl_resample合成的周线及以上K线的时间是最后一根次级别K线的日期），调用方保证不早于上一根K线
+        """
+        if self.last_klu_checkpoint is None:
+            raise CChanException("最后一根K线不是以forming=True加入的，或者之后回滚/读档过，不能修改", ErrCode.PARA_ERROR)
+        if DataField.FIELD_TIME in kl_dict and not allow_time:
+            raise CChanException("不能修改最后一根K线的时间", ErrCode.PARA_ERROR)
+        old_klu = self.lst[-1][-1]
+        new_dict = {
+            DataField.FIELD_TIME: old_klu.time,
+            DataField.FIELD_OPEN: old_klu.open,
+            DataField.FIELD_HIGH: old_klu.high,
+            DataField.FIELD_LOW: old_klu.low,
+            DataField.FIELD_CLOSE: old_klu.close,
+            **old_klu.trade_info.metric,
+            **kl_dict,
+        }
+        klu = CKLine_Unit(new_dict)  # 先检查数据，有问题时不会改动任何状态
+        klu.kl_type = old_klu.kl_type
+        klu.set_idx(old_klu.idx)
+        klu.limit_flag = old_klu.limit_flag
+        if self.kl_store is None:  # 原地修改，外部持有的引用仍然有效
+            old_klu.time, old_klu.open, old_klu.high, old_klu.low, old_klu.close = klu.time, klu.open, klu.high, klu.low, klu.close
+            old_klu.trade_info = klu.trade_info
+            klu = old_klu
+        sup_kl, sub_kl_list = old_klu.sup_kl, old_klu.sub_kl_list
+
+        self.rollback_last_klu()
+        self.last_klu_checkpoint.before_step()
+        klu = self.run_stage("update_last_klu", self.add_klu_step, klu)
+
+        if klu is not old_klu:  # 列式存储时换成了新的视图，父子级别关系也要换过去
+            klu.set_parent(sup_kl)
+            if sup_kl is not None:
+                sup_kl.sub_kl_list = [klu if sub_klu is old_klu else sub_klu for sub_klu in sup_kl.sub_kl_list]
+            klu.sub_kl_list = sub_kl_list
+            for sub_klu in sub_kl_list:
+                sub_klu.set_parent(klu)
+        return klu
+
+    def rollback_last_klu(self):
+        # 回到最后一根K线（以forming=True加入的）加入之前，检查点依然有效
+        # 检查点只针对本级别，父子级别关系之后可能被其它级别修改过（比如父级别K线换成了新的视图），回滚时保留当前的
+        klu_link = [(saved_klu, saved_klu.sup_kl, saved_klu.sub_kl_list) for saved_klu in self.last_klu_checkpoint.saved_klu_lst()]
+        self.run_stage("rollback", self.last_klu_checkpoint.rollback)
+        for saved_klu, saved_sup_kl, saved_sub_kl_list in klu_link:
+            saved_klu.sup_kl, saved_klu.sub_kl_list = saved_sup_kl, saved_sub_kl_list
+
+    def add_klu_step(self, klu: CKLine_Unit) -> CKLine_Unit:
+        if self.checkpoint is not None:
+            self.checkpoint.before_step()
+        if self.kl_store is not None:
+            klu = self.kl_store.add_klu(klu)
+        self.run_stage("set_metric", klu.set_metric, self.step_metric_model_lst)
+        if self.batch_metric_model_lst:
+            self.pending_metric_klu.append(klu)
+        self.metric_index.add_klu(klu)
+        if self.batch_combine:
+            self.pending_combine_klu.append(klu)
+            return klu
         if len(self.lst) == 0:
             self.lst.append(CKLine(klu, idx=0))
+            self.klc_index.add_klc(self.lst[-1])
         else:
-            _dir = self.lst[-1].try_add(klu)
+            _dir = self.run_stage("kl_combine", self.lst[-1].try_add, klu)
             if _dir != KLINE_DIR.COMBINE:  # 不需要合并K线
                 self.lst.append(CKLine(klu, idx=len(self.lst), _dir=_dir))
+                self.klc_index.add_klc(self.lst[-1])
                 if len(self.lst) >= 3:
-                    self.lst[-2].update_fx(self.lst[-3], self.lst[-1])
-                if self.bi_list.update_bi(self.lst[-2], self.lst[-1], self.step_calculation) and self.step_calculation:
+                    self.run_stage("update_fx", self.lst[-2].update_fx, self.lst[-3], self.lst[-1])
+                if self.run_bi_stage("update_bi", self.bi_list.update_bi, self.lst[-2], self.lst[-1], self.step_calculation) and self.step_calculation:
                     self.cal_seg_and_zs()
-            elif self.step_calculation and self.bi_list.try_add_virtual_bi(self.lst[-1], need_del_end=True):  # 这里的必要性参见issue#175
+            elif self.step_calculation and self.run_bi_stage("virtual_bi", self.bi_list.try_add_virtual_bi, self.lst[-1], True):  # need_del_end=True，这里的必要性参见issue#175
                 self.cal_seg_and_zs()
+        if self.config.retain_kl_cnt is not None and self.checkpoint is None and self.last_klu_checkpoint is None:
+            self.trim_metric()
+        if self.step_calculation:
+            self.notify_event()
+        return klu
+
+    def flush_combine(self):
+        """
+        非逐步模式下批量合并攒下的K线：先用 batch_combine_klu 一次算出所有合并K线的范围/方向/高低点，再批量生成 CKLine
+        分型和笔仍然在每根新合并K线出现时计算，这时新合并K线只包含它的第一根K线，和逐根 add_klu_step 看到的状态一致
+        """
+        if not self.pending_combine_klu:
+            return
+        self.run_stage("kl_combine", self._flush_combine)
+
+    def _flush_combine(self):
+        klu_lst, self.pending_combine_klu = self.pending_combine_klu, []
+        if self.kl_store is not None:  # 列式存储时K线是连续的行，直接读数组
+            begin_row, end_row = klu_lst[0].row, klu_lst[-1].row + 1
+            highs = self.kl_store.columns[DataField.FIELD_HIGH][begin_row:end_row].tolist()
+            lows = self.kl_store.columns[DataField.FIELD_LOW][begin_row:end_row].tolist()
+        else:
+            highs = [klu.high for klu in klu_lst]
+            lows = [klu.low for klu in klu_lst]
+        klc_info = batch_combine_klu(highs, lows, self.lst[-1] if len(self.lst) else None)
+        for info_idx, (begin, _dir, high, low) in enumerate(klc_info):
+            end = klc_info[info_idx+1][0] if info_idx + 1 < len(klc_info) else len(klu_lst)
+            if begin == -1:  # 并入原来的最后一根合并K线
+                klc = self.lst[-1]
+                begin = 0
+            else:
+                klc = CKLine(klu_lst[begin], idx=len(self.lst), _dir=_dir)
+                self.lst.append(klc)
+                self.klc_index.add_klc(klc)
+                if len(self.lst) >= 3:
+                    self.run_stage("update_fx", self.lst[-2].update_fx, self.lst[-3], klc)
+                if len(self.lst) >= 2:
+                    self.run_bi_stage("update_bi", self.bi_list.update_bi, self.lst[-2], klc, False)
+                begin += 1
+            if begin < end:
+                for klu in klu_lst[begin:end]:
+                    klc.add(klu)
+                    klu.set_klc(klc)
+                klc.set_high_low(high, low)
+                klc._time_end = klu_lst[end-1].time
+                klc.clean_cache()
 
     def klu_iter(self, klc_begin_idx=0):
         for klc in self.lst[klc_begin_idx:]:
             yield from klc.lst
 
 
-def cal_seg(bi_list, seg_list):
+def cal_seg(bi_list, seg_list, full_cal=False):
     seg_list.update(bi_list)
     # 计算每一笔属于哪个线段
-    bi_seg_idx_dict = {}
-    for seg_idx, seg in enumerate(seg_list):
-        for i in range(seg.start_bi.idx, seg.end_bi.idx+1):
-            bi_seg_idx_dict[i] = seg_idx
-    for bi in bi_list:
-        bi.set_seg_idx(bi_seg_idx_dict.get(bi.idx, len(seg_list)))  # 找不到的应该都是最后一个线段的
+    # 线段只会从尾部开始变化，所以从后往前更新，碰到上次已经标记过且没有变化的线段就可以停止了
+    last_seg_end_idx = seg_list[-1].end_bi.idx if seg_list else -1
+    for bi in bi_list[last_seg_end_idx+1:]:
+        bi.set_seg_idx(len(seg_list))  # 找不到的应该都是最后一个线段的
+    for seg in reversed(seg_list.lst):
+        seg_idx = seg.idx
+        seg_mark = (seg_idx, seg.start_bi, seg.end_bi)
+        if not full_cal and seg.bi_seg_idx_mark == seg_mark and seg.end_bi.idx < len(bi_list) and bi_list[seg.end_bi.idx] is seg.end_bi:
+            break
+        for bi in bi_list[seg.start_bi.idx:seg.end_bi.idx+1]:
+            bi.set_seg_idx(seg_idx)
+        seg.bi_seg_idx_mark = seg_mark
 
 
 def update_zs_in_seg(bi_list, seg_list, zs_list):
     sure_seg_cnt = 0
-    for seg in seg_list[::-1]:  # 反向迭代，从最后一个开始操作
+    for seg in reversed(seg_list):  # 反向迭代，从最后一个开始操作
         if seg.ele_inside_is_sure:
             break
         if seg.is_sure:
             sure_seg_cnt += 1
         seg.clear_zs_lst()
-        for zs in zs_list[::-1]:
+        for zs in reversed(zs_list):
             if zs.end.idx < seg.start_bi.get_begin_klu().idx:
                 break
             if zs.is_inside(seg):
@@ -165,3 +567,24 @@ def update_zs_in_seg(bi_list, seg_list, zs_list):
 
         if sure_seg_cnt > 2:
             seg.ele_inside_is_sure = True
+
+
+def zs_update_begin(seg_list) -> float:
+    # update_zs_in_seg 之后还会重新设置的中枢：结束在这根K线（idx）之后的
+    begin_klu_idx = float("inf")
+    for seg in reversed(seg_list):
+        if seg.ele_inside_is_sure:
+            break
+        begin_klu_idx = seg.start_bi.get_begin_klu().idx
+    return begin_klu_idx
+
+
+def ele_signature(ele):
+    # 用于check_step_result对比的元素特征
+    if isinstance(ele, CBi):
+        return ele.idx, ele.begin_klc.idx, ele.end_klc.idx, ele.is_sure, ele.seg_idx
+    elif isinstance(ele, CSeg):
+        return ele.idx, ele.start_bi.idx, ele.end_bi.idx, ele.is_sure, ele.dir, ele.seg_idx, [str(zs) for zs in ele.zs_lst]
+    elif isinstance(ele, CZS):
+        return str(ele), ele.low, ele.high, ele.is_sure, ele.bi_in.idx if ele.bi_in else None, ele.bi_out.idx if ele.bi_out else None
+    return ele.klu.idx, ele.bi.idx, ele.is_buy, ele.type2str()
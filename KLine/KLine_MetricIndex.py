@@ -0,0 +1,250 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from Common.CEnum import TRADE_INFO_LST
+from Common.ChanException import CChanException, ErrCode
+from Common.SparseTable import CSparseTable, grow_array
+
+from .KLine import CKLine
+from .KLine_Unit import CKLine_Unit
+
+RAW_COLUMNS = ["macd", "rsi"] + TRADE_INFO_LST
+
+
+class CPrefixSum:
+    # prefix[i] = sum(values[:i])，nan 当作 0；nan_cnt 同理记录缺失个数
+    def __init__(self, use_abs=False):
+        self.use_abs = use_abs
+        self.size = 0
+        self.prefix = np.zeros(1024)
+        self.nan_cnt = np.zeros(1024, dtype=np.int64)
+
+    def extend(self, values: np.ndarray, size: int):
+        if size <= self.size:
+            return
+        self.prefix = grow_array(self.prefix, size+1, 0.0)
+        self.nan_cnt = grow_array(self.nan_cnt, size+1, 0)
+        new_values = np.abs(values[self.size:size]) if self.use_abs else values[self.size:size]
+        is_nan = np.isnan(new_values)
+        self.prefix[self.size+1:size+1] = self.prefix[self.size] + np.cumsum(np.where(is_nan, 0.0, new_values))
+        self.nan_cnt[self.size+1:size+1] = self.nan_cnt[self.size] + np.cumsum(is_nan)
+        self.size = size
+
+    def sum(self, begin, end) -> float:
+        return float(self.prefix[end+1] - self.prefix[begin])
+
+    def has_nan(self, begin, end) -> bool:
+        return self.nan_cnt[end+1] != self.nan_cnt[begin]
+
+
+class CKLineMetricIndex:
+    """
+    单个级别所有K线的 macd/rsi/成交信息 按K线idx排列，并按需维护前缀和/稀疏表/同号区间
+    笔和线段的 MACD_ALGO 指标都可以在 O(1)（半面积 O(logn)）内算出，和笔的长度无关
+    新K线先放在 pending_klu 里，等到查询时再批量读取（非逐步模式下指标是读完K线后才批量计算的）
+    头部的K线被裁剪后（参见 CKLine_List.trim_history），数组里只存 offset 及之后的K线，接口仍然使用K线idx
+    """
+    def __init__(self):
+        self.pending_klu: List[CKLine_Unit] = []
+        self.offset = 0  # 数组第0个元素对应的K线idx
+        self.size = 0  # 已经读入数组的K线个数（不含offset之前裁掉的）
+        self.values: Dict[str, np.ndarray] = {name: np.full(1024, np.nan) for name in RAW_COLUMNS}
+        self.prefix_sum: Dict[str, CPrefixSum] = {}
+        self.sparse_table: Dict[str, CSparseTable] = {}
+        self.run_size = 0
+        self.run_start = np.zeros(1024, dtype=np.int64)  # macd同号区间的起点
+
+    def __len__(self):
+        return self.offset + self.size + len(self.pending_klu)
+
+    def add_klu(self, klu: CKLine_Unit):
+        self.pending_klu.append(klu)
+
+    def truncate(self, size):
+        # 丢掉size之后的K线，CKLine_List回滚时用
+        size -= self.offset
+        if size >= self.size:
+            del self.pending_klu[size-self.size:]
+            return
+        self.pending_klu = []
+        self.size = size
+        for derived in list(self.prefix_sum.values()) + list(self.sparse_table.values()):
+            derived.size = min(derived.size, size)
+        self.run_size = min(self.run_size, size)
+
+    def trim(self, begin_idx):
+        # 丢掉idx小于begin_idx的K线，前缀和/稀疏表等派生数据直接清空，下次查询时重新计算
+        self.flush()
+        cut = min(begin_idx - self.offset, self.size)
+        if cut <= 0:
+            return
+        for name in RAW_COLUMNS:
+            self.values[name] = self.values[name][cut:].copy()
+        self.offset += cut
+        self.size -= cut
+        self.prefix_sum = {}
+        self.sparse_table = {}
+        self.run_size = 0
+        self.run_start = np.zeros(1024, dtype=np.int64)
+
+    def flush(self):
+        if not self.pending_klu:
+            return
+        end_idx = self.pending_klu[-1].idx + 1 - self.offset
+        for name in RAW_COLUMNS:
+            self.values[name] = grow_array(self.values[name], end_idx)
+            self.values[name][self.size:end_idx] = np.nan  # 中间如果有缺失的idx，当作没有数据
+        macd, rsi = self.values["macd"], self.values["rsi"]
+        trade_values = [self.values[name] for name in TRADE_INFO_LST]
+        for klu in self.pending_klu:
+            idx = klu.idx - self.offset
+            macd[idx] = klu.macd.macd
+            rsi[idx] = getattr(klu, "rsi", np.nan)
+            metric = klu.trade_info.metric
+            for name, arr in zip(TRADE_INFO_LST, trade_values):
+                value = metric[name]
+                if value is not None:
+                    arr[idx] = value
+        self.size = end_idx
+        self.pending_klu = []
+
+    def get_prefix_sum(self, name) -> CPrefixSum:
+        self.flush()
+        if name not in self.prefix_sum:
+            self.prefix_sum[name] = CPrefixSum(use_abs=name == "abs_macd")
+        prefix_sum = self.prefix_sum[name]
+        prefix_sum.extend(self.values["macd" if name == "abs_macd" else name], self.size)
+        return prefix_sum
+
+    def get_sparse_table(self, name, is_max) -> CSparseTable:
+        self.flush()
+        key = f"{name}_{'max' if is_max else 'min'}"
+        if key not in self.sparse_table:
+            self.sparse_table[key] = CSparseTable(is_max)
+        sparse_table = self.sparse_table[key]
+        sparse_table.extend(self.values[name], self.size)
+        return sparse_table
+
+    def get_run_start(self) -> np.ndarray:
+        self.flush()
+        if self.run_size < self.size:
+            self.run_start = grow_array(self.run_start, self.size, 0)
+            idx = np.arange(self.run_size, self.size)
+            macd = self.values["macd"]
+            if self.run_size == 0:
+                new_run = np.ones(len(idx), dtype=np.bool_)
+                new_run[1:] = ~(macd[idx[1:]]*macd[idx[1:]-1] > 0)
+            else:
+                new_run = ~(macd[idx]*macd[idx-1] > 0)
+            start = np.maximum.accumulate(np.where(new_run, idx, -1))
+            if self.run_size > 0:
+                start = np.maximum(start, self.run_start[self.run_size-1])
+            self.run_start[self.run_size:self.size] = start
+            self.run_size = self.size
+        return self.run_start[:self.size]
+
+    def macd_area(self, begin, end) -> float:
+        return 1e-7 + self.get_prefix_sum("abs_macd").sum(begin-self.offset, end-self.offset)
+
+    def macd_peak(self, begin, end, is_down) -> float:
+        # 下跌笔取绿柱最长的长度，上涨笔取红柱最长的长度
+        begin, end = begin-self.offset, end-self.offset
+        if is_down:
+            return max(-self.get_sparse_table("macd", is_max=False).query(begin, end), 1e-7)
+        return max(self.get_sparse_table("macd", is_max=True).query(begin, end), 1e-7)
+
+    def macd_diff(self, begin, end) -> float:
+        begin, end = begin-self.offset, end-self.offset
+        return self.get_sparse_table("macd", is_max=True).query(begin, end) - self.get_sparse_table("macd", is_max=False).query(begin, end)
+
+    def macd_half(self, begin, end, is_reverse) -> float:
+        # 正向：从begin开始往后，和begin同号的那段macd面积（不超过end）；反向：从end开始往前
+        run_start = self.get_run_start()
+        begin, end = begin-self.offset, end-self.offset
+        from_idx = end if is_reverse else begin
+        if self.values["macd"][from_idx] == 0:
+            return 1e-7
+        if is_reverse:
+            begin = max(int(run_start[from_idx]), begin)
+        else:
+            end = min(int(np.searchsorted(run_start, run_start[from_idx], side="right")) - 1, end)
+        return 1e-7 + self.get_prefix_sum("abs_macd").sum(begin, end)
+
+    def rsi_metric(self, begin, end, is_down) -> float:
+        begin, end = begin-self.offset, end-self.offset
+        if is_down:
+            rsi = self.get_sparse_table("rsi", is_max=False).query(begin, end)
+        else:
+            rsi = self.get_sparse_table("rsi", is_max=True).query(begin, end)
+        if np.isnan(rsi):
+            raise CChanException("没有rsi指标数据，需要设置cal_rsi=True", ErrCode.PARA_ERROR)
+        return 10000.0/(rsi+1e-7) if is_down else rsi
+
+    def trade_metric_sum(self, metric: str, begin, end) -> Optional[float]:
+        # 区间内有任何一根K线缺失该成交信息时返回 None
+        prefix_sum = self.get_prefix_sum(metric)
+        begin, end = begin-self.offset, end-self.offset
+        if prefix_sum.has_nan(begin, end):
+            return None
+        return prefix_sum.sum(begin, end)
+
+
+class CKLineExtremeIndex:
+    """
+    合并K线（CKLine）高低点的区间最值，用于 end_is_peak 判断两个分型之间有没有更高/更低的合并K线
+    只有后面已经出现新合并K线的才会被读入，因为最后一根合并K线的高低点还会变
+    """
+    def __init__(self):
+        self.klc_lst: List[CKLine] = []
+        self.offset = 0  # klc_lst[0] 以及数组第0个元素对应的合并K线idx
+        self.size = 0
+        self.high = np.full(1024, np.nan)
+        self.low = np.full(1024, np.nan)
+        self.max_high = CSparseTable(is_max=True)
+        self.min_low = CSparseTable(is_max=False)
+
+    def add_klc(self, klc: CKLine):
+        self.klc_lst.append(klc)
+
+    def truncate(self, klc_cnt):
+        # 回滚到只有klc_cnt根合并K线时的状态，最后一根当时还没定型，也不能保留
+        klc_cnt -= self.offset
+        del self.klc_lst[klc_cnt:]
+        self.size = max(min(self.size, klc_cnt - 1), 0)
+        self.max_high.size = min(self.max_high.size, self.size)
+        self.min_low.size = min(self.min_low.size, self.size)
+
+    def trim(self, begin_idx):
+        # 丢掉idx小于begin_idx的合并K线，稀疏表清空，下次查询时重新计算
+        cut = begin_idx - self.offset
+        if cut <= 0:
+            return
+        del self.klc_lst[:cut]
+        self.high = self.high[cut:].copy()
+        self.low = self.low[cut:].copy()
+        self.offset = begin_idx
+        self.size = max(self.size - cut, 0)
+        self.max_high = CSparseTable(is_max=True)
+        self.min_low = CSparseTable(is_max=False)
+
+    def flush(self, end_idx):
+        end_idx -= self.offset
+        if end_idx < self.size:
+            return
+        self.high = grow_array(self.high, end_idx+1)
+        self.low = grow_array(self.low, end_idx+1)
+        for idx, klc in enumerate(self.klc_lst[self.size:end_idx+1], start=self.size):
+            self.high[idx] = klc.high
+            self.low[idx] = klc.low
+        self.size = end_idx + 1
+
+    def get_max_high(self, begin, end) -> float:
+        self.flush(end)
+        self.max_high.extend(self.high, self.size)
+        return self.max_high.query(begin-self.offset, end-self.offset)
+
+    def get_min_low(self, begin, end) -> float:
+        self.flush(end)
+        self.min_low.extend(self.low, self.size)
+        return self.min_low.query(begin-self.offset, end-self.offset)
@@ -0,0 +1,107 @@
+from collections import defaultdict
+from time import perf_counter
+from typing import Dict, List, Optional
+
+
+class CKLineProfiler:
+    """
+    CKLine_List 分阶段的累计耗时/调用次数，以及一些计算量的计数，配置 profile=True 时才创建，参见 CChan.get_profile
+    阶段耗时 time 包含嵌套在里面的其它阶段，比如 cal_seg_and_zs 包含 cal_seg/cal_bi_zs/cal_bsp 等；self_time 是扣掉嵌套阶段之后自身的耗时
+    计数：
+        virtual_bi_rewrite：虚笔被改写（终点变化或者被删掉）的次数
+        seg_recompute/segseg_recompute：已有的线段被丢弃重算的个数
+        seg_create/segseg_create：生成的线段个数（包括重算出来的）
+    """
+    def __init__(self, kl_type):
+        self.kl_type = kl_type
+        self.cost: Dict[str, float] = defaultdict(float)
+        self.self_cost: Dict[str, float] = defaultdict(float)
+        self.cnt: Dict[str, int] = defaultdict(int)
+        self.child_cost: List[float] = []  # 正在运行的各层阶段里，已经结束的嵌套阶段的耗时
+        self.counter: Dict[str, int] = defaultdict(int)
+
+    def run(self, stage: str, func, *args):
+        self.child_cost.append(0.0)
+        begin = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            cost = perf_counter() - begin
+            self.cost[stage] += cost
+            self.self_cost[stage] += cost - self.child_cost.pop()
+            self.cnt[stage] += 1
+            if self.child_cost:
+                self.child_cost[-1] += cost
+
+    def run_bi_update(self, stage: str, bi_list, func, *args):
+        # 只有最后两笔可能是虚笔
+        virtual_bi_lst = [(bi, bi.end_klc.idx) for bi in bi_list[-2:] if not bi.is_sure]
+        res = self.run(stage, func, *args)
+        for bi, end_klc_idx in virtual_bi_lst:
+            if bi.idx >= len(bi_list) or bi_list[bi.idx] is not bi or bi.end_klc.idx != end_klc_idx:
+                self.counter["virtual_bi_rewrite"] += 1
+        return res
+
+    def run_seg_update(self, stage: str, name: str, seg_list, func, *args):
+        # frontier_seg_idx 之前的线段不会变，对比之后的部分有多少线段被换掉
+        from .KLine_Checkpoint import frontier_seg_idx
+        begin = frontier_seg_idx(seg_list)
+        old_tail = seg_list[begin:]
+        res = self.run(stage, func, *args)
+        new_tail = seg_list[begin:]
+        keep_cnt = 0
+        for old_seg, new_seg in zip(old_tail, new_tail):
+            if old_seg is not new_seg:
+                break
+            keep_cnt += 1
+        self.counter[f"{name}_recompute"] += len(old_tail) - keep_cnt
+        self.counter[f"{name}_create"] += len(new_tail) - keep_cnt
+        return res
+
+    def reset(self):
+        self.cost.clear()
+        self.self_cost.clear()
+        self.cnt.clear()
+        self.counter.clear()
+
+    def to_dict(self) -> dict:
+        return {
+            "stages": {stage: {"time": self.cost[stage], "self_time": self.self_cost[stage], "calls": self.cnt[stage]} for stage in self.cost},
+            "counters": dict(self.counter),
+        }
+
+
+def profile_to_prometheus(profile: Dict[str, dict], labels: Optional[Dict[str, str]] = None, prefix="chan") -> str:
+    """
+    Prometheus 文本格式（可以给 node_exporter 的 textfile collector 读取）
+    profile 为 CChan.get_profile() 的返回值，key 是级别名；labels 是附加在每个指标上的标签，如 {"code": "sz.000001"}
+    """
+    def fmt_labels(**extra):
+        label_dict = {**(labels or {}), **extra}
+        return ",".join(f'{k}="{escape_label(v)}"' for k, v in label_dict.items())
+
+    stage_time, stage_calls = [], []
+    counters: Dict[str, list] = defaultdict(list)  # 指标名 -> 各级别的取值
+    for level, lv_profile in profile.items():
+        for stage, item in lv_profile["stages"].items():
+            stage_time.append(f'{prefix}_stage_seconds_total{{{fmt_labels(level=level, stage=stage)}}} {item["time"]!r}')
+            stage_calls.append(f'{prefix}_stage_calls_total{{{fmt_labels(level=level, stage=stage)}}} {item["calls"]}')
+        for name, value in lv_profile["counters"].items():
+            counters[f"{prefix}_{name}_total"].append(f'{prefix}_{name}_total{{{fmt_labels(level=level)}}} {value}')
+
+    res = [
+        f"# HELP {prefix}_stage_seconds_total 各阶段累计耗时（秒）",
+        f"# TYPE {prefix}_stage_seconds_total counter",
+        *stage_time,
+        f"# HELP {prefix}_stage_calls_total 各阶段累计调用次数",
+        f"# TYPE {prefix}_stage_calls_total counter",
+        *stage_calls,
+    ]
+    for name, lines in counters.items():
+        res.append(f"# TYPE {name} counter")
+        res.extend(lines)
+    return "\n".join(res) + "\n"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
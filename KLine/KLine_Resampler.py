@@ -0,0 +1,169 @@
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from Common.CEnum import DataField, KL_TYPE, TRADE_INFO_LST
+from Common.ChanException import CChanException, ErrCode
+from Common.CTime import CTime
+from Common.func_util import kltype_lt_day
+
+from .KLine_Unit import CKLine_Unit
+
+KL_MINUTES = {
+    KL_TYPE.K_1M: 1,
+    KL_TYPE.K_3M: 3,
+    KL_TYPE.K_5M: 5,
+    KL_TYPE.K_15M: 15,
+    KL_TYPE.K_30M: 30,
+    KL_TYPE.K_60M: 60,
+}
+
+
+def parse_session(session: Optional[List[str]]) -> Optional[List[Tuple[int, int]]]:
+    # ["09:30-11:30", "13:00-15:00"] -> [(570, 690), (780, 900)]，单位是当天的分钟数
+    if session is None:
+        return None
+    res = []
+    try:
+        for item in session:
+            begin, end = item.split("-")
+            res.append((int(begin[:-3])*60 + int(begin[-2:]), int(end[:-3])*60 + int(end[-2:])))
+    except (ValueError, AttributeError) as e:
+        raise CChanException(f"交易时段格式应该是HH:MM-HH:MM，当前为{session}", ErrCode.PARA_ERROR) from e
+    if not res or any(begin >= end for begin, end in res) or any(res[i][1] > res[i+1][0] for i in range(len(res)-1)):
+        raise CChanException(f"交易时段必须从早到晚且不能重叠，当前为{session}", ErrCode.PARA_ERROR)
+    return res
+
+
+class CKLineResampler:
+    """
+    用最小级别的K线逐根合成一个更高级别的K线，只记录当前这根K线的开高低收和成交信息，不保存次级别K线
+    分钟级别按K线结束时间在当天已经交易的分钟数分桶，开盘那一分钟算在第一根K线里：
+        设置了交易时段时，如A股的60分钟线是10:30，11:30，14:00，15:00
+        没有设置交易时段时按全天交易，从0点开始每N分钟一根（0点整的K线算在当天第一根，24点结束的K线时间记为23:59，保证和日线在同一天）
+    日线按日期，周线按自然周，月/季/年线按自然月/季/年；日线及以上的K线时间取最后一根次级别K线的日期
+    """
+    def __init__(self, kl_type: KL_TYPE, session: Optional[List[Tuple[int, int]]] = None):
+        if kltype_lt_day(kl_type) and kl_type not in KL_MINUTES:
+            raise CChanException(f"不支持合成{kl_type}", ErrCode.PARA_ERROR)
+        self.kl_type = kl_type
+        self.session = session
+        self.key = None  # 当前这根K线所在的桶，None表示还没有K线
+        self.time: Optional[CTime] = None
+        self.open = self.high = self.low = self.close = 0.0
+        self.trade_info: Dict[str, Optional[float]] = {}
+
+    def get_key(self, sub_time: CTime):
+        # 返回 (桶, 这根K线的时间)
+        if not kltype_lt_day(self.kl_type):
+            if self.kl_type == KL_TYPE.K_DAY:
+                key = sub_time.date_int
+            elif self.kl_type == KL_TYPE.K_WEEK:
+                key = (date(sub_time.year, sub_time.month, sub_time.day).toordinal()-1)//7  # 第1天（0001/01/01）是周一
+            elif self.kl_type == KL_TYPE.K_MON:
+                key = sub_time.year*12 + sub_time.month
+            elif self.kl_type == KL_TYPE.K_QUARTER:
+                key = sub_time.year*4 + (sub_time.month-1)//3
+            else:
+                key = sub_time.year
+            return key, CTime(sub_time.year, sub_time.month, sub_time.day, 0, 0)
+        end_minute = self.session_end_minute(sub_time.hour*60 + sub_time.minute, KL_MINUTES[self.kl_type])
+        hour, minute = divmod(min(end_minute, 23*60+59), 60)  # 24点结束的K线记为当天23:59，保证和日线在同一天
+        return (sub_time.date_int, end_minute), CTime(sub_time.year, sub_time.month, sub_time.day, hour, minute, auto=False)
+
+    def session_end_minute(self, minute, kl_minutes) -> int:
+        # 按当天已经交易的分钟数向上取整到kl_minutes，再换算回时刻；开盘那一分钟算在第一根K线里
+        traded = 0
+        session = self.session if self.session is not None else [(0, 24*60)]
+        for begin, end in session:
+            if begin <= minute <= end:
+                traded += minute - begin
+                break
+            traded += end - begin
+        else:
+            raise CChanException(f"{minute//60:02}:{minute % 60:02}不在交易时段内，不能合成{self.kl_type}", ErrCode.KL_DATA_INVALID)
+        end_traded = min(max(-(-traded//kl_minutes), 1)*kl_minutes, sum(end-begin for begin, end in session))
+        for begin, end in session:
+            if end_traded <= end - begin:
+                return begin + end_traded
+            end_traded -= end - begin
+        return session[-1][1]
+
+    def add(self, sub_klu: CKLine_Unit) -> Optional[CKLine_Unit]:
+        # 加入一根已经走完的次级别K线，如果它属于新的一根K线，返回上一根（已经走完）
+        key, time = self.get_key(sub_klu.time)
+        finished = None
+        if key != self.key:
+            finished = self.get_klu()
+            self.key = key
+            self.open, self.high, self.low = sub_klu.open, sub_klu.high, sub_klu.low
+            self.trade_info = dict(sub_klu.trade_info.metric)
+        else:
+            self.high = max(self.high, sub_klu.high)
+            self.low = min(self.low, sub_klu.low)
+            for name in TRADE_INFO_LST:
+                value = sub_klu.trade_info.metric[name]
+                self.trade_info[name] = None if value is None or self.trade_info[name] is None else self.trade_info[name] + value
+        self.time = time
+        self.close = sub_klu.close
+        return finished
+
+    def get_kl_dict(self) -> dict:
+        # 当前这根K线的时间，开高低收和成交信息（没有的为None）
+        return {
+            DataField.FIELD_TIME: self.time,
+            DataField.FIELD_OPEN: self.open,
+            DataField.FIELD_HIGH: self.high,
+            DataField.FIELD_LOW: self.low,
+            DataField.FIELD_CLOSE: self.close,
+            **self.trade_info,
+        }
+
+    def get_klu(self) -> Optional[CKLine_Unit]:
+        # 当前这根K线（可能还没走完），每次都返回新的对象
+        if self.key is None:
+            return None
+        klu = CKLine_Unit({name: value for name, value in self.get_kl_dict().items() if value is not None})
+        klu.kl_type = self.kl_type
+        return klu
+
+
+def resample_klus(sub_klu_iter: Iterable[CKLine_Unit], resampler: CKLineResampler) -> Iterator[CKLine_Unit]:
+    # 把最小级别的K线迭代器转换成高级别的，最后一根没有走完的K线也会返回
+    klu_idx = 0
+    for sub_klu in sub_klu_iter:
+        klu = resampler.add(sub_klu)
+        if klu is not None:
+            klu.set_idx(klu_idx)
+            klu_idx += 1
+            yield klu
+    klu = resampler.get_klu()
+    if klu is not None:
+        klu.set_idx(klu_idx)
+        yield klu
+
+
+class CMultiLevelResampler:
+    """
+    CChan 在 kl_resample 模式下 trigger_load 用：只传入最小级别已经走完的K线，合成其余所有级别
+    其余每个级别只记录最后一根K线，它走完之前会随着新的最小级别K线不断变化（称为未确定的K线），参见 CChan.trigger_load_resample
+    """
+    def __init__(self, lv_list: List[KL_TYPE], session: Optional[List[str]] = None):
+        self.lv_list = lv_list
+        session_minutes = parse_session(session)
+        self.resampler_lst = [CKLineResampler(lv, session_minutes) for lv in lv_list[:-1]]
+        self.forming_loaded = False  # CChan里是否加入了各级别未确定的K线
+
+    def add(self, sub_klu: CKLine_Unit) -> List[bool]:
+        # 加入一根最小级别的K线，返回除最小级别外每个级别的最后一根K线是不是新开始的（否则是在原来那根上更新）
+        res = []
+        for resampler in self.resampler_lst:
+            key = resampler.key
+            resampler.add(sub_klu)
+            res.append(resampler.key != key)
+        return res
+
+    def get_forming_klu(self, lv_idx: int) -> Optional[CKLine_Unit]:
+        return self.resampler_lst[lv_idx].get_klu()
+
+    def get_forming_dict(self, lv_idx: int) -> dict:
+        return self.resampler_lst[lv_idx].get_kl_dict()
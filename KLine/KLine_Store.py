@@ -0,0 +1,291 @@
+import copy
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from Common.CEnum import DataField, TRADE_INFO_LST, TREND_TYPE
+from Common.CTime import CTime
+from Math.BOLL import BOLL_Metric, BollModel
+from Math.Demark import CDemarkEngine, CDemarkIndex
+from Math.KDJ import KDJ, KDJ_Item
+from Math.MACD import CMACD, CMACD_item
+from Math.RSI import RSI
+from Math.TrendModel import CTrendModel
+
+from .KLine_Unit import CKLine_Unit
+from .TradeInfo import CTradeInfo
+
+PRICE_COLUMNS = [DataField.FIELD_OPEN, DataField.FIELD_HIGH, DataField.FIELD_LOW, DataField.FIELD_CLOSE]
+MACD_COLUMNS = ["macd_fast_ema", "macd_slow_ema", "macd_dif", "macd_dea"]
+BOLL_COLUMNS = ["boll_mid", "boll_up", "boll_down", "boll_theta"]
+KDJ_COLUMNS = ["kdj_k", "kdj_d", "kdj_j"]
+
+
+def pack_time(t: CTime) -> int:
+    return t.packed()
+
+
+def unpack_time(v: int, auto: bool) -> CTime:
+    return CTime.from_packed(v, auto=auto)
+
+
+def trend_column(trend_type: TREND_TYPE, T: int) -> str:
+    return f"trend_{trend_type.value}_{T}"
+
+
+_read_only_cls: Dict[type, type] = {}
+
+
+def _raise_read_only(self, *args):
+    raise AttributeError(f"{type(self).__name__}是从CKLine_Store读出来的副本，不能修改")
+
+
+class CReadOnlyDict(dict):
+    # CKLine_UnitView现读出来的字典（成交信息，trend），打印/json等和dict一样，但不能修改；拷贝/pickle时还原成dict
+    def _raise_read_only(self, *args, **kwargs):
+        raise TypeError("从CKLine_Store读出来的副本，不能修改")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _raise_read_only
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+
+def _reduce_read_only(self, protocol):
+    # 拷贝/pickle时还原成普通的可修改对象
+    obj = object.__new__(type(self).__base__)
+    obj.__dict__.update({k: dict(v) if isinstance(v, CReadOnlyDict) else v for k, v in self.__dict__.items()})
+    return copy.copy, (obj,)
+
+
+def read_only(obj):
+    # 把CKLine_UnitView每次现读出来的对象（指标，成交信息）换成同名只读子类，防止修改了却没有写回存储
+    cls = type(obj)
+    if cls not in _read_only_cls:
+        _read_only_cls[cls] = type(cls.__name__, (cls,), {"__setattr__": _raise_read_only, "__delattr__": _raise_read_only, "__reduce_ex__": _reduce_read_only})
+    object.__setattr__(obj, "__class__", _read_only_cls[cls])
+    return obj
+
+
+class CKLine_Store:
+    """
+    单个级别K线的列式存储，所有数值（时间，OHLC，成交信息，各种指标）都存在连续的numpy数组里面
+    CKLine_UnitView 只记录自己在第几行，取值时再从这里读
+    """
+    def __init__(self, kl_type, capacity=1024):
+        self.kl_type = kl_type
+        self.size = 0
+        self.capacity = capacity
+        self.columns: Dict[str, np.ndarray] = {}
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.time_auto = np.zeros(capacity, dtype=np.bool_)
+        self.idx = np.zeros(capacity, dtype=np.int64)
+        self.limit_flag = np.zeros(capacity, dtype=np.int8)
+        self.trend_keys: List[Tuple[TREND_TYPE, int]] = []
+        self.demark_dict: Dict[int, CDemarkIndex] = {}  # demark结构太复杂，只存有数据的行
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        self.capacity *= 2
+        for name in ["time", "time_auto", "idx", "limit_flag"]:
+            setattr(self, name, np.resize(getattr(self, name), self.capacity))
+        for name, arr in self.columns.items():
+            new_arr = np.full(self.capacity, np.nan)
+            new_arr[:self.size] = arr[:self.size]
+            self.columns[name] = new_arr
+
+    def truncate(self, size):
+        # 丢掉size之后的行，CKLine_List回滚时用
+        self.size = size
+        while self.demark_dict and next(reversed(self.demark_dict)) >= size:
+            self.demark_dict.popitem()
+
+    def trim(self, row_cnt):
+        # 丢掉前row_cnt行，CKLine_List裁剪历史时用；之后的行号都要减去row_cnt，由调用方更新保留下来的视图
+        if row_cnt <= 0:
+            return
+        self.size -= row_cnt
+        self.capacity = max(self.size, 1024)
+        for name in ["time", "time_auto", "idx", "limit_flag"]:
+            arr = getattr(self, name)
+            setattr(self, name, np.resize(arr[row_cnt:row_cnt+self.size], self.capacity))
+        for name, arr in self.columns.items():
+            new_arr = np.full(self.capacity, np.nan)
+            new_arr[:self.size] = arr[row_cnt:row_cnt+self.size]
+            self.columns[name] = new_arr
+        self.demark_dict = {row-row_cnt: demark for row, demark in self.demark_dict.items() if row >= row_cnt}
+
+    def get_column(self, name) -> np.ndarray:
+        if name not in self.columns:
+            self.columns[name] = np.full(self.capacity, np.nan)
+        return self.columns[name]
+
+    def has_column(self, name) -> bool:
+        return name in self.columns
+
+    def get(self, name, row) -> Optional[float]:
+        if name not in self.columns:
+            return None
+        value = self.columns[name][row]
+        return None if np.isnan(value) else float(value)
+
+    def set(self, name, row, value: Optional[float]):
+        self.get_column(name)[row] = np.nan if value is None else value
+
+    def add_klu(self, klu: CKLine_Unit) -> 'CKLine_UnitView':
+        if self.size == self.capacity:
+            self.grow()
+        row = self.size
+        self.size += 1
+        self.time[row] = pack_time(klu.time)
+        self.time_auto[row] = klu.time.auto
+        self.idx[row] = klu.idx
+        self.limit_flag[row] = klu.limit_flag
+        for name in PRICE_COLUMNS:
+            self.set(name, row, getattr(klu, name))
+        for name in TRADE_INFO_LST:
+            self.set(name, row, klu.trade_info.metric[name])
+        return CKLine_UnitView(self, row)
+
+    def set_metric(self, row, metric_model_lst: list):
+        close = float(self.columns[DataField.FIELD_CLOSE][row])
+        high = float(self.columns[DataField.FIELD_HIGH][row])
+        low = float(self.columns[DataField.FIELD_LOW][row])
+        for metric_model in metric_model_lst:
+            if isinstance(metric_model, CDemarkEngine):
+                demark = metric_model.update(idx=int(self.idx[row]), close=close, high=high, low=low)
+                if demark.data:
+                    self.demark_dict[row] = demark
+            elif isinstance(metric_model, KDJ):
+                self.set_metric_value(row, metric_model, metric_model.add(high, low, close))
+            else:
+                self.set_metric_value(row, metric_model, metric_model.add(close))
+
+    def set_metric_value(self, row, metric_model, value):
+        if isinstance(metric_model, CMACD):
+            for name, v in zip(MACD_COLUMNS, [value.fast_ema, value.slow_ema, value.DIF, value.DEA]):
+                self.set(name, row, v)
+        elif isinstance(metric_model, CTrendModel):
+            if (metric_model.type, metric_model.T) not in self.trend_keys:
+                self.trend_keys.append((metric_model.type, metric_model.T))
+            self.set(trend_column(metric_model.type, metric_model.T), row, value)
+        elif isinstance(metric_model, BollModel):
+            for name, v in zip(BOLL_COLUMNS, [value.MID, value.UP, value.DOWN, value.theta]):
+                self.set(name, row, v)
+        elif isinstance(metric_model, RSI):
+            self.set("rsi", row, value)
+        elif isinstance(metric_model, KDJ):
+            for name, v in zip(KDJ_COLUMNS, [value.k, value.d, value.j]):
+                self.set(name, row, v)
+
+
+class CKLine_UnitView(CKLine_Unit):
+    """
+    列式存储下的单根K线，只保存所在行以及父子级别/合并K线的关系，其余字段均从 CKLine_Store 读取
+    对外接口和 CKLine_Unit 保持一致，区别是除了time之外都是只读的：
+        time第一次访问时生成并缓存在视图上（这一行的时间之后不会再变，修改最后一根K线时换成的是新的视图）
+        trade_info/macd/boll/kdj/trend每次访问都从存储里现读一个副本，副本不能修改（会直接报错），
+        demark是存储里的同一个对象；要改指标只能通过set_metric/set_metric_value写回存储
+    """
+    _cache_time: Optional[CTime] = None  # 以 _cache_ 开头，CChan.save 时不保存
+
+    def __init__(self, store: CKLine_Store, row: int):
+        self.store = store
+        self.row = row
+        self.sub_kl_list = []
+        self.sup_kl: Optional[CKLine_Unit] = None
+        self.set_klc(None)
+
+    def __deepcopy__(self, memo):
+        # 同 CKLine_Unit.__deepcopy__，不拷贝父子级别和合并K线的关系；拷贝出来的视图指向拷贝出来的存储，行号不变
+        obj = CKLine_UnitView(copy.deepcopy(self.store, memo), self.row)
+        memo[id(self)] = obj
+        return obj
+
+    @property
+    def idx(self):
+        return int(self.store.idx[self.row])
+
+    def set_idx(self, idx):
+        self.store.idx[self.row] = idx
+
+    @property
+    def kl_type(self):
+        return self.store.kl_type
+
+    @property
+    def time(self) -> CTime:
+        if self._cache_time is None:
+            self._cache_time = unpack_time(int(self.store.time[self.row]), bool(self.store.time_auto[self.row]))
+        return self._cache_time
+
+    @property
+    def open(self) -> float:
+        return float(self.store.columns[DataField.FIELD_OPEN][self.row])
+
+    @property
+    def high(self) -> float:
+        return float(self.store.columns[DataField.FIELD_HIGH][self.row])
+
+    @property
+    def low(self) -> float:
+        return float(self.store.columns[DataField.FIELD_LOW][self.row])
+
+    @property
+    def close(self) -> float:
+        return float(self.store.columns[DataField.FIELD_CLOSE][self.row])
+
+    @property
+    def limit_flag(self) -> int:
+        return int(self.store.limit_flag[self.row])
+
+    @property
+    def trade_info(self) -> CTradeInfo:
+        trade_info = CTradeInfo({name: self.store.get(name, self.row) for name in TRADE_INFO_LST})
+        trade_info.metric = CReadOnlyDict(trade_info.metric)
+        return read_only(trade_info)
+
+    @property
+    def demark(self) -> CDemarkIndex:
+        return self.store.demark_dict.get(self.row, CDemarkIndex())
+
+    @property
+    def trend(self) -> Dict[TREND_TYPE, Dict[int, float]]:
+        res: Dict[TREND_TYPE, Dict[int, float]] = {}
+        for trend_type, T in self.store.trend_keys:
+            res.setdefault(trend_type, {})[T] = self.store.get(trend_column(trend_type, T), self.row)
+        return CReadOnlyDict({trend_type: CReadOnlyDict(value) for trend_type, value in res.items()})
+
+    @property
+    def macd(self) -> CMACD_item:
+        if not self.store.has_column(MACD_COLUMNS[0]):
+            raise AttributeError("macd")
+        return read_only(CMACD_item(*[self.store.get(name, self.row) for name in MACD_COLUMNS]))
+
+    @property
+    def boll(self) -> BOLL_Metric:
+        if not self.store.has_column(BOLL_COLUMNS[0]):
+            raise AttributeError("boll")
+        boll = BOLL_Metric.__new__(BOLL_Metric)
+        boll.MID, boll.UP, boll.DOWN, boll.theta = [self.store.get(name, self.row) for name in BOLL_COLUMNS]
+        return read_only(boll)
+
+    @property
+    def rsi(self) -> float:
+        if not self.store.has_column("rsi"):
+            raise AttributeError("rsi")
+        return self.store.get("rsi", self.row)
+
+    @property
+    def kdj(self) -> KDJ_Item:
+        if not self.store.has_column(KDJ_COLUMNS[0]):
+            raise AttributeError("kdj")
+        return read_only(KDJ_Item(*[self.store.get(name, self.row) for name in KDJ_COLUMNS]))
+
+    def set_metric(self, metric_model_lst: list) -> None:
+        self.store.set_metric(self.row, metric_model_lst)
+
+    def set_metric_value(self, metric_model, value) -> None:
+        self.store.set_metric_value(self.row, metric_model, value)
@@ -63,8 +63,9 @@ class CKLine_Unit:
         obj.demark = copy.deepcopy(self.demark, memo)
         obj.trend = copy.deepcopy(self.trend, memo)
         obj.limit_flag = self.limit_flag
-        obj.macd = copy.deepcopy(self.macd, memo)
-        obj.boll = copy.deepcopy(self.boll, memo)
+        if hasattr(self, "macd"):  # 还没有加入CKLine_List的K线没有指标
+            obj.macd = copy.deepcopy(self.macd, memo)
+            obj.boll = copy.deepcopy(self.boll, memo)
         if hasattr(self, "rsi"):
             obj.rsi = copy.deepcopy(self.rsi, memo)
         if hasattr(self, "kdj"):
@@ -133,20 +134,27 @@ class CKLine_Unit:
     def set_metric(self, metric_model_lst: list) -> None:
         # 设置和更新一系列与金融市场交易相关的技术指标模型
         for metric_model in metric_model_lst:
-            if isinstance(metric_model, CMACD):
-                self.macd: CMACD_item = metric_model.add(self.close)
-            elif isinstance(metric_model, CTrendModel):
-                if metric_model.type not in self.trend:
-                    self.trend[metric_model.type] = {}
-                self.trend[metric_model.type][metric_model.T] = metric_model.add(self.close)
-            elif isinstance(metric_model, BollModel):
-                self.boll: BOLL_Metric = metric_model.add(self.close)
-            elif isinstance(metric_model, CDemarkEngine):
+            if isinstance(metric_model, CDemarkEngine):
                 self.demark = metric_model.update(idx=self.idx, close=self.close, high=self.high, low=self.low)
-            elif isinstance(metric_model, RSI):
-                self.rsi = metric_model.add(self.close)
             elif isinstance(metric_model, KDJ):
-                self.kdj = metric_model.add(self.high, self.low, self.close)
+                self.set_metric_value(metric_model, metric_model.add(self.high, self.low, self.close))
+            else:
+                self.set_metric_value(metric_model, metric_model.add(self.close))
+
+    def set_metric_value(self, metric_model, value) -> None:
+        # 把指标模型算出来的值挂到K线上，批量计算指标时直接调用
+        if isinstance(metric_model, CMACD):
+            self.macd: CMACD_item = value
+        elif isinstance(metric_model, CTrendModel):
+            if metric_model.type not in self.trend:
+                self.trend[metric_model.type] = {}
+            self.trend[metric_model.type][metric_model.T] = value
+        elif isinstance(metric_model, BollModel):
+            self.boll: BOLL_Metric = value
+        elif isinstance(metric_model, RSI):
+            self.rsi = value
+        elif isinstance(metric_model, KDJ):
+            self.kdj = value
 
     def get_parent_klc(self):
         assert self.sup_kl is not None
@@ -1,4 +1,9 @@
 import math
+from typing import List
+
+import numpy as np
+
+from .RollingWindow import CRollingSum
 
 
 def _truncate(x):
@@ -18,12 +23,33 @@ class BollModel:
     def __init__(self, N=20):
         assert N > 1
         self.N = N
-        self.arr = []
+        self.rolling_sum = CRollingSum(N)  # 滑动窗口累加和，每根O(1)
 
     def add(self, value) -> BOLL_Metric:
-        self.arr.append(value)
-        if len(self.arr) > self.N:
-            self.arr = self.arr[-self.N:]
-        ma = sum(self.arr)/len(self.arr)
-        theta = math.sqrt(sum((x-ma)**2 for x in self.arr) / len(self.arr))
-        return BOLL_Metric(ma, theta)
+        self.rolling_sum.add(value)
+        n = len(self.rolling_sum)
+        m1 = self.rolling_sum.sum1 / n
+        ma = self.rolling_sum.K + m1
+        var = self.rolling_sum.sum2 / n - m1 * m1
+        return BOLL_Metric(ma, math.sqrt(var if var > 0 else 0.0))
+
+    def add_batch(self, values: List[float]) -> List[BOLL_Metric]:
+        # 等价于逐个调用add，用numpy一次算完
+        if not values:
+            return []
+        n, K, sum1, sum2 = self.rolling_sum.add_batch(values)
+        m1 = sum1 / n
+        ma = K + m1
+        var = sum2 / n - m1 * m1
+        theta = np.sqrt(np.where(var > 0, var, 0.0))
+        return [BOLL_Metric(_ma, _theta) for _ma, _theta in zip(ma.tolist(), theta.tolist())]
+
+    def snapshot(self):
+        return self.rolling_sum.snapshot()
+
+    def restore(self, snapshot):
+        self.rolling_sum.restore(snapshot)
+
+    def trim(self):
+        # 滑动窗口大小固定，没有需要裁剪的历史
+        pass
@@ -106,6 +106,17 @@ class CDemarkSetup:
             self.last_demark_index.add(self.dir, 'countdown', self.countdown.idx, self)
         return self.last_demark_index
 
+    def snapshot(self):
+        countdown_state = None if self.countdown is None else (self.countdown, dict(self.countdown.__dict__, kl_list=list(self.countdown.kl_list)))
+        return dict(self.__dict__, kl_list=list(self.kl_list)), countdown_state
+
+    def restore(self, snapshot):
+        state, countdown_state = snapshot
+        self.__dict__.update(state, kl_list=list(state['kl_list']))
+        if countdown_state is not None:
+            countdown, countdown_dict = countdown_state
+            countdown.__dict__.update(countdown_dict, kl_list=list(countdown_dict['kl_list']))
+
     def add_setup(self):
         self.idx += 1
         self.last_demark_index.add(self.dir, 'setup', self.idx, self)
@@ -182,6 +193,21 @@ class CDemarkEngine:
         self.clear()
         return result
 
+    def snapshot(self):
+        # kl_lst只会往后追加，记下长度即可；series数量很少，记录每个series的状态
+        return len(self.kl_lst), list(self.series), [series.snapshot() for series in self.series]
+
+    def restore(self, snapshot):
+        kl_len, self.series, series_state = snapshot
+        del self.kl_lst[kl_len:]
+        self.series = list(self.series)
+        for series, state in zip(self.series, series_state):
+            series.restore(state)
+
+    def trim(self):
+        # update只会往前看SETUP_BIAS+2根，正在进行的series自己持有用到的K线
+        del self.kl_lst[:-(CDemarkEngine.SETUP_BIAS+2)]
+
     def cal_result(self) -> CDemarkIndex:
         demark_index = CDemarkIndex()
         for series in self.series:
@@ -1,3 +1,10 @@
+from typing import List
+
+import numpy as np
+
+from .RollingWindow import CRollingExtreme
+
+
 class KDJ_Item:
     def __init__(self, k, d, j):
         self.k = k
@@ -9,20 +16,15 @@ class KDJ:
     # KDJ 指标是用来衡量市场动量的一种技术指标，通常用于识别市场的超买或超卖情况。它通过随机指标 K、D 和 J 值来表征市场趋势。
     def __init__(self, period: int = 9):
         super(KDJ, self).__init__()
-        self.arr = []
         self.period = period
+        # 单调队列维护窗口内最高最低价，每根O(1)
+        self.high_window = CRollingExtreme(period, is_max=True)
+        self.low_window = CRollingExtreme(period, is_max=False)
         self.pre_kdj = KDJ_Item(50, 50, 50)
 
     def add(self, high, low, close) -> KDJ_Item:
-        self.arr.append({
-            'high': high,
-            'low': low,
-        })
-        if len(self.arr) > self.period:
-            self.arr.pop(0)
-
-        hn = max([x['high'] for x in self.arr])
-        ln = min([x['low'] for x in self.arr])
+        hn = self.high_window.add(high)
+        ln = self.low_window.add(low)
         cn = close
         rsv = 100 * (cn - ln) / (hn - ln) if hn != ln else 0.0
 
@@ -33,3 +35,35 @@ class KDJ:
         self.pre_kdj = cur_kdj
 
         return cur_kdj
+
+    def add_batch(self, highs: List[float], lows: List[float], closes: List[float]) -> List[KDJ_Item]:
+        # 等价于逐个调用add，窗口最高最低价和rsv用numpy一次算完，K/D是递推的，仍按顺序计算
+        if not closes:
+            return []
+        hn = self.high_window.add_batch(highs)
+        ln = self.low_window.add_batch(lows)
+        cn = np.asarray(closes, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsv_arr = np.where(hn != ln, 100 * (cn - ln) / (hn - ln), 0.0)
+        res = []
+        pre_kdj = self.pre_kdj
+        for rsv in rsv_arr.tolist():
+            cur_k = 2 / 3 * pre_kdj.k + 1 / 3 * rsv
+            cur_d = 2 / 3 * pre_kdj.d + 1 / 3 * cur_k
+            cur_j = 3 * cur_k - 2 * cur_d
+            pre_kdj = KDJ_Item(cur_k, cur_d, cur_j)
+            res.append(pre_kdj)
+        self.pre_kdj = pre_kdj
+        return res
+
+    def snapshot(self):
+        return self.high_window.snapshot(), self.low_window.snapshot(), self.pre_kdj
+
+    def restore(self, snapshot):
+        high_snapshot, low_snapshot, self.pre_kdj = snapshot
+        self.high_window.restore(high_snapshot)
+        self.low_window.restore(low_snapshot)
+
+    def trim(self):
+        # 滑动窗口大小固定，没有需要裁剪的历史
+        pass
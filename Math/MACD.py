@@ -28,3 +28,38 @@ class CMACD:
             _dea = (2 * _dif + (self.signalperiod - 1) * self.macd_info[-1].DEA) / (self.signalperiod + 1)
             self.macd_info.append(CMACD_item(fast_ema=_fast_ema, slow_ema=_slow_ema, DIF=_dif, DEA=_dea))
         return self.macd_info[-1]
+
+    def add_batch(self, values: List[float]) -> List[CMACD_item]:
+        # 等价于逐个调用add，EMA是递推的，为了和add结果完全一致这里仍按顺序递推，只是省掉了逐根调用的开销
+        res: List[CMACD_item] = []
+        if not values:
+            return res
+        if not self.macd_info:
+            res.append(CMACD_item(fast_ema=values[0], slow_ema=values[0], DIF=0, DEA=0))
+            values = values[1:]
+        else:
+            res.append(self.macd_info[-1])
+        fast_ema, slow_ema, dea = res[-1].fast_ema, res[-1].slow_ema, res[-1].DEA
+        fast_k, slow_k, signal_k = self.fastperiod - 1, self.slowperiod - 1, self.signalperiod - 1
+        fast_n, slow_n, signal_n = self.fastperiod + 1, self.slowperiod + 1, self.signalperiod + 1
+        for value in values:
+            fast_ema = (2 * value + fast_k * fast_ema) / fast_n
+            slow_ema = (2 * value + slow_k * slow_ema) / slow_n
+            dif = fast_ema - slow_ema
+            dea = (2 * dif + signal_k * dea) / signal_n
+            res.append(CMACD_item(fast_ema=fast_ema, slow_ema=slow_ema, DIF=dif, DEA=dea))
+        if self.macd_info:
+            res = res[1:]
+        self.macd_info.extend(res)
+        return res
+
+    def snapshot(self):
+        # macd_info只会往后追加，记下长度即可
+        return len(self.macd_info)
+
+    def restore(self, snapshot):
+        del self.macd_info[snapshot:]
+
+    def trim(self):
+        # 之后的递推只用到最后一个，更早的历史可以丢掉（K线上仍然挂着各自的值）
+        del self.macd_info[:-1]
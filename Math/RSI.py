@@ -1,3 +1,6 @@
+from typing import List
+
+
 class RSI:
     # RSI（相对强弱指数）是一种衡量证券或股票在特定时期内价格变动的速度和变化量的技术分析指标，通常用于识别超买或超卖的条件。
     def __init__(self, period: int = 14):
@@ -28,3 +31,55 @@ class RSI:
         rs = self.up[-1] / self.down[-1] if self.down[-1] != 0 else 0
         rsi = 100.0 - 100.0 / (1.0 + rs)
         return rsi
+
+    def add_batch(self, values: List[float]) -> List[float]:
+        # 等价于逐个调用add，up/down是递推的，这里按顺序递推，只是省掉了逐根调用和每根重算前period个diff的开销
+        res = []
+        if not values:
+            return res
+        if not self.close_arr:
+            res.append(50.0)
+        closes = self.close_arr[-1:] + list(values)
+        diff = [cur - pre for pre, cur in zip(closes[:-1], closes[1:])]
+        self.close_arr.extend(values)
+        up_sum = sum(x for x in self.diff if x > 0) if len(self.diff) < self.period else 0.0
+        down_sum = sum(-x for x in self.diff if x < 0) if len(self.diff) < self.period else 0.0
+        for d in diff:
+            self.diff.append(d)
+            if len(self.diff) < self.period:
+                if d > 0:
+                    up_sum += d
+                elif d < 0:
+                    down_sum += -d
+                self.up.append(up_sum/self.period)
+                self.down.append(down_sum/self.period)
+            else:
+                if d > 0:
+                    upval = d
+                    downval = 0.0
+                else:
+                    upval = 0.0
+                    downval = -d
+                self.up.append((self.up[-1] * (self.period - 1) + upval) / self.period)
+                self.down.append((self.down[-1] * (self.period - 1) + downval) / self.period)
+            rs = self.up[-1] / self.down[-1] if self.down[-1] != 0 else 0
+            res.append(100.0 - 100.0 / (1.0 + rs))
+        return res
+
+    def snapshot(self):
+        # 几个数组都只会往后追加，记下长度即可
+        return len(self.close_arr), len(self.diff), len(self.up), len(self.down)
+
+    def restore(self, snapshot):
+        close_len, diff_len, up_len, down_len = snapshot
+        del self.close_arr[close_len:]
+        del self.diff[diff_len:]
+        del self.up[up_len:]
+        del self.down[down_len:]
+
+    def trim(self):
+        # 之后的递推只用到最后一个值，diff的个数需要保持不少于period（判断是否还在前period根），更早的历史可以丢掉
+        del self.close_arr[:-(self.period+1)]
+        del self.diff[:-self.period]
+        del self.up[:-self.period]
+        del self.down[:-self.period]
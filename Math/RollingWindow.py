@@ -0,0 +1,178 @@
+from collections import deque
+from typing import Deque, List, Tuple
+
+import numpy as np
+
+
+def rolling_window(history, values: List[float], N: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量计算用的滑动窗口，第i行是 (history + values)[:len(history)+i+1] 的最后N个元素
+    不足N个时左侧补0，同时返回每行实际的元素个数
+    """
+    history = list(history)[-(N-1):] if N > 1 else []
+    padded = np.zeros(N - 1 + len(values))
+    padded[N-1-len(history):N-1] = history
+    padded[N-1:] = values
+    windows = np.lib.stride_tricks.sliding_window_view(padded, N)
+    cnt = np.minimum(np.arange(len(history)+1, len(history)+1+len(values)), N)
+    return windows, cnt
+
+
+def window_mask(cnt: np.ndarray, N: int) -> np.ndarray:
+    # 每行里面哪些位置是真实数据（补的0在左边）
+    return np.arange(N)[None, :] >= (N - cnt)[:, None]
+
+
+def window_sum(windows: np.ndarray) -> np.ndarray:
+    # 按列从左到右依次累加，和逐个相加的结果完全一致（np.sum是两两求和，尾数会有差异）
+    res = np.zeros(windows.shape[0])
+    for col in range(windows.shape[1]):
+        res += windows[:, col]
+    return res
+
+
+class CRollingSum:
+    """
+    滑动窗口内 x-K 以及 (x-K)^2 的累加和，每根K线O(1)更新
+    K是锚点，每N根用最新值做锚点从头重算一次，避免长期增减带来的误差累积，同时减少方差计算时的抵消误差
+    """
+    def __init__(self, N: int):
+        self.N = N
+        self.arr: Deque[float] = deque(maxlen=N)
+        self.K = 0.0
+        self.sum1 = 0.0
+        self.sum2 = 0.0
+        self.since_refresh = N - 1  # 第一根就需要重算
+
+    def __len__(self):
+        return len(self.arr)
+
+    def refresh(self):
+        self.K = self.arr[-1]
+        self.sum1 = 0.0
+        self.sum2 = 0.0
+        for value in self.arr:
+            d = value - self.K
+            self.sum1 += d
+            self.sum2 += d * d
+        self.since_refresh = 0
+
+    def add(self, value):
+        old = self.arr[0] if len(self.arr) == self.N else None
+        self.arr.append(value)
+        self.since_refresh += 1
+        if self.since_refresh >= self.N:
+            self.refresh()
+            return
+        d = value - self.K
+        o = old - self.K if old is not None else 0.0
+        self.sum1 += d - o
+        self.sum2 += d * d - o * o
+
+    def add_batch(self, values: List[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        等价于逐个调用add，返回每一根加入后的 (窗口元素个数, K, sum1, sum2)
+        增减量用numpy一次算好，每两次重算之间用cumsum顺序累加，结果和逐个add完全一致
+        """
+        N, m, h = self.N, len(values), len(self.arr)
+        ext = np.asarray(list(self.arr) + list(values), dtype=float)
+        pos = h + np.arange(m)
+        x = ext[pos]
+        has_old = pos >= N
+        old = ext[np.where(has_old, pos - N, 0)]
+        cnt = np.minimum(pos + 1, N)
+
+        refresh_rows = np.arange(N - 1 - self.since_refresh, m, N)
+        K_lst = np.concatenate(([self.K], x[refresh_rows]))
+        K = K_lst[np.searchsorted(refresh_rows, np.arange(m), side='right')]
+        d = x - K
+        o = np.where(has_old, old - K, 0.0)
+        d1 = d - o
+        d2 = d * d - o * o
+
+        # 重算的那几根直接对整个窗口求和
+        padded = np.concatenate((np.zeros(N - 1), ext))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, N)[pos[refresh_rows]]
+        dev = np.where(window_mask(cnt[refresh_rows], N), windows - K[refresh_rows][:, None], 0.0)
+        refresh_sum1 = window_sum(dev)
+        refresh_sum2 = window_sum(dev * dev)
+
+        sum1 = np.empty(m)
+        sum2 = np.empty(m)
+        seg_begin = [0] + refresh_rows.tolist()
+        seg_end = refresh_rows.tolist() + [m]
+        start1 = [self.sum1] + refresh_sum1.tolist()
+        start2 = [self.sum2] + refresh_sum2.tolist()
+        for seg_idx, (begin, end) in enumerate(zip(seg_begin, seg_end)):
+            if seg_idx > 0:  # begin是重算的那一根
+                sum1[begin], sum2[begin] = start1[seg_idx], start2[seg_idx]
+                begin += 1
+            if begin < end:
+                sum1[begin:end] = np.cumsum(np.concatenate(([start1[seg_idx]], d1[begin:end])))[1:]
+                sum2[begin:end] = np.cumsum(np.concatenate(([start2[seg_idx]], d2[begin:end])))[1:]
+
+        if m:
+            self.arr.extend(values)
+            self.K = float(K_lst[-1])
+            self.sum1 = float(sum1[-1])
+            self.sum2 = float(sum2[-1])
+            self.since_refresh = m - 1 - int(refresh_rows[-1]) if len(refresh_rows) else self.since_refresh + m
+        return cnt, K, sum1, sum2
+
+    def snapshot(self):
+        return tuple(self.arr), self.K, self.sum1, self.sum2, self.since_refresh
+
+    def restore(self, snapshot):
+        arr, self.K, self.sum1, self.sum2, self.since_refresh = snapshot
+        self.arr = deque(arr, maxlen=self.N)
+
+
+class CRollingExtreme:
+    """
+    单调队列维护滑动窗口最大(is_max=True)/最小值，每根K线均摊O(1)
+    """
+    def __init__(self, N: int, is_max: bool):
+        self.N = N
+        self.is_max = is_max
+        self.arr: Deque[float] = deque(maxlen=N)  # 窗口原始数据，批量计算时用
+        self.queue: Deque[Tuple[int, float]] = deque()  # (序号, 值)，值单调
+        self.cnt = 0
+
+    def add(self, value) -> float:
+        self.arr.append(value)
+        if self.is_max:
+            while self.queue and self.queue[-1][1] <= value:
+                self.queue.pop()
+        else:
+            while self.queue and self.queue[-1][1] >= value:
+                self.queue.pop()
+        self.queue.append((self.cnt, value))
+        self.cnt += 1
+        if self.queue[0][0] <= self.cnt - 1 - self.N:
+            self.queue.popleft()
+        return self.queue[0][1]
+
+    def add_batch(self, values: List[float]) -> np.ndarray:
+        # 等价于逐个调用add
+        if not values:
+            return np.zeros(0)
+        windows, cnt = rolling_window(self.arr, values, self.N)
+        if self.is_max:
+            res = np.where(window_mask(cnt, self.N), windows, -np.inf).max(axis=1)
+        else:
+            res = np.where(window_mask(cnt, self.N), windows, np.inf).min(axis=1)
+        tail = (list(self.arr) + list(values))[-self.N:]
+        self.cnt += len(values) - len(tail)
+        self.arr.clear()
+        self.queue.clear()
+        for value in tail:
+            self.add(value)
+        return res
+
+    def snapshot(self):
+        return tuple(self.arr), tuple(self.queue), self.cnt
+
+    def restore(self, snapshot):
+        arr, queue, self.cnt = snapshot
+        self.arr = deque(arr, maxlen=self.N)
+        self.queue = deque(queue)
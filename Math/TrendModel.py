@@ -1,23 +1,45 @@
+from typing import List
+
 from Common.CEnum import TREND_TYPE
 from Common.ChanException import CChanException, ErrCode
 
+from .RollingWindow import CRollingExtreme, CRollingSum
+
 
 class CTrendModel:
     # 计算并更新趋势指标。
     def __init__(self, trend_type: TREND_TYPE, T: int):
         self.T = T
-        self.arr = []
         self.type = trend_type
-
-    def add(self, value) -> float:
-        self.arr.append(value)
-        if len(self.arr) > self.T:
-            self.arr = self.arr[-self.T:]
+        # 均值用滑动累加和，最大最小值用单调队列，每根都是O(1)
         if self.type == TREND_TYPE.MEAN:
-            return sum(self.arr)/len(self.arr)
-        elif self.type == TREND_TYPE.MAX:
-            return max(self.arr)
-        elif self.type == TREND_TYPE.MIN:
-            return min(self.arr)
+            self.window = CRollingSum(T)
+        elif self.type in [TREND_TYPE.MAX, TREND_TYPE.MIN]:
+            self.window = CRollingExtreme(T, is_max=self.type == TREND_TYPE.MAX)
         else:
             raise CChanException(f"Unknown trendModel Type = {self.type}", ErrCode.PARA_ERROR)
+
+    def add(self, value) -> float:
+        if self.type == TREND_TYPE.MEAN:
+            self.window.add(value)
+            return self.window.K + self.window.sum1 / len(self.window)
+        return self.window.add(value)
+
+    def add_batch(self, values: List[float]) -> List[float]:
+        # 等价于逐个调用add，用numpy一次算完
+        if not values:
+            return []
+        if self.type == TREND_TYPE.MEAN:
+            n, K, sum1, _ = self.window.add_batch(values)
+            return (K + sum1 / n).tolist()
+        return self.window.add_batch(values).tolist()
+
+    def snapshot(self):
+        return self.window.snapshot()
+
+    def restore(self, snapshot):
+        self.window.restore(snapshot)
+
+    def trim(self):
+        # 滑动窗口大小固定，没有需要裁剪的历史
+        pass
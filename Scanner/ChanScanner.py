@@ -0,0 +1,297 @@
+import multiprocessing
+import traceback
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from Chan import CChan
+from Common.CEnum import BSP_TYPE, CHAN_EVENT, KL_TYPE
+from Common.ChanException import CChanException, ErrCode
+from Common.CTime import CTime
+from KLine.KLine_Event import CChanEvent
+from KLine.KLine_Unit import CKLine_Unit
+
+BSP_EVENT = {
+    CHAN_EVENT.BSP_ADD: (False, True),  # (是否线段买卖点, 是否新增)
+    CHAN_EVENT.BSP_REMOVE: (False, False),
+    CHAN_EVENT.SEG_BSP_ADD: (True, True),
+    CHAN_EVENT.SEG_BSP_REMOVE: (True, False),
+}
+
+
+class CScanBsp:
+    # 一次更新里新出现的买卖点，只记录基本信息，可以跨进程传递
+    __slots__ = ("code", "kl_type", "is_seg_bsp", "is_buy", "types", "time", "klu_idx")
+
+    def __init__(self, code: str, kl_type: KL_TYPE, is_seg_bsp: bool, is_buy: bool, types: List[BSP_TYPE], time: CTime, klu_idx: int):
+        self.code = code
+        self.kl_type = kl_type
+        self.is_seg_bsp = is_seg_bsp
+        self.is_buy = is_buy
+        self.types = types
+        self.time = time  # 买卖点所在K线的时间
+        self.klu_idx = klu_idx
+
+    def __str__(self):
+        return f"{self.code} {self.kl_type.name} {self.time} {'seg_' if self.is_seg_bsp else ''}{'buy' if self.is_buy else 'sell'} {','.join(t.value for t in self.types)}"
+
+
+class CScanWorker:
+    """
+    管理一组常驻的 CChan，在 CChanScanner 的工作进程里运行（max_workers=0 时直接在当前进程）
+    通过 CChan.add_event_listener 收集每次 trigger_load 新出现的买卖点，不用每次对比整个买卖点列表
+    """
+    def __init__(self, make_chan: Callable[[str], CChan]):
+        self.make_chan = make_chan
+        self.chan_dict: Dict[str, CChan] = {}
+        self.pending_bsp: Dict[str, Dict[Tuple[KL_TYPE, bool, int], CScanBsp]] = {}  # 当前这次更新新出现的买卖点
+
+    def add(self, code_lst: List[str]) -> Dict[str, str]:
+        # 返回创建失败的代码及错误信息
+        errors = {}
+        for code in code_lst:
+            try:
+                chan = self.make_chan(code)
+                chan.add_event_listener(self.get_listener(code))
+            except Exception:
+                errors[code] = traceback.format_exc()
+                continue
+            self.chan_dict[code] = chan
+        return errors
+
+    def remove(self, code_lst: List[str]):
+        for code in code_lst:
+            self.chan_dict.pop(code, None)
+
+    def get_listener(self, code):
+        def listener(event: CChanEvent):
+            if event.type not in BSP_EVENT:
+                return
+            is_seg_bsp, is_add = BSP_EVENT[event.type]
+            key = (event.kl_type, is_seg_bsp, event.ele.klu.idx)
+            if is_add:
+                bsp = event.ele
+                self.pending_bsp[code][key] = CScanBsp(code, event.kl_type, is_seg_bsp, bsp.is_buy, list(bsp.type), bsp.klu.time, bsp.klu.idx)
+            else:  # 同一次更新里出现又消失的不算
+                self.pending_bsp[code].pop(key, None)
+        return listener
+
+    def update(self, inp_dict: Dict[str, Dict[KL_TYPE, List[CKLine_Unit]]], forming=False) -> Tuple[Dict[str, List[CScanBsp]], Dict[str, str]]:
+        """
+        每个代码 trigger_load 一批新K线，返回 (代码 -> 新出现的买卖点, 代码 -> 错误信息)
+        出错的代码从注册表中删除（内部状态可能已经不完整），需要重新 add
+        """
+        fresh_bsp, errors = {}, {}
+        for code, inp in inp_dict.items():
+            if code not in self.chan_dict:
+                errors[code] = f"{code}没有注册"
+                continue
+            self.pending_bsp[code] = {}
+            try:
+                self.chan_dict[code].trigger_load(inp, forming=forming)
+            except Exception:
+                errors[code] = traceback.format_exc()
+                del self.chan_dict[code]
+                continue
+            finally:
+                bsp_dict = self.pending_bsp.pop(code)
+            if bsp_dict:
+                fresh_bsp[code] = list(bsp_dict.values())
+        return fresh_bsp, errors
+
+    def get_codes(self) -> List[str]:
+        return list(self.chan_dict.keys())
+
+
+class CLocalWorker:
+    # 在当前进程里执行，和 CProcessWorker 接口一致
+    def __init__(self, make_chan: Callable[[str], CChan]):
+        self.worker = CScanWorker(make_chan)
+        self.result = None
+
+    def send(self, cmd: str, *args):
+        try:
+            self.result = (True, getattr(self.worker, cmd)(*args))
+        except Exception:
+            self.result = (False, traceback.format_exc())
+
+    def recv(self):
+        return unpack_result(self.result)
+
+    def close(self):
+        self.worker.chan_dict.clear()
+
+
+def worker_main(conn, make_chan: Callable[[str], CChan]):
+    worker = CScanWorker(make_chan)
+    while True:
+        cmd, args = conn.recv()
+        if cmd == "close":
+            break
+        try:
+            conn.send((True, getattr(worker, cmd)(*args)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+class CProcessWorker:
+    # 常驻的工作进程，CChan 一直保存在进程里，每次只传入新K线，返回新出现的买卖点
+    def __init__(self, make_chan: Callable[[str], CChan], ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child_conn, make_chan), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def send(self, cmd: str, *args):
+        self.conn.send((cmd, args))
+
+    def recv(self):
+        try:
+            result = self.conn.recv()
+        except EOFError:
+            raise CChanException(f"扫描工作进程{self.process.pid}异常退出，exitcode={self.process.exitcode}", ErrCode.COMMON_ERROR)
+        return unpack_result(result)
+
+    def close(self):
+        if self.process.is_alive():
+            self.conn.send(("close", ()))
+            self.process.join()
+        self.conn.close()
+
+
+def unpack_result(result):
+    ok, value = result
+    if not ok:
+        raise CChanException(f"扫描工作进程执行出错:\n{value}", ErrCode.COMMON_ERROR)
+    return value
+
+
+class CChanScanner:
+    """
+    多代码扫描：按代码常驻一组 CChan（每个 CChan 包含自己的 lv_list 各级别），每来一批新K线只 trigger_load 增量计算，不再每次重新读取全部历史
+    CChan 分摊到 max_workers 个常驻工作进程里，每个代码固定在一个进程，更新时各进程并行计算
+    每次 update 之后按 (级别, 买卖点类别, 买/卖) 索引这次新出现的买卖点，比如查询这根K线30分钟级别新出现二类买点的代码：
+        scanner = CChanScanner(make_chan, max_workers=8)
+        scanner.add(code_lst)
+        scanner.update({code: {KL_TYPE.K_30M: [klu]} for code, klu in new_bar.items()})
+        scanner.query(KL_TYPE.K_30M, BSP_TYPE.T2, is_buy=True)
+    make_chan(code) 返回已经读完历史的 CChan（在工作进程里调用，需要能被pickle，即模块级函数）；建议配置 retain_kl_cnt/kl_columnar 控制常驻内存
+    max_workers=0 时在当前进程里计算，可以用 get_chan 直接访问 CChan
+    """
+    def __init__(self, make_chan: Callable[[str], CChan], max_workers: Optional[int] = None, mp_context: Optional[str] = None):
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        if max_workers < 0:
+            raise CChanException(f"max_workers不能小于0，当前为{max_workers}", ErrCode.PARA_ERROR)
+        if max_workers == 0:
+            self.worker_lst = [CLocalWorker(make_chan)]
+        else:
+            ctx = multiprocessing.get_context(mp_context)
+            self.worker_lst = [CProcessWorker(make_chan, ctx) for _ in range(max_workers)]
+        self.code_worker: Dict[str, int] = {}  # 代码 -> 所在工作进程的下标
+        self.fresh_bsp: Dict[str, List[CScanBsp]] = {}  # 最近一次update每个代码新出现的买卖点
+        self.bsp_index: Dict[Tuple[KL_TYPE, bool, bool, BSP_TYPE], Set[str]] = defaultdict(set)  # (级别, 是否线段买卖点, 是否买点, 类别) -> 代码
+        self.errors: Dict[str, str] = {}  # 最近一次add/update出错的代码及错误信息，这些代码已经不在注册表里
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for worker in self.worker_lst:
+            worker.close()
+        self.worker_lst = []
+
+    def __len__(self):
+        return len(self.code_worker)
+
+    def __contains__(self, code):
+        return code in self.code_worker
+
+    def dispatch(self, cmd: str, arg_dict: Dict[int, tuple]) -> Dict[int, object]:
+        # 先给所有工作进程发命令再统一收结果，各进程并行执行
+        for worker_idx, args in arg_dict.items():
+            self.worker_lst[worker_idx].send(cmd, *args)
+        res, error = {}, None
+        for worker_idx in arg_dict:
+            try:
+                res[worker_idx] = self.worker_lst[worker_idx].recv()
+            except CChanException as e:  # 其余进程的结果也要收完，否则之后的通信会错位
+                error = error or e
+        if error is not None:
+            raise error
+        return res
+
+    def add(self, code_lst: Iterable[str]) -> Dict[str, str]:
+        # 创建并读取历史（在工作进程里并行），返回创建失败的代码及错误信息；已经注册过的代码会被忽略
+        shard_size = [0] * len(self.worker_lst)
+        for worker_idx in self.code_worker.values():
+            shard_size[worker_idx] += 1
+        shard = defaultdict(list)
+        for code in code_lst:
+            if code in self.code_worker:
+                continue
+            worker_idx = shard_size.index(min(shard_size))  # 放到代码最少的进程
+            shard[worker_idx].append(code)
+            shard_size[worker_idx] += 1
+            self.code_worker[code] = worker_idx
+        self.errors = {}
+        for errors in self.dispatch("add", {worker_idx: (codes,) for worker_idx, codes in shard.items()}).values():
+            self.errors.update(errors)
+        for code in self.errors:
+            del self.code_worker[code]
+        return self.errors
+
+    def remove(self, code_lst: Iterable[str]):
+        shard = defaultdict(list)
+        for code in code_lst:
+            if (worker_idx := self.code_worker.pop(code, None)) is not None:
+                shard[worker_idx].append(code)
+        self.dispatch("remove", {worker_idx: (codes,) for worker_idx, codes in shard.items()})
+
+    def update(self, inp_dict: Dict[str, Dict[KL_TYPE, List[CKLine_Unit]]], forming=False) -> Dict[str, List[CScanBsp]]:
+        """
+        inp_dict: 代码 -> 传给 CChan.trigger_load 的新K线；没有传入的代码这次认为没有新K线
+        返回这次新出现的买卖点（代码 -> 列表），同时更新 query 用的索引；出错的代码记录在 errors 里并从注册表中删除
+        """
+        shard = defaultdict(dict)
+        self.errors = {}
+        for code, inp in inp_dict.items():
+            if code not in self.code_worker:
+                self.errors[code] = f"{code}没有注册"
+                continue
+            shard[self.code_worker[code]][code] = inp
+        self.fresh_bsp = {}
+        for fresh_bsp, errors in self.dispatch("update", {worker_idx: (inp, forming) for worker_idx, inp in shard.items()}).values():
+            self.fresh_bsp.update(fresh_bsp)
+            self.errors.update(errors)
+        for code in self.errors:
+            self.code_worker.pop(code, None)
+
+        self.bsp_index = defaultdict(set)
+        for code, bsp_lst in self.fresh_bsp.items():
+            for bsp in bsp_lst:
+                for bsp_type in bsp.types:
+                    self.bsp_index[(bsp.kl_type, bsp.is_seg_bsp, bsp.is_buy, bsp_type)].add(code)
+        return self.fresh_bsp
+
+    def query(self, kl_type: KL_TYPE, bsp_type: Optional[BSP_TYPE] = None, is_buy: Optional[bool] = None, is_seg_bsp=False) -> List[str]:
+        # 最近一次 update 在 kl_type 级别新出现了指定类别（None为任意）买卖点的代码
+        res = set()
+        for (_kl_type, _is_seg_bsp, _is_buy, _bsp_type), codes in self.bsp_index.items():
+            if _kl_type == kl_type and _is_seg_bsp == is_seg_bsp and is_buy in (None, _is_buy) and bsp_type in (None, _bsp_type):
+                res |= codes
+        return sorted(res)
+
+    def get_codes(self) -> List[str]:
+        return list(self.code_worker.keys())
+
+    def get_chan(self, code) -> CChan:
+        # 只有 max_workers=0 时可用，其余情况 CChan 在工作进程里
+        if not isinstance(self.worker_lst[0], CLocalWorker):
+            raise CChanException("只有max_workers=0时才能直接访问CChan", ErrCode.PARA_ERROR)
+        if code not in self.code_worker:
+            raise CChanException(f"{code}没有注册", ErrCode.PARA_ERROR)
+        return self.worker_lst[0].worker.chan_dict[code]
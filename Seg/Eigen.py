@@ -4,6 +4,8 @@ from Common.CEnum import BI_DIR, FX_TYPE
 
 
 class CEigen(CKLineCombiner[CBi]):
+    __slots__ = ("gap",)
+
     def __init__(self, bi, _dir):
         super(CEigen, self).__init__(bi, _dir)
         self.gap = False
@@ -1,7 +1,7 @@
 from typing import Generic, List, Optional, Self, TypeVar
 
 from Bi.Bi import CBi
-from Common.CEnum import BI_DIR, MACD_ALGO, TREND_LINE_SIDE
+from Common.CEnum import BI_DIR, DataField, MACD_ALGO, TREND_LINE_SIDE
 from Common.ChanException import CChanException, ErrCode
 from KLine.KLine_Unit import CKLine_Unit
 from Math.TrendLine import CTrendLine
@@ -10,10 +10,23 @@ from .EigenFX import CEigenFX
 
 LINE_TYPE = TypeVar('LINE_TYPE', CBi, "CSeg")
 
+TRADE_METRIC_ALGO = {
+    MACD_ALGO.AMOUNT: (DataField.FIELD_TURNOVER, False),
+    MACD_ALGO.VOLUMN: (DataField.FIELD_VOLUME, False),
+    MACD_ALGO.VOLUMN_AVG: (DataField.FIELD_VOLUME, True),
+    MACD_ALGO.AMOUNT_AVG: (DataField.FIELD_TURNOVER, True),
+    MACD_ALGO.TURNRATE_AVG: (DataField.FIELD_TURNRATE, True),
+}
+
 
 class CSeg(Generic[LINE_TYPE]):
+    __slots__ = (
+        "idx", "start_bi", "end_bi", "is_sure", "dir", "zs_lst", "eigen_fx", "seg_idx", "parent_seg", "pre", "next", "bsp",
+        "reason", "ele_inside_is_sure", "bi_seg_idx_mark", "bi_list_cache",
+    )
+
     def __init__(self, idx: int, start_bi: LINE_TYPE, end_bi: LINE_TYPE, is_sure=True, seg_dir=None, reason="normal"):
-        assert start_bi.idx == 0 or start_bi.dir == end_bi.dir or not is_sure, f"{start_bi.idx} {end_bi.idx} {start_bi.dir} {end_bi.dir}"
+        assert start_bi.pre is None or start_bi.dir == end_bi.dir or not is_sure, f"{start_bi.idx} {end_bi.idx} {start_bi.dir} {end_bi.dir}"
         self.idx = idx
         self.start_bi = start_bi
         self.end_bi = end_bi
@@ -32,15 +45,14 @@ class CSeg(Generic[LINE_TYPE]):
         from BuySellPoint.BS_Point import CBSPoint
         self.bsp: Optional[CBSPoint] = None  # 尾部是不是买卖点
 
-        self.bi_list: List[LINE_TYPE] = []  # 仅通过self.update_bi_list来更新
         self.reason = reason
-        self.support_trend_line = None
-        self.resistance_trend_line = None
         if end_bi.idx - start_bi.idx < 2:
             self.is_sure = False
         self.check()
 
         self.ele_inside_is_sure = False
+        self.bi_seg_idx_mark = None  # 上次cal_seg标记内部笔seg_idx时的(seg_idx, start_bi, end_bi)，没变化就不用重新标记
+        self.bi_list_cache: Optional[tuple] = None  # (end_bi, bi_list)，参见 bi_list
 
     def set_seg_idx(self, idx):
         self.seg_idx = idx
@@ -109,13 +121,38 @@ class CSeg(Generic[LINE_TYPE]):
     def get_klu_cnt(self):
         return self.get_end_klu().idx - self.get_begin_klu().idx + 1
 
+    @property
+    def metric_index(self):
+        return self.start_bi.metric_index
+
+    def klu_idx_range(self):
+        return self.start_bi.klu_idx_range()[0], self.end_bi.klu_idx_range()[1]
+
     def cal_macd_metric(self, macd_algo, is_reverse):
         if macd_algo == MACD_ALGO.SLOPE:
             return self.Cal_MACD_slope()
         elif macd_algo == MACD_ALGO.AMP:
             return self.Cal_MACD_amp()
+        elif macd_algo == MACD_ALGO.FULL_AREA:
+            return self.metric_index.macd_area(*self.klu_idx_range())
+        elif macd_algo == MACD_ALGO.AREA:
+            if is_reverse:
+                return self.metric_index.macd_half(self.klu_idx_range()[0], self.get_end_klu().idx, is_reverse=True)
+            return self.metric_index.macd_half(self.get_begin_klu().idx, self.klu_idx_range()[1], is_reverse=False)
+        elif macd_algo == MACD_ALGO.PEAK:
+            return self.metric_index.macd_peak(*self.klu_idx_range(), is_down=self.is_down())
+        elif macd_algo == MACD_ALGO.DIFF:
+            return self.metric_index.macd_diff(*self.klu_idx_range())
+        elif macd_algo == MACD_ALGO.RSI:
+            return self.metric_index.rsi_metric(*self.klu_idx_range(), is_down=self.is_down())
+        elif macd_algo in TRADE_METRIC_ALGO:
+            metric, cal_avg = TRADE_METRIC_ALGO[macd_algo]
+            _s = self.metric_index.trade_metric_sum(metric, *self.klu_idx_range())
+            if _s is None:
+                return 0.0
+            return _s / self.get_klu_cnt() if cal_avg else _s
         else:
-            raise CChanException(f"unsupport macd_algo={macd_algo} of Seg, should be one of slope/amp", ErrCode.PARA_ERROR)
+            raise CChanException(f"unsupport macd_algo={macd_algo} of Seg", ErrCode.PARA_ERROR)
 
     def Cal_MACD_slope(self):
         begin_klu = self.get_begin_klu()
@@ -136,10 +173,35 @@ class CSeg(Generic[LINE_TYPE]):
     def update_bi_list(self, bi_lst, idx1, idx2):
         for bi_idx in range(idx1, idx2+1):
             bi_lst[bi_idx].parent_seg = self
-            self.bi_list.append(bi_lst[bi_idx])
-        if len(self.bi_list) >= 3:
-            self.support_trend_line = CTrendLine(self.bi_list, TREND_LINE_SIDE.INSIDE)
-            self.resistance_trend_line = CTrendLine(self.bi_list, TREND_LINE_SIDE.OUTSIDE)
+
+    @property
+    def bi_list(self) -> List[LINE_TYPE]:
+        # 线段内的所有笔，从start_bi沿着next取到end_bi；确定的线段内部的笔不会再变，按end_bi缓存（end_bi换了重新取）
+        # 不确定的线段最后几笔可能被删掉重新生成（end_bi可能已经不在笔列表里了），每次都重新取
+        if not self.is_sure:
+            return self.walk_bi_list()
+        if self.bi_list_cache is None or self.bi_list_cache[0] is not self.end_bi:
+            self.bi_list_cache = (self.end_bi, self.walk_bi_list())
+        return self.bi_list_cache[1]
+
+    def walk_bi_list(self) -> List[LINE_TYPE]:
+        res = []
+        bi = self.start_bi
+        while bi is not None and bi.idx <= self.end_bi.idx:
+            res.append(bi)
+            bi = bi.next
+        return res
+
+    @property
+    def support_trend_line(self) -> Optional[CTrendLine]:
+        # 趋势线只有画图用到，用的时候再算
+        bi_list = self.bi_list
+        return CTrendLine(bi_list, TREND_LINE_SIDE.INSIDE) if len(bi_list) >= 3 else None
+
+    @property
+    def resistance_trend_line(self) -> Optional[CTrendLine]:
+        bi_list = self.bi_list
+        return CTrendLine(bi_list, TREND_LINE_SIDE.OUTSIDE) if len(bi_list) >= 3 else None
 
     def get_first_multi_bi_zs(self):
         return next((zs for zs in self.zs_lst if not zs.is_one_bi_zs()), None)
@@ -1,10 +1,13 @@
 import abc
-from typing import Generic, List, TypeVar, Union, overload
+from typing import Generic, List, Optional, TypeVar, Union, overload
 
 from Bi.Bi import CBi
 from Bi.BiList import CBiList
+from Bi.LinePeakIndex import CLinePeakIndex
 from Common.CEnum import BI_DIR, LEFT_SEG_METHOD, SEG_TYPE
 from Common.ChanException import CChanException, ErrCode
+from Common.OffsetList import COffsetList
+from Common.SparseTable import LINEAR_SCAN_MAX
 
 from .Seg import CSeg
 from .SegConfig import CSegConfig
@@ -14,13 +17,14 @@ SUB_LINE_TYPE = TypeVar('SUB_LINE_TYPE', CBi, "CSeg")
 
 class CSegListComm(Generic[SUB_LINE_TYPE]):
     def __init__(self, seg_config=CSegConfig(), lv=SEG_TYPE.BI):
-        self.lst: List[CSeg[SUB_LINE_TYPE]] = []
+        self.lst: COffsetList[CSeg[SUB_LINE_TYPE]] = COffsetList()  # 按线段的idx访问，头部可能被裁剪
         self.lv = lv
         self.do_init()
         self.config = seg_config
+        self.peak_index = CLinePeakIndex()  # 作为线段的线段的输入时，在线段里面找最高最低点用
 
     def do_init(self):
-        self.lst = []
+        self.lst = COffsetList()
 
     def __iter__(self):
         yield from self.lst
@@ -37,11 +41,36 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
     def __len__(self):
         return len(self.lst)
 
+    def __bool__(self):
+        # 是否有保留下来的线段，同 COffsetList
+        return bool(self.lst)
+
+    @property
+    def offset(self) -> int:
+        # 第一个保留的线段的idx，头部没有被裁剪时为0
+        return self.lst.offset
+
+    def trim(self, begin_idx):
+        # 裁掉idx小于begin_idx的线段，同 CBiList.trim；begin_idx为len(self)时全部裁掉，之后的线段idx接着往后编
+        for seg in self.lst.trim(begin_idx):
+            seg.pre = None
+            seg.next = None
+            seg.parent_seg = None
+        if self.lst:
+            self.lst[begin_idx].pre = None
+        self.peak_index.trim(begin_idx)
+
     def left_bi_break(self, bi_lst: CBiList):
         # 最后一个确定线段之后的笔有突破该线段最后一笔的
-        if len(self) == 0:
+        if not self:
             return False
         last_seg_end_bi = self[-1].end_bi
+        if (peak_index := get_peak_index(bi_lst, last_seg_end_bi.idx+1)) is not None:
+            if last_seg_end_bi.is_up():
+                return peak_index.get_max_high(bi_lst, last_seg_end_bi.idx+1, len(bi_lst)-1) > last_seg_end_bi._high()
+            elif last_seg_end_bi.is_down():
+                return peak_index.get_min_low(bi_lst, last_seg_end_bi.idx+1, len(bi_lst)-1) < last_seg_end_bi._low()
+            return False
         for bi in bi_lst[last_seg_end_bi.idx+1:]:
             if last_seg_end_bi.is_up() and bi._high() > last_seg_end_bi._high():
                 return True
@@ -50,33 +79,40 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
         return False
 
     def collect_first_seg(self, bi_lst: CBiList):
-        if len(bi_lst) < 3:
+        # bi_lst头部可能被裁剪过，从第一个保留的笔开始
+        first_bi_idx = bi_lst.offset
+        if len(bi_lst) - first_bi_idx < 3:
             return
+        first_bi = bi_lst[first_bi_idx]
         if self.config.left_method == LEFT_SEG_METHOD.PEAK:
-            _high = max(bi._high() for bi in bi_lst)
-            _low = min(bi._low() for bi in bi_lst)
-            if abs(_high-bi_lst[0].get_begin_val()) >= abs(_low-bi_lst[0].get_begin_val()):
-                peak_bi = FindPeakBi(bi_lst, is_high=True)
+            if (peak_index := get_peak_index(bi_lst, first_bi_idx)) is not None:
+                _high = peak_index.get_max_high(bi_lst, first_bi_idx, len(bi_lst)-1)
+                _low = peak_index.get_min_low(bi_lst, first_bi_idx, len(bi_lst)-1)
+            else:
+                _high = max(bi._high() for bi in bi_lst)
+                _low = min(bi._low() for bi in bi_lst)
+            if abs(_high-first_bi.get_begin_val()) >= abs(_low-first_bi.get_begin_val()):
+                peak_bi = find_peak_line(bi_lst, first_bi_idx, is_high=True)
                 assert peak_bi is not None
                 self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=BI_DIR.UP, split_first_seg=False, reason="0seg_find_high")
             else:
-                peak_bi = FindPeakBi(bi_lst, is_high=False)
+                peak_bi = find_peak_line(bi_lst, first_bi_idx, is_high=False)
                 assert peak_bi is not None
                 self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=BI_DIR.DOWN, split_first_seg=False, reason="0seg_find_low")
             self.collect_left_as_seg(bi_lst)
         elif self.config.left_method == LEFT_SEG_METHOD.ALL:
-            _dir = BI_DIR.UP if bi_lst[-1].get_end_val() >= bi_lst[0].get_begin_val() else BI_DIR.DOWN
+            _dir = BI_DIR.UP if bi_lst[-1].get_end_val() >= first_bi.get_begin_val() else BI_DIR.DOWN
             self.add_new_seg(bi_lst, bi_lst[-1].idx, is_sure=False, seg_dir=_dir, split_first_seg=False, reason="0seg_collect_all")
         else:
             raise CChanException(f"unknown seg left_method = {self.config.left_method}", ErrCode.PARA_ERROR)
 
     def collect_left_seg_peak_method(self, last_seg_end_bi, bi_lst):
         if last_seg_end_bi.is_down():
-            peak_bi = FindPeakBi(bi_lst[last_seg_end_bi.idx+3:], is_high=True)
+            peak_bi = find_peak_line(bi_lst, last_seg_end_bi.idx+3, is_high=True)
             if peak_bi and peak_bi.idx - last_seg_end_bi.idx >= 3:
                 self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=BI_DIR.UP, reason="collectleft_find_high")
         else:
-            peak_bi = FindPeakBi(bi_lst[last_seg_end_bi.idx+3:], is_high=False)
+            peak_bi = find_peak_line(bi_lst, last_seg_end_bi.idx+3, is_high=False)
             if peak_bi and peak_bi.idx - last_seg_end_bi.idx >= 3:
                 self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=BI_DIR.DOWN, reason="collectleft_find_low")
         last_seg_end_bi = self[-1].end_bi
@@ -89,11 +125,11 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
         if last_bi.idx-last_seg_end_bi.idx < 3:
             return
         if last_seg_end_bi.is_down() and last_bi.get_end_val() <= last_seg_end_bi.get_end_val():
-            if peak_bi := FindPeakBi(bi_lst[last_seg_end_bi.idx+3:], is_high=True):
+            if peak_bi := find_peak_line(bi_lst, last_seg_end_bi.idx+3, is_high=True):
                 self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=BI_DIR.UP, reason="collectleft_find_high_force")
                 self.collect_left_seg(bi_lst)
         elif last_seg_end_bi.is_up() and last_bi.get_end_val() >= last_seg_end_bi.get_end_val():
-            if peak_bi := FindPeakBi(bi_lst[last_seg_end_bi.idx+3:], is_high=False):
+            if peak_bi := find_peak_line(bi_lst, last_seg_end_bi.idx+3, is_high=False):
                 self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=BI_DIR.DOWN, reason="collectleft_find_low_force")
                 self.collect_left_seg(bi_lst)
         # 剩下线段的尾部相比于最后一个线段的尾部，高低关系和最后一个虚线段的方向一致
@@ -105,7 +141,7 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
             raise CChanException(f"unknown seg left_method = {self.config.left_method}", ErrCode.PARA_ERROR)
 
     def collect_left_seg(self, bi_lst: CBiList):
-        if len(self) == 0:
+        if not self:
             self.collect_first_seg(bi_lst)
         else:
             self.collect_segs(bi_lst)
@@ -121,19 +157,21 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
             self.add_new_seg(bi_lst, last_bi.idx, is_sure=False, reason="collect_left_0")
 
     def try_add_new_seg(self, bi_lst, end_bi_idx: int, is_sure=True, seg_dir=None, split_first_seg=True, reason="normal"):
-        if len(self) == 0 and split_first_seg and end_bi_idx >= 3:
+        first_bi_idx = bi_lst.offset
+        if not self and split_first_seg and end_bi_idx - first_bi_idx >= 3:
             if peak_bi := FindPeakBi(bi_lst[end_bi_idx-3::-1], bi_lst[end_bi_idx].is_down()):
-                if (peak_bi.is_down() and (peak_bi._low() < bi_lst[0]._low() or peak_bi.idx == 0)) or \
-                   (peak_bi.is_up() and (peak_bi._high() > bi_lst[0]._high() or peak_bi.idx == 0)):  # 要比第一笔开头还高/低（因为没有比较到）
+                first_bi = bi_lst[first_bi_idx]
+                if (peak_bi.is_down() and (peak_bi._low() < first_bi._low() or peak_bi is first_bi)) or \
+                   (peak_bi.is_up() and (peak_bi._high() > first_bi._high() or peak_bi is first_bi)):  # 要比第一笔开头还高/低（因为没有比较到）
                     self.add_new_seg(bi_lst, peak_bi.idx, is_sure=False, seg_dir=peak_bi.dir, reason="split_first_1st")
                     self.add_new_seg(bi_lst, end_bi_idx, is_sure=False, reason="split_first_2nd")
                     return
-        bi1_idx = 0 if len(self) == 0 else self[-1].end_bi.idx+1
+        bi1_idx = first_bi_idx if not self else self[-1].end_bi.idx+1
         bi1 = bi_lst[bi1_idx]
         bi2 = bi_lst[end_bi_idx]
         self.lst.append(CSeg(len(self.lst), bi1, bi2, is_sure=is_sure, seg_dir=seg_dir, reason=reason))
 
-        if len(self.lst) >= 2:
+        if len(self.lst) - self.offset >= 2:
             self.lst[-2].next = self.lst[-1]
             self.lst[-1].pre = self.lst[-2]
         self.lst[-1].update_bi_list(bi_lst, bi1_idx, end_bi_idx)
@@ -142,7 +180,7 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
         try:
             self.try_add_new_seg(bi_lst, end_bi_idx, is_sure, seg_dir, split_first_seg, reason)
         except CChanException as e:
-            if e.errcode == ErrCode.SEG_END_VALUE_ERR and len(self.lst) == 0:
+            if e.errcode == ErrCode.SEG_END_VALUE_ERR and not self:
                 return False
             raise e
         except Exception as e:
@@ -154,7 +192,7 @@ class CSegListComm(Generic[SUB_LINE_TYPE]):
         ...
 
     def exist_sure_seg(self):
-        return any(seg.is_sure for seg in self.lst)
+        return any(seg.is_sure for seg in reversed(self.lst))
 
 
 def FindPeakBi(bi_lst: Union[CBiList, List[CBi]], is_high):
@@ -167,3 +205,19 @@ def FindPeakBi(bi_lst: Union[CBiList, List[CBi]], is_high):
             peak_val = bi.get_end_val()
             peak_bi = bi
     return peak_bi
+
+
+def get_peak_index(bi_lst, begin_idx) -> Optional[CLinePeakIndex]:
+    # bi_lst[begin_idx:] 比较长时才用区间极值索引，短的直接遍历更快
+    if len(bi_lst) - begin_idx <= LINEAR_SCAN_MAX:
+        return None
+    return getattr(bi_lst, "peak_index", None)
+
+
+def find_peak_line(bi_lst: Union[CBiList, List[CBi]], begin_idx, is_high):
+    # 等价于 FindPeakBi(bi_lst[begin_idx:], is_high)
+    if begin_idx >= len(bi_lst):
+        return None
+    if (peak_index := get_peak_index(bi_lst, begin_idx)) is not None:
+        return peak_index.find_peak(bi_lst, begin_idx, len(bi_lst)-1, is_high)
+    return FindPeakBi(bi_lst[begin_idx:], is_high)
@@ -18,10 +18,9 @@ class Eg:
         self.hold_quantity = 0  # 持股数
 
     def execute(self, chan: Chan = None):
-        bsp_list = chan.get_bsp()  # 获取买卖点列表
-        if not bsp_list:  # 为空
+        last_bsp = chan.get_latest_bsp()  # 最后一个买卖点
+        if last_bsp is None:  # 还没有买卖点
             return False
-        last_bsp = bsp_list[-1]  # 最后一个买卖点
         # if BSP_TYPE.T1 not in last_bsp.type and BSP_TYPE.T1P not in last_bsp.type:  # 假如只做1类买卖点
         #     return False
 
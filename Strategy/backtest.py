@@ -1,7 +1,13 @@
 import importlib
 import json
 import os
+import signal
 import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from queue import Empty
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
 from Chan import CChan
 from ChanConfig import CChanConfig
@@ -58,7 +64,7 @@ class Backtest:
     def __init__(self, config):
         self.config = config
 
-    def run_backtest(self, plot=False):
+    def run_backtest(self, plot=False) -> dict:
         # 根据配置的策略名称执行策略
         strategy_name = self.config.get('strategy')
         strategy_class = self._get_strategy_class(strategy_name)
@@ -81,7 +87,7 @@ class Backtest:
             strategy.execute(chan=chan_snapshot)
 
         # 分析回测结果
-        self._analyze_backtest_result(strategy.get_result())
+        result = self._analyze_backtest_result(strategy.get_result())
 
         if plot:
             # 画图
@@ -94,6 +100,7 @@ class Backtest:
 
             plot_driver.figure.show()
             plot_driver.save2img(f"/Users/paopao/Documents/chan_plot/{self.config['code']}.jpg")
+        return result
 
     def _get_strategy_class(self, strategy_name):
         module_name = 'Strategy.' + strategy_name
@@ -109,11 +116,13 @@ class Backtest:
         # 分析回测结果的逻辑，生成回测报告
         result['code'] = self.config['code']
         print(json.dumps(result, ensure_ascii=False))
-        write_file(f"/Users/paopao/backtext.txt", json.dumps(result, ensure_ascii=False) + '\n', mode='a')
+        if result_file := self.config.get('result_file'):
+            write_file(result_file, json.dumps(result, ensure_ascii=False) + '\n', mode='a')
+        return result
 
 
-def run_one(code):
-    backtest_conf = {
+def make_backtest_conf(code):
+    return {
         "code": f"sz.{code}",
         "begin_time": "2022-07-24",
         "end_time": "2024-07-24",
@@ -126,21 +135,98 @@ def run_one(code):
         }),
         'strategy': 'Eg',
     }
+
+
+def run_one(code):
     try:
-        b = Backtest(backtest_conf)
+        b = Backtest(make_backtest_conf(code))
         b.run_backtest()
     except Exception as e:
         return
 
 
+class CBacktestTimeout(BaseException):
+    # 在SIGALRM处理函数里抛出，和KeyboardInterrupt一样不继承Exception，避免被回测过程中的 except Exception（如数据源失败时改用缓存）吞掉
+    pass
+
+
+def _on_timeout(signum, frame):
+    raise CBacktestTimeout()
+
+
+def _run_chunk(codes: List[str], make_conf: Callable[[str], dict], timeout: Optional[float], queue):
+    # 子进程中执行：逐个回测，每完成一个就把结果放进队列，单个股票出错不影响后续股票
+    use_alarm = timeout is not None and hasattr(signal, "SIGALRM")  # windows下没有SIGALRM，不限制单个股票的耗时
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+    for code in codes:
+        start = time.time()
+        item = {'code': code, 'result': None, 'error': None}
+        try:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            item['result'] = Backtest(make_conf(code)).run_backtest()
+        except CBacktestTimeout:
+            item['error'] = f"timeout after {timeout}s"
+        except Exception:
+            item['error'] = traceback.format_exc()
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        item['cost'] = time.time() - start
+        queue.put(item)
+
+
+class CParallelBacktest:
+    """
+    多进程批量回测，每个子进程一次领取chunk_size个股票
+    结果通过队列实时返回，格式为 {'code', 'result', 'error', 'cost'}，出错或超时的股票 result 为 None，error 为错误信息
+    """
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        chunk_size: int = 1,
+        timeout: Optional[float] = None,
+        make_conf: Callable[[str], dict] = make_backtest_conf,
+    ):
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.timeout = timeout  # 单个股票的最长回测时间（秒），None表示不限制
+        self.make_conf = make_conf  # code -> Backtest 配置，需要能被pickle（模块级函数）
+
+    def run(self, codes: Iterable[str]) -> Iterator[Dict]:
+        codes = list(codes)
+        chunks = [codes[i:i+self.chunk_size] for i in range(0, len(codes), self.chunk_size)]
+        finished = set()
+        with Manager() as manager, ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            queue = manager.Queue()
+            futures = {executor.submit(_run_chunk, chunk, self.make_conf, self.timeout, queue): chunk for chunk in chunks}
+            while len(finished) < len(codes):
+                try:
+                    item = queue.get(timeout=1)
+                except Empty:
+                    if all(future.done() for future in futures):  # 子进程异常退出，队列里不会再有结果
+                        break
+                    continue
+                finished.add(item['code'])
+                yield item
+            # 子进程崩溃（比如被kill，内存不足）导致没有返回结果的股票
+            for future, chunk in futures.items():
+                error = future.exception() if future.done() else None
+                for code in chunk:
+                    if code not in finished:
+                        finished.add(code)
+                        yield {'code': code, 'result': None, 'error': repr(error), 'cost': None}
+
+
 if __name__ == "__main__":
     # run_one('300671')
 
-    for line in open(f'{WORK_DIR}/sz.txt', 'r'):
-        code = line.strip()
-        print(code)
-        run_one(code)
-        time.sleep(0.5)
-
-    # exit(0)
+    result_file = f'{WORK_DIR}/backtest_result.txt'
+    code_lst = [line.strip() for line in open(f'{WORK_DIR}/sz.txt', 'r') if line.strip()]
+    for item in CParallelBacktest(chunk_size=4, timeout=600).run(code_lst):
+        if item['error'] is not None:
+            print(f"{item['code']} 回测失败: {item['error']}")
+            continue
+        write_file(result_file, json.dumps(item['result'], ensure_ascii=False) + '\n', mode='a')
 
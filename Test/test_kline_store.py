@@ -0,0 +1,67 @@
+import copy
+import unittest
+
+from Chan import CChan
+from ChanConfig import CChanConfig
+from Common.CEnum import KL_TYPE
+from DataAPI.SyntheticAPI import CSyntheticAPI
+
+
+def chan_signature(chan: CChan):
+    kl_list = chan[0]
+    return (
+        kl_list.lst.offset,
+        [(klu.idx, str(klu.time), klu.close, klu.macd.macd) for klu in kl_list.klu_iter()],
+        [str(bi) for bi in kl_list.bi_list],
+        [str(seg) for seg in kl_list.seg_list],
+        [(bsp.klu.idx, bsp.type2str()) for bsp in kl_list.bs_point_lst],
+    )
+
+
+class TestRetainColumnarDeepcopy(unittest.TestCase):
+    # 列式存储 + retain_kl_cnt 时，deepcopy 之后继续 trigger_load 要能正常裁剪，结果和不拷贝一致
+    code = "rw:3:1200"
+
+    def new_chan(self) -> CChan:
+        config = CChanConfig({"trigger_step": True, "retain_kl_cnt": 150, "retain_kl_max": 400, "kl_columnar": True, "print_warning": False})
+        return CChan(self.code, data_src="custom:SyntheticAPI.CSyntheticAPI", lv_list=[KL_TYPE.K_DAY], config=config)
+
+    def test_deepcopy_then_trim(self):
+        klu_lst = list(CSyntheticAPI(self.code, k_type=KL_TYPE.K_DAY).get_kl_data())
+        ref, chan = self.new_chan(), self.new_chan()
+        for klu in klu_lst[:len(klu_lst)//2]:
+            ref.trigger_load({KL_TYPE.K_DAY: [klu]})
+            chan.trigger_load({KL_TYPE.K_DAY: [klu]})
+        chan_copy = copy.deepcopy(chan)
+        self.assertIsNot(chan_copy[0].kl_store, chan[0].kl_store)
+        for klu in klu_lst[len(klu_lst)//2:]:
+            ref.trigger_load({KL_TYPE.K_DAY: [klu]})
+            chan.trigger_load({KL_TYPE.K_DAY: [klu]})
+            chan_copy.trigger_load({KL_TYPE.K_DAY: [klu]})
+        self.assertGreater(chan_copy[0].lst.offset, 0)
+        self.assertEqual(chan_signature(chan_copy), chan_signature(ref))
+        self.assertEqual(chan_signature(chan), chan_signature(ref))
+
+
+class TestUnitViewReadOnly(unittest.TestCase):
+    # 列式存储的K线视图：time缓存在视图上，其余现读的副本不能修改，避免改了却没有写回存储
+    def test_read_only(self):
+        config = CChanConfig({"kl_columnar": True, "cal_kdj": True, "trend_metrics": [5], "print_warning": False})
+        chan = CChan("rw:1:300", data_src="custom:SyntheticAPI.CSyntheticAPI", lv_list=[KL_TYPE.K_DAY], config=config)
+        klu = chan[0][-1][-1]
+        self.assertIs(klu.time, klu.time)
+        with self.assertRaises(AttributeError):
+            klu.macd.macd = 0
+        with self.assertRaises(AttributeError):
+            klu.kdj.k = 0
+        with self.assertRaises(TypeError):
+            klu.trade_info.metric["volume"] = 0
+        with self.assertRaises(TypeError):
+            next(iter(klu.trend.values()))[5] = 0
+        macd = copy.deepcopy(klu.macd)  # 拷贝出来的是普通对象，可以修改
+        macd.macd = 0
+        self.assertEqual(macd.macd, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
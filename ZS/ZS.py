@@ -2,6 +2,7 @@ from typing import Generic, List, Optional, TypeVar
 
 from Bi.Bi import CBi
 from BuySellPoint.BSPointConfig import CPointConfig
+from Common.cache import cache_slots, new_cache_gen
 from Common.ChanException import CChanException, ErrCode
 from Common.func_util import has_overlap
 from KLine.KLine_Unit import CKLine_Unit
@@ -11,6 +12,11 @@ LINE_TYPE = TypeVar('LINE_TYPE', CBi, "CSeg")
 
 
 class CZS(Generic[LINE_TYPE]):
+    __slots__ = (
+        "__is_sure", "__sub_zs_lst", "__begin", "__begin_bi", "__low", "__high", "__mid", "__end", "__end_bi",
+        "__peak_high", "__peak_low", "__bi_in", "__bi_out", "__bi_lst",
+    ) + cache_slots()
+
     def __init__(self, lst: Optional[List[LINE_TYPE]], is_sure=True):
         # begin/end：永远指向 klu
         # low/high: 中枢的范围
@@ -42,7 +48,7 @@ class CZS(Generic[LINE_TYPE]):
         self.__bi_lst: List[LINE_TYPE] = []  # begin_bi~end_bi之间的笔，在update_zs_in_seg函数中更新
 
     def clean_cache(self):
-        self._memoize_cache = {}
+        self._cache_gen = new_cache_gen()
 
     @property
     def is_sure(self): return self.__is_sure
@@ -21,7 +21,7 @@ class CZSList:
 
     def update_last_pos(self, seg_list: CSegListComm):
         self.last_sure_pos = -1
-        for seg in seg_list[::-1]:
+        for seg in reversed(seg_list):
             if seg.is_sure:
                 self.last_sure_pos = seg.start_bi.idx
                 return
@@ -29,13 +29,37 @@ class CZSList:
     def seg_need_cal(self, seg: CSeg):
         return seg.start_bi.idx >= self.last_sure_pos
 
+    def first_need_cal_seg_idx(self, seg_list: CSegListComm) -> int:
+        # 线段的start_bi是递增的，需要计算的一定是尾部那几个线段
+        seg_idx = len(seg_list)
+        while seg_idx > seg_list.offset and self.seg_need_cal(seg_list[seg_idx-1]):
+            seg_idx -= 1
+        return seg_idx
+
+    def can_trim(self, begin_bi_idx, update_klu_idx) -> bool:
+        # 跨过裁剪位置的中枢（包括bi_in，zs_algo=over_seg时中枢会跨线段）如果结束在update_klu_idx之后，
+        # 之后update_zs_in_seg还会重新设置它的bi_in等属性，需要访问裁掉的笔，这时不能裁剪
+        for zs in self.zs_lst:
+            if zs.begin_bi.idx > begin_bi_idx:
+                break
+            if zs.end_bi.idx >= begin_bi_idx and zs.end.idx >= update_klu_idx:
+                return False
+        return True
+
+    def trim(self, begin_bi_idx):
+        # 裁掉结束在begin_bi_idx之前的中枢
+        trim_cnt = 0
+        while trim_cnt < len(self.zs_lst) and self.zs_lst[trim_cnt].end_bi.idx < begin_bi_idx:
+            trim_cnt += 1
+        del self.zs_lst[:trim_cnt]
+
     def add_to_free_lst(self, item, is_sure, zs_algo):
         if len(self.free_item_lst) != 0 and item.idx == self.free_item_lst[-1].idx:
             # 防止笔新高或新低的更新带来bug
             self.free_item_lst = self.free_item_lst[:-1]
         self.free_item_lst.append(item)
         res = self.try_construct_zs(self.free_item_lst, is_sure, zs_algo)  # 可能是一笔中枢
-        if res is not None and res.begin_bi.idx > 0:  # 禁止第一笔就是中枢的起点
+        if res is not None and res.begin_bi.pre is not None:  # 禁止第一笔（头部被裁剪时为第一个保留的笔）就是中枢的起点
             self.zs_lst.append(res)
             self.clear_free_lst()
             self.try_combine()
@@ -92,15 +116,13 @@ class CZSList:
         while self.zs_lst and self.zs_lst[-1].begin_bi.idx >= self.last_sure_pos:
             self.zs_lst.pop()
         if self.config.zs_algo == "normal":
-            for seg in seg_lst:
-                if not self.seg_need_cal(seg):
-                    continue
+            for seg in seg_lst[self.first_need_cal_seg_idx(seg_lst):]:
                 self.clear_free_lst()
                 seg_bi_lst = bi_lst[seg.start_bi.idx:seg.end_bi.idx+1]
                 self.add_zs_from_bi_range(seg_bi_lst, seg.dir, seg.is_sure)
 
             # 处理未生成新线段的部分
-            if len(seg_lst):
+            if seg_lst:
                 self.clear_free_lst()
                 self.add_zs_from_bi_range(bi_lst[seg_lst[-1].end_bi.idx+1:], revert_bi_dir(seg_lst[-1].dir), False)
         elif self.config.zs_algo == "over_seg":
@@ -158,4 +180,4 @@ class CZSList:
         if not self.config.need_combine:
             return
         while len(self.zs_lst) >= 2 and self.zs_lst[-2].combine(self.zs_lst[-1], combine_mode=self.config.zs_combine_mode):
-            self.zs_lst = self.zs_lst[:-1]  # 合并后删除最后一个
+            self.zs_lst.pop()  # 合并后删除最后一个